@@ -1,10 +1,33 @@
-from flask import Flask, render_template, request, redirect, session, jsonify, flash
+from flask import Flask, render_template, request, redirect, session, jsonify, flash, g, make_response
 from markupsafe import Markup
-import sqlite3, os, uuid, re
+import sqlite3, os, uuid, re, threading
+import click
+import json
+import zlib
+import tasks
+import cache
+import compression
+import tag_index
+import social_graph
+import exports
+import wallet_service
+import ledger
+import transfers
 from datetime import timedelta
+from jinja2 import FileSystemBytecodeCache
 from werkzeug.security import generate_password_hash, check_password_hash
 # from flask_socketio import SocketIO, emit, join_room  # Disabled for deployment
-# import storage  # Storage integration (Supabase or local) - DISABLED: causes Python 3.14 incompatibility
+# Storage integration (Supabase or local). Guarded: the Supabase client breaks on Python 3.14
+# Faster JSON for the v1 API when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import storage
+except Exception as e:
+    storage = None
+    print(f"⚠️  Storage module unavailable - serving files from static/: {e}")
 # import email_service  # Email sending service - DISABLED: requires email_config.py
 # import db_schema  # Database schema - disabled, using SQLite only
 
@@ -25,28 +48,42 @@ ADMIN_EMAIL = "ho.swag@mail.ru"
 # Jinja filter for file URLs (Supabase or local)
 @app.template_filter('file_url')
 def file_url_filter(path):
-    """Convert file path to proper URL (just return path as-is for local static/)"""
+    """Convert file path to proper URL (Supabase public/signed URL or local static/)"""
     if not path:
         return None
-    # Assume path is already in /static/... format
-    return path if path.startswith('/') else f'/static/{path}'
+    # Already a URL or /static/... path
+    if path.startswith('/') or '://' in path:
+        return path
+    if storage is not None:
+        return storage.get_file_url(path)
+    return f'/static/{path}'
 
 # Register the filter
 app.jinja_env.filters['file_url'] = file_url_filter
 
+# Compiled templates persist across restarts so new workers skip Jinja parsing
+JINJA_CACHE_DIR = os.environ.get("JINJA_CACHE_DIR", os.path.join(app.root_path, ".jinja_cache"))
+try:
+    os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+except OSError as e:
+    print(f"⚠️  Jinja bytecode cache disabled: {e}")
+
 # -----------------------
-# Local File Upload Helper
+# File Upload Helper
 # -----------------------
 def save_upload_file(file, folder_name):
-    """Save uploaded file to local static folder"""
+    """Save an uploaded file to the `folder_name` bucket (Supabase or local static folder)"""
     if not file or not file.filename:
         return None
+    if storage is not None:
+        return storage.upload_file(file, folder_name)
     
     import os
     from werkzeug.utils import secure_filename
     
     filename = secure_filename(file.filename)
-    # Add timestamp to avoid collisions
+    # Add a random prefix to avoid collisions
     filename = f"{uuid.uuid4().hex}_{filename}"
     
     folder_path = os.path.join("static", folder_name)
@@ -58,9 +95,69 @@ def save_upload_file(file, folder_name):
     # Return relative path for URL
     return f"{folder_name}/{filename}"
 
+def delete_upload_file(path):
+    """Delete a file saved by save_upload_file (Supabase or local static folder)"""
+    if not path:
+        return False
+    if storage is not None:
+        return storage.delete_file(path, path.split('/', 1)[0])
+    try:
+        os.remove(os.path.join("static", path))
+        return True
+    except OSError:
+        return False
+
 # -----------------------
 # Notification Counts Context Processor
 # -----------------------
+def get_notification_counts(user_id):
+    """Unread messages, pending friend requests and new followers for the nav bar (memoized per request)"""
+    counts = g.get('notification_counts')
+    if counts is not None:
+        return counts
+
+    conn = get_db_connection()
+
+    # Count unread messages
+    try:
+        unread_messages = conn.execute("""
+            SELECT COUNT(*) as count FROM messages 
+            WHERE receiver_id=? AND is_read=0
+        """, (user_id,)).fetchone()
+        unread_messages_count = unread_messages['count'] if unread_messages else 0
+    except sqlite3.OperationalError:
+        # Column might not exist yet during database migration
+        unread_messages_count = 0
+
+    # Count pending friend requests (received, not sent)
+    try:
+        friend_requests_count = social_graph.user_graph(conn, user_id).incoming_request_count()
+    except sqlite3.OperationalError:
+        friend_requests_count = 0
+
+    # Count new followers (last 7 days) - only for users with subscription
+    new_followers_count = 0
+    try:
+        user = conn.execute("SELECT subscription FROM users WHERE id=?", (user_id,)).fetchone()
+        if user and user['subscription'] in ['basic', 'pro', 'premium']:
+            new_followers = conn.execute("""
+                SELECT COUNT(*) as count FROM followers 
+                WHERE following_id=? AND created_at >= datetime('now', '-7 days')
+            """, (user_id,)).fetchone()
+            new_followers_count = new_followers['count'] if new_followers else 0
+    except:
+        pass
+
+    conn.close()
+
+    counts = dict(
+        unread_messages_count=unread_messages_count,
+        friend_requests_count=friend_requests_count,
+        new_followers_count=new_followers_count
+    )
+    g.notification_counts = counts
+    return counts
+
 @app.context_processor
 def inject_notifications():
     """Make notification counts available to all templates"""
@@ -71,52 +168,8 @@ def inject_notifications():
             new_followers_count=0
         )
     
-    user_id = session['user_id']
-    
     try:
-        conn = get_db_connection()
-        
-        # Count unread messages
-        try:
-            unread_messages = conn.execute("""
-                SELECT COUNT(*) as count FROM messages 
-                WHERE receiver_id=? AND is_read=0
-            """, (user_id,)).fetchone()
-            unread_messages_count = unread_messages['count'] if unread_messages else 0
-        except sqlite3.OperationalError:
-            # Column might not exist yet during database migration
-            unread_messages_count = 0
-        
-        # Count pending friend requests (received, not sent)
-        try:
-            friend_requests = conn.execute("""
-                SELECT COUNT(*) as count FROM friendships 
-                WHERE friend_id=? AND status='pending'
-            """, (user_id,)).fetchone()
-            friend_requests_count = friend_requests['count'] if friend_requests else 0
-        except sqlite3.OperationalError:
-            friend_requests_count = 0
-        
-        # Count new followers (last 7 days) - only for users with subscription
-        new_followers_count = 0
-        try:
-            user = conn.execute("SELECT subscription FROM users WHERE id=?", (user_id,)).fetchone()
-            if user and user['subscription'] in ['basic', 'pro', 'premium']:
-                new_followers = conn.execute("""
-                    SELECT COUNT(*) as count FROM followers 
-                    WHERE following_id=? AND created_at >= datetime('now', '-7 days')
-                """, (user_id,)).fetchone()
-                new_followers_count = new_followers['count'] if new_followers else 0
-        except:
-            pass
-        
-        conn.close()
-        
-        return dict(
-            unread_messages_count=unread_messages_count,
-            friend_requests_count=friend_requests_count,
-            new_followers_count=new_followers_count
-        )
+        return get_notification_counts(session['user_id'])
     except Exception as e:
         print(f"⚠️  Error in inject_notifications: {e}")
         return dict(
@@ -129,14 +182,23 @@ def inject_notifications():
 # Online Status Tracking
 # -----------------------
 def update_user_activity(user_id):
-    """Update user's last_activity timestamp"""
+    """
+    Update user's last_activity timestamp
+
+    Returns:
+        bool: False if the account is retired or gone (the session must end)
+    """
     try:
         conn = get_db_connection()
-        conn.execute("UPDATE users SET last_activity=CURRENT_TIMESTAMP WHERE id=?", (user_id,))
+        updated = conn.execute(
+            "UPDATE users SET last_activity=CURRENT_TIMESTAMP WHERE id=? AND NOT retired", (user_id,)
+        ).rowcount
         conn.commit()
         conn.close()
+        return updated > 0
     except:
-        pass
+        # A busy database must not sign anyone out
+        return True
 
 def is_user_online(user_id):
     """Check if user is online (active in last 5 minutes)"""
@@ -152,15 +214,22 @@ def is_user_online(user_id):
         """, (user_id,)).fetchone()
         conn.close()
         
-        if not user or not user['last_activity']:
+        if not user:
             return False
-        
-        from datetime import datetime, timedelta
-        last_activity = datetime.fromisoformat(user['last_activity'])
-        return datetime.now() - last_activity < timedelta(minutes=5)
+        return is_recently_active(user['last_activity'])
     except Exception as e:
         return False
 
+def is_recently_active(last_activity):
+    """True if a users.last_activity value is within the last 5 minutes"""
+    if not last_activity:
+        return False
+    try:
+        from datetime import datetime, timedelta
+        return datetime.now() - datetime.fromisoformat(last_activity) < timedelta(minutes=5)
+    except (TypeError, ValueError):
+        return False
+
 # Jinja filter for online status
 @app.template_filter('online_status')
 def online_status_filter(user_id):
@@ -180,6 +249,29 @@ def online_status_filter(user_id):
 # Register online filter
 app.jinja_env.filters['online_status'] = online_status_filter
 
+ONLINE_BADGE = '<span class="online-badge" title="Online">●</span>'
+
+@app.template_filter('online_slot')
+def online_slot_filter(user_id):
+    """Placeholder for an online badge inside cached fragments (see fill_fragment)"""
+    try:
+        return Markup(f'<!--online:{int(user_id)}-->') if user_id else Markup('')
+    except (ValueError, TypeError):
+        return Markup('')
+
+def get_online_user_ids(conn, user_ids):
+    """Return the subset of user_ids active in the last 5 minutes (one query)"""
+    user_ids = list(user_ids)
+    online = set()
+    for i in range(0, len(user_ids), 500):
+        chunk = user_ids[i:i + 500]
+        placeholders = ','.join('?' for _ in chunk)
+        online.update(row[0] for row in conn.execute(f"""
+            SELECT id FROM users
+            WHERE id IN ({placeholders}) AND last_activity >= datetime('now', '-5 minutes')
+        """, chunk))
+    return online
+
 # Linkify filter - convert URLs to clickable links
 @app.template_filter('linkify')
 def linkify_filter(text):
@@ -207,12 +299,143 @@ def linkify_filter(text):
 
 app.jinja_env.filters['linkify'] = linkify_filter
 
+@app.template_filter('duration')
+def duration_filter(seconds):
+    """Format a track length in seconds as m:ss"""
+    if not seconds:
+        return ''
+    seconds = int(round(seconds))
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+@app.template_filter('waveform_svg')
+def waveform_svg_filter(waveform):
+    """Render a stored waveform (JSON list of 0..1 bars) as a small inline SVG"""
+    if not waveform:
+        return Markup('')
+    try:
+        bars = json.loads(waveform) if isinstance(waveform, str) else waveform
+    except ValueError:
+        return Markup('')
+    if not bars:
+        return Markup('')
+    rects = ''.join(
+        f'<rect x="{i * 3}" y="{(1 - float(b)) * 12:.1f}" width="2" height="{max(float(b), 0.04) * 24:.1f}" rx="1"/>'
+        for i, b in enumerate(bars)
+    )
+    return Markup(
+        f'<svg class="waveform" viewBox="0 0 {len(bars) * 3} 24" preserveAspectRatio="none" '
+        f'style="width:100%;height:24px;fill:#667eea;opacity:.6;">{rects}</svg>'
+    )
+
+# -----------------------
+# Startup (deferred, one-time bootstrap)
+# -----------------------
+try:
+    import fcntl
+except ImportError:  # Windows: single-process dev server only
+    fcntl = None
+
+# Load every template at boot instead of on its first request
+PRECOMPILE_TEMPLATES = os.environ.get("PRECOMPILE_TEMPLATES") == "1"
+
+_bootstrapped = False
+_bootstrap_lock = threading.Lock()
+
+def precompile_templates():
+    """Compile all templates into the in-memory (and bytecode) cache"""
+    names = app.jinja_env.list_templates(extensions=["html"])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+def bootstrap(precompile=None):
+    """
+    One-time setup that used to run at import: upload folders, schema
+    migrations and (optionally) template precompilation.
+
+    create_tables() only runs when users.db was last migrated by a different
+    version of it; the first worker to notice takes a file lock and migrates
+    while the others wait, then everyone takes the fast path.
+    """
+    global _bootstrapped
+    if _bootstrapped:
+        return
+    with _bootstrap_lock:
+        if _bootstrapped:
+            return
+
+        for folder in [AVATAR_FOLDER, UPLOAD_FOLDER, STORY_FOLDER, MUSIC_FOLDER, PRODUCT_FOLDER]:
+            os.makedirs(folder, exist_ok=True)
+
+        fingerprint = schema_fingerprint()
+        if current_schema_version() != fingerprint:
+            with open("users.db.lock", "w") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                # Another worker may have migrated while we waited for the lock
+                if current_schema_version() != fingerprint:
+                    try:
+                        create_tables()
+                        conn = get_db_connection()
+                        conn.execute(f"PRAGMA user_version = {fingerprint}")
+                        conn.close()
+                        print("✅ Database tables created successfully")
+                    except Exception as e:
+                        print(f"❌ Error creating database tables: {e}")
+                        import traceback
+                        traceback.print_exc()
+
+        # Transfers queued before a restart would otherwise wait for the next send
+        try:
+            conn = get_db_connection()
+            try:
+                queued = conn.execute(
+                    "SELECT 1 FROM pending_transfers WHERE status = 'pending' LIMIT 1"
+                ).fetchone()
+            finally:
+                conn.close()
+            if queued:
+                schedule_settlement()
+        except sqlite3.Error as e:
+            print(f"⚠️  Could not check the transfer queue: {e}")
+
+        if precompile is None:
+            precompile = PRECOMPILE_TEMPLATES
+        if precompile:
+            precompile_templates()
+
+        _bootstrapped = True
+
+@app.before_request
+def ensure_bootstrapped():
+    bootstrap()
+
 # Track user activity
 @app.before_request
 def track_activity():
     """Update user's last_activity on each request"""
     if "user_id" in session:
-        update_user_activity(session["user_id"])
+        if not update_user_activity(session["user_id"]):
+            # The account was deleted: its other signed-in sessions end here
+            session.clear()
+            if request.path.startswith("/api/"):
+                return jsonify({'error': 'Not authenticated'}), 401
+            return redirect("/login")
+
+# -----------------------
+# Response compression
+# -----------------------
+@app.after_request
+def compress_response(response):
+    """gzip/brotli-encode HTML and JSON for clients that accept it"""
+    return compression.compress_response(response, request)
+
+def send_static(filename):
+    """Static files, preferring the .br/.gz variants written by `python compression.py static`"""
+    return (compression.send_precompressed(app.static_folder, filename, request)
+            or app.send_static_file(filename))
+
+app.view_functions['static'] = send_static
 
 # -----------------------
 # Delete profile post
@@ -226,6 +449,8 @@ def delete_profile_post(post_id):
         "DELETE FROM profile_posts WHERE id=? AND user_id=?",
         (post_id, session["user_id"])
     )
+    unindex_media(conn, 'post', post_id, session["user_id"])
+    bump_user_version(conn, session["user_id"])
     conn.commit()
     conn.close()
     
@@ -235,8 +460,184 @@ def delete_profile_post(post_id):
         return redirect("/photos")
     return redirect("/profile")
 
+# -----------------------
+# Download my data (streamed zip of everything stored about the user)
+@app.route("/account/export")
+def export_account():
+    if "user_id" not in session:
+        return redirect("/login")
+
+    body = exports.user_archive(get_db_connection, session["user_id"])
+    response = app.response_class(body, mimetype="application/zip")
+    response.headers["Content-Disposition"] = f'attachment; filename="my-data-{session["user_id"]}.zip"'
+    return response
+
 # -----------------------
 # Delete Account (complete user deletion)
+#
+# The request only retires the account (credentials cleared, a row queued in
+# account_deletions); purge_account() then removes everything that references
+# the user in the background, in small batches on indexed columns, so no single
+# transaction holds the write lock for more than a few milliseconds.
+ACCOUNT_PURGE_BATCH = 200
+ACCOUNT_PURGE_PAUSE = 0.01  # seconds between batches, so other writers get the lock
+
+# (table, key columns, condition on the user's id, upload columns) in purge order
+ACCOUNT_PURGE_STEPS = [
+    # Relationships first: the account drops out of other users' graphs quickly
+    ("friendships", "id", "id IN (SELECT request_id FROM friend_edges WHERE user_id=?)", ()),
+    ("followers", "id", "follower_id=?", ()),
+    ("followers", "id", "following_id=?", ()),
+    ("blocked_users", "id", "user_id=?", ()),
+    ("blocked_users", "id", "blocked_user_id=?", ()),
+    ("people_suggestions", "user_id, suggested_id", "user_id=?", ()),
+    # Other users' likes, comments and timeline entries on this user's posts
+    ("likes", "id", "post_id IN (SELECT id FROM posts WHERE user_id=?)", ()),
+    ("comments", "id", "post_id IN (SELECT id FROM posts WHERE user_id=?)", ()),
+    ("post_tags", "rowid", "post_id IN (SELECT id FROM posts WHERE user_id=?)", ()),
+    ("timelines", "rowid", "post_id IN (SELECT id FROM posts WHERE user_id=?)", ()),
+    ("timelines", "rowid", "user_id=?", ()),
+    ("media_items", "id", "user_id=?", ()),
+    ("posts", "id", "user_id=?", ("image", "music")),
+    ("profile_posts", "id", "user_id=?", ("image", "music")),
+    ("comments", "id", "user_id=?", ()),
+    ("likes", "id", "user_id=?", ()),
+    ("stories", "id", "user_id=?", ("image",)),
+    ("album_images", "id", "user_id=?", ("image",)),
+    ("products", "id", "user_id=?", ("images", "file")),
+    ("purchases", "id", "user_id=?", ()),
+    ("transactions", "id", "user_id=?", ()),
+    ("music_library", "id", "user_id=?", ("file_path",)),
+    ("messages", "id", "sender_id=?", ("image", "music")),
+    ("messages", "id", "receiver_id=?", ("image", "music")),
+    ("notifications", "id", "user_id=?", ()),
+    ("notifications", "id", "from_user=?", ()),
+]
+# Steps before this index remove relationships (see the graph invalidation below)
+ACCOUNT_PURGE_RELATIONSHIP_STEPS = 5
+
+# Tables whose rows are baked into cached post cards: deleting one bumps its post
+ACCOUNT_PURGE_CARD_TABLES = {"comments", "likes"}
+
+def purge_batch(conn, user_id, table, keys, condition, upload_columns, batch_size):
+    """Delete up to batch_size rows of one purge step; returns the deleted rows"""
+    key_columns = [key.strip() for key in keys.split(",")]
+    extra_columns = list(upload_columns)
+    if table in ACCOUNT_PURGE_CARD_TABLES:
+        extra_columns.append("post_id")
+    rows = conn.execute(
+        f"SELECT {', '.join(key_columns + extra_columns)} FROM {table} WHERE {condition} LIMIT ?",
+        (user_id, batch_size)
+    ).fetchall()
+    if rows:
+        match = " AND ".join(f"{key}=?" for key in key_columns)
+        conn.executemany(f"DELETE FROM {table} WHERE {match}",
+                         [tuple(row)[:len(key_columns)] for row in rows])
+        if table in ACCOUNT_PURGE_CARD_TABLES:
+            conn.executemany(
+                "UPDATE posts SET version = COALESCE(version, 0) + 1 WHERE id=?",
+                [(post_id,) for post_id in sorted({row["post_id"] for row in rows})]
+            )
+            bump_feed_version(conn)
+    return rows
+
+def upload_paths(rows, upload_columns):
+    """Upload paths ("uploads/x.jpg") stored in rows; products.images holds a comma-separated list"""
+    for row in rows:
+        for column in upload_columns:
+            for value in (row[column] or "").split(","):
+                # Same normalisation as media_gc.normalize_path (which needs storage)
+                path = value.strip().lstrip("/")
+                if path.startswith("static/"):
+                    path = path[len("static/"):]
+                if path and "://" not in path and path != "avatars/default.png":
+                    yield path
+
+def purge_account(user_id, batch_size=ACCOUNT_PURGE_BATCH, pause=ACCOUNT_PURGE_PAUSE):
+    """
+    Delete a retired account and everything that references it (background task).
+
+    Each batch is its own short transaction, and the job sleeps `pause` seconds
+    between batches. It runs on the slow task lane, so the sleeps never hold up
+    settlement or fan-out. Progress (current step, rows and files deleted) is kept in
+    account_deletions. Every step is idempotent, so an interrupted purge is
+    simply run again from the start (`flask purge-accounts`).
+    """
+    import time
+    started = time.time()
+    conn = get_db_connection()
+    try:
+        conn.execute("""
+            UPDATE account_deletions SET status='running', updated_at=CURRENT_TIMESTAMP
+            WHERE user_id=?
+        """, (user_id,))
+        conn.commit()
+        neighbours = social_graph.load_user_graph(conn, user_id).neighbours()
+        avatar = conn.execute("SELECT avatar FROM users WHERE id=?", (user_id,)).fetchone()
+    finally:
+        conn.close()
+
+    rows_deleted = files_deleted = 0
+    try:
+        for index, (table, keys, condition, upload_columns) in enumerate(ACCOUNT_PURGE_STEPS):
+            step = f"{table}: {condition}"
+            while True:
+                conn = get_db_connection()
+                try:
+                    rows = purge_batch(conn, user_id, table, keys, condition, upload_columns, batch_size)
+                    rows_deleted += len(rows)
+                    conn.execute("""
+                        UPDATE account_deletions
+                        SET step=?, rows_deleted=?, files_deleted=?, updated_at=CURRENT_TIMESTAMP
+                        WHERE user_id=?
+                    """, (step, rows_deleted, files_deleted, user_id))
+                    conn.commit()
+                finally:
+                    conn.close()
+
+                # Files go only once the rows pointing at them are committed
+                for path in upload_paths(rows, upload_columns):
+                    if delete_upload_file(path):
+                        files_deleted += 1
+                if len(rows) < batch_size:
+                    break
+                time.sleep(pause)
+
+            if index == ACCOUNT_PURGE_RELATIONSHIP_STEPS - 1:
+                social_graph.invalidate(user_id, *neighbours)
+
+        if avatar and avatar["avatar"]:
+            for path in upload_paths([avatar], ("avatar",)):
+                if delete_upload_file(path):
+                    files_deleted += 1
+
+        conn = get_db_connection()
+        try:
+            conn.execute("DELETE FROM users WHERE id=?", (user_id,))
+            bump_feed_version(conn)
+            conn.execute("""
+                UPDATE account_deletions
+                SET status='done', step=NULL, rows_deleted=?, files_deleted=?,
+                    updated_at=CURRENT_TIMESTAMP, finished_at=CURRENT_TIMESTAMP
+                WHERE user_id=?
+            """, (rows_deleted + 1, files_deleted, user_id))
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception:
+        conn = get_db_connection()
+        conn.execute("""
+            UPDATE account_deletions SET status='failed', updated_at=CURRENT_TIMESTAMP
+            WHERE user_id=?
+        """, (user_id,))
+        conn.commit()
+        conn.close()
+        raise
+
+    social_graph.invalidate(user_id, *neighbours)
+    print(f"🗑️  Purged account {user_id}: {rows_deleted + 1} rows, {files_deleted} files "
+          f"in {time.time() - started:.1f}s")
+
 @app.route("/account/delete", methods=["POST"])
 def delete_account():
     if "user_id" not in session:
@@ -246,58 +647,57 @@ def delete_account():
     conn = get_db_connection()
     
     try:
-        # Delete all user data from all tables
-        conn.execute("DELETE FROM profile_posts WHERE user_id=?", (user_id,))
-        conn.execute("DELETE FROM posts WHERE user_id=?", (user_id,))
-        conn.execute("DELETE FROM comments WHERE user_id=?", (user_id,))
-        conn.execute("DELETE FROM likes WHERE user_id=?", (user_id,))
-        conn.execute("DELETE FROM stories WHERE user_id=?", (user_id,))
-        conn.execute("DELETE FROM album_images WHERE user_id=?", (user_id,))
-        conn.execute("DELETE FROM products WHERE user_id=?", (user_id,))
-        conn.execute("DELETE FROM purchases WHERE user_id=?", (user_id,))
-        conn.execute("DELETE FROM transactions WHERE user_id=?", (user_id,))
-        conn.execute("DELETE FROM music_library WHERE user_id=?", (user_id,))
-        
-        # Delete friendships (both directions)
-        conn.execute("DELETE FROM friendships WHERE user_id=? OR friend_id=?", (user_id, user_id))
-        
-        # Delete messages (both sent and received)
-        conn.execute("DELETE FROM messages WHERE sender_id=? OR receiver_id=?", (user_id, user_id))
-        
-        # Delete notifications
-        try:
-            conn.execute("DELETE FROM notifications WHERE user_id=? OR from_user_id=?", (user_id, user_id))
-        except sqlite3.OperationalError:
-            pass  # Table might not exist or column names different
-        
-        # Delete group memberships
-        try:
-            conn.execute("DELETE FROM group_members WHERE user_id=?", (user_id,))
-        except sqlite3.OperationalError:
-            pass  # Table might not exist
-        
-        # Delete owned groups
-        try:
-            conn.execute("DELETE FROM groups WHERE owner_id=?", (user_id,))
-        except sqlite3.OperationalError:
-            pass  # Table might not exist or column name different
-        
-        # Finally, delete the user account itself
-        conn.execute("DELETE FROM users WHERE id=?", (user_id,))
-        
+        # Retire the account at once: nobody can sign in as it (other sessions
+        # end on their next request), its username, handle and email are free
+        # again and its posts, stories and profile are hidden; the data itself
+        # goes in the background
+        conn.execute("""
+            UPDATE users
+            SET email=NULL, handle=NULL, password=NULL, username='deleted_' || id,
+                bio='', about_me='', interests='', retired=1
+            WHERE id=?
+        """, (user_id,))
+        # Close the wallet on the ledger, so the user's entries still sum to
+        # zero once the account row is gone
+        cents = conn.execute("SELECT wallet_cents FROM users WHERE id=?", (user_id,)).fetchone()
+        if cents and cents[0]:
+            conn.execute("UPDATE users SET wallet_cents=0, wallet_balance=0.0 WHERE id=?", (user_id,))
+            ledger.post(conn, ledger.CLOSED_ACCOUNTS, "Account closed",
+                        [(ledger.WALLET, user_id, -cents[0]), (ledger.CLOSED_ACCOUNTS, None, cents[0])])
+        conn.execute("""
+            INSERT OR REPLACE INTO account_deletions (user_id, status)
+            VALUES (?, 'pending')
+        """, (user_id,))
+        bump_commented_posts(conn, user_id)
         conn.commit()
-    except Exception as e:
+    except sqlite3.Error as e:
         conn.rollback()
         print(f"Error deleting account: {e}")
-        conn.close()
         return redirect("/profile?error=delete_failed")
     finally:
         conn.close()
     
+    tasks.enqueue_slow(purge_account, user_id)
+    
     # Clear session and redirect to login
     session.clear()
     return redirect("/login?deleted=1")
 
+@app.route("/admin/account-deletions")
+def admin_account_deletions():
+    """Progress of recent account purges"""
+    if "user_id" not in session or session.get("user_id") != 1:
+        return jsonify({"error": "Admin only"}), 403
+
+    conn = get_db_connection()
+    rows = conn.execute("""
+        SELECT * FROM account_deletions
+        ORDER BY requested_at DESC, user_id DESC
+        LIMIT 100
+    """).fetchall()
+    conn.close()
+    return jsonify({'deletions': [dict(row) for row in rows]})
+
 # Upload folders
 # -----------------------
 AVATAR_FOLDER = "static/avatars"
@@ -306,12 +706,18 @@ STORY_FOLDER  = "static/stories"
 MUSIC_FOLDER  = "static/music"
 PRODUCT_FOLDER = "static/products"
 
+# Stories disappear after this many hours; the forum strip shows at most
+# STORY_STRIP_LIMIT of the newest live stories
+STORY_TTL_HOURS = 24
+STORY_STRIP_LIMIT = 200
+STORY_SWEEP_BATCH = 500
+STORY_SWEEP_INTERVAL = 300  # seconds between opportunistic sweeps
+
+AUDIO_EXTENSIONS = {"mp3", "wav", "ogg", "m4a"}
+
 ALLOWED_EXTENSIONS = {"png","jpg","jpeg","gif","mp3","wav","ogg","m4a",
                       "apk","zip","exe","pdf","py","js","docx","pptx"}
 
-for folder in [AVATAR_FOLDER, UPLOAD_FOLDER, STORY_FOLDER, MUSIC_FOLDER, PRODUCT_FOLDER]:
-    os.makedirs(folder, exist_ok=True)
-
 
 # -----------------------
 # Utils
@@ -324,6 +730,8 @@ def get_db_connection():
     """Get SQLite database connection"""
     conn = sqlite3.connect("users.db")
     conn.row_factory = sqlite3.Row
+    # Off by default in SQLite; the ON DELETE rules in FOREIGN_KEYS need it per connection
+    conn.execute("PRAGMA foreign_keys = ON")
     return conn
 
 def execute_query(conn, query, params=()):
@@ -347,6 +755,192 @@ def get_subscription(conn, user_id):
     ).fetchone()
     return (row["subscription"] if row and row["subscription"] else "none")
 
+# -----------------------
+# Conditional GET (ETag / 304)
+# -----------------------
+# Online badges and "last seen" text age with the clock, so page ETags roll over every minute
+ETAG_TIME_BUCKET = 60
+
+def bump_user_version(conn, *user_ids):
+    """Mark a user's profile/photos as changed (posts, stories, products, album, followers, profile edits)"""
+    for uid in user_ids:
+        conn.execute("UPDATE users SET content_version = COALESCE(content_version, 0) + 1 WHERE id=?", (uid,))
+
+def bump_feed_version(conn):
+    """Mark the forum feed as changed (new/deleted posts, likes, comments, stories, author changes)"""
+    conn.execute("UPDATE site_versions SET version = version + 1 WHERE name='feed'")
+
+def get_feed_version(conn):
+    row = conn.execute("SELECT version FROM site_versions WHERE name='feed'").fetchone()
+    return row["version"] if row else 0
+
+def page_etag(*parts):
+    """
+    Weak ETag for a per-viewer page.
+
+    parts are the cheap version/state values the page depends on; the viewer
+    id, nav-bar notification counts and current time bucket are always mixed in.
+    """
+    import time
+    viewer_id = session.get("user_id")
+    counts = get_notification_counts(viewer_id) if viewer_id else {}
+    state = [viewer_id, int(time.time() // ETAG_TIME_BUCKET), sorted(counts.items())]
+    state.extend(parts)
+    return f"{zlib.crc32(repr(state).encode()):08x}"
+
+def is_not_modified(etag):
+    """True when the client already holds this version (never while flash messages are pending)"""
+    if session.get('_flashes'):
+        return False
+    return request.if_none_match.contains_weak(etag)
+
+def not_modified(etag):
+    response = make_response('', 304)
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def with_etag(body, etag):
+    """Attach the weak ETag to a rendered page; browsers revalidate on every visit"""
+    response = make_response(body)
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+# -----------------------
+# Media index
+# -----------------------
+# source_type -> (table, caption column) for rows that appear in /photos
+MEDIA_SOURCES = {
+    'post': ('profile_posts', 'content'),
+    'forum_post': ('posts', 'content'),
+    'album': ('album_images', 'caption'),
+}
+PHOTOS_PAGE_SIZE = 60
+
+def index_media(conn, source_type, source_id=None):
+    """Copy an image-bearing row (or all rows of a source when source_id is None) into media_items"""
+    table, caption_column = MEDIA_SOURCES[source_type]
+    where = "image IS NOT NULL AND image != ''"
+    params = [source_type]
+    if source_id is not None:
+        where += " AND id=?"
+        params.append(source_id)
+    conn.execute(f"""
+        INSERT OR IGNORE INTO media_items (user_id, source_type, source_id, image, caption, created_at)
+        SELECT user_id, ?, id, image, {caption_column}, created_at FROM {table}
+        WHERE {where}
+    """, params)
+
+def unindex_media(conn, source_type, source_id, user_id):
+    """Remove a deleted row's image from media_items"""
+    conn.execute(
+        "DELETE FROM media_items WHERE source_type=? AND source_id=? AND user_id=?",
+        (source_type, source_id, user_id)
+    )
+
+def keyset_condition(cursor, created_column="created_at", id_column="id"):
+    """SQL condition (with leading AND) and params for rows after a "created_at|id" cursor, newest first"""
+    if not cursor:
+        return "", []
+    try:
+        created_at, last_id = cursor.rsplit('|', 1)
+        last_id = int(last_id)
+    except ValueError:
+        return "", []
+    return (f" AND ({created_column} < ? OR ({created_column} = ? AND {id_column} < ?))",
+            [created_at, created_at, last_id])
+
+def get_media_page(conn, user_id, cursor=None, limit=PHOTOS_PAGE_SIZE):
+    """
+    One keyset page of a user's photos, newest first.
+
+    cursor is the "created_at|id" of the last item already shown. Returns
+    (photos, next_cursor) where next_cursor is None on the last page.
+    """
+    after, after_params = keyset_condition(cursor)
+    where = "user_id=?" + after
+    params = [user_id] + after_params
+    rows = conn.execute(f"""
+        SELECT id, source_type, source_id, image, caption, created_at,
+               strftime('%Y-%m-%d', created_at) AS date
+        FROM media_items
+        WHERE {where}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    """, params + [limit + 1]).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    photos = [{
+        'id': row['source_id'],
+        'image': row['image'],
+        'caption': row['caption'] or '',
+        'content': (row['caption'] or '') if row['source_type'] != 'album' else '',
+        'date': row['date'],
+        'type': row['source_type'],
+        'timestamp': row['created_at']
+    } for row in rows]
+    next_cursor = f"{rows[-1]['created_at']}|{rows[-1]['id']}" if has_more else None
+    return photos, next_cursor
+
+# -----------------------
+# Audio metadata
+# -----------------------
+def is_audio_file(path):
+    return bool(path) and "." in path and path.rsplit(".", 1)[1].lower() in AUDIO_EXTENSIONS
+
+def extract_audio_metadata(path):
+    """Parse an uploaded track's headers and store the result (runs on the task worker)"""
+    import audio_meta
+
+    local_path = os.path.join("static", path)
+    download = None
+    try:
+        if not os.path.exists(local_path) and storage is not None:
+            # Uploaded to Supabase: parse a temporary copy
+            data = storage.download_file(path, path.split('/', 1)[0])
+            if data is not None:
+                import tempfile
+                download = tempfile.NamedTemporaryFile(suffix=os.path.splitext(path)[1], delete=False)
+                download.write(data)
+                download.close()
+                local_path = download.name
+        meta = audio_meta.read_metadata(local_path) if os.path.exists(local_path) else None
+        status = 'done' if meta else 'unreadable'
+    except Exception as e:
+        print(f"⚠️  Could not parse audio {path}: {e}")
+        meta, status = None, 'unreadable'
+    finally:
+        if download is not None:
+            os.remove(download.name)
+    meta = meta or {}
+
+    conn = get_db_connection()
+    conn.execute("""
+        INSERT OR REPLACE INTO audio_metadata
+            (path, format, duration, bitrate, title, artist, waveform, status, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    """, (
+        path, meta.get('format'), meta.get('duration'), meta.get('bitrate'),
+        meta.get('title'), meta.get('artist'),
+        json.dumps(meta['waveform']) if meta.get('waveform') else None,
+        status
+    ))
+    # Feed cards show the new duration/waveform
+    bump_feed_version(conn)
+    conn.commit()
+    conn.close()
+
+def queue_audio_metadata(path):
+    """Schedule header parsing for a freshly uploaded track"""
+    if is_audio_file(path):
+        tasks.enqueue(extract_audio_metadata, path)
+
+# Columns selected alongside a post that has a `music` path (LEFT JOIN audio_metadata am)
+AUDIO_COLUMNS = """am.duration AS audio_duration, am.bitrate AS audio_bitrate,
+        am.title AS audio_title, am.artist AS audio_artist, am.waveform AS audio_waveform"""
+
 # -----------------------
 # Database
 # -----------------------
@@ -430,7 +1024,11 @@ def create_tables():
         verification_sent_at TIMESTAMP,
         last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         about_me TEXT DEFAULT '',
-        interests TEXT DEFAULT ''
+        interests TEXT DEFAULT '',
+        content_version INTEGER DEFAULT 0,
+        fanout_on_read INTEGER DEFAULT 0,
+        wallet_cents INTEGER DEFAULT 0,
+        retired INTEGER DEFAULT 0
     )""")
     try:
         conn.execute("ALTER TABLE users ADD COLUMN subscription TEXT DEFAULT 'none'")
@@ -490,6 +1088,24 @@ def create_tables():
         conn.execute("ALTER TABLE users ADD COLUMN interests TEXT DEFAULT ''")
     except sqlite3.OperationalError:
         pass
+    try:
+        conn.execute("ALTER TABLE users ADD COLUMN content_version INTEGER DEFAULT 0")
+    except sqlite3.OperationalError:
+        pass
+    try:
+        conn.execute("ALTER TABLE users ADD COLUMN fanout_on_read INTEGER DEFAULT 0")
+    except sqlite3.OperationalError:
+        pass
+    try:
+        # Authoritative balance in cents (wallet_balance mirrors it); filled by ledger.open_balances()
+        conn.execute("ALTER TABLE users ADD COLUMN wallet_cents INTEGER DEFAULT 0")
+    except sqlite3.OperationalError:
+        pass
+    try:
+        # Set when an account is deleted; hides it until purge_account() removes the row
+        conn.execute("ALTER TABLE users ADD COLUMN retired INTEGER DEFAULT 0")
+    except sqlite3.OperationalError:
+        pass
     # Update any null values
     try:
         conn.execute("UPDATE users SET handle = LOWER(REPLACE(username, ' ', '_')) WHERE handle IS NULL OR handle = ''")
@@ -506,8 +1122,8 @@ def create_tables():
     conn.execute("UPDATE users SET about_me='' WHERE about_me IS NULL")
     conn.execute("UPDATE users SET interests='' WHERE interests IS NULL")
     
-    # Give admin $1000 for testing and verify/approve admin
-    conn.execute("UPDATE users SET wallet_balance=1000.0, is_verified=1, is_approved=1 WHERE id=1")
+    # Verify/approve admin
+    conn.execute("UPDATE users SET is_verified=1, is_approved=1 WHERE id=1")
     
     conn.execute("""
     CREATE TABLE IF NOT EXISTS transactions (
@@ -536,6 +1152,7 @@ def create_tables():
         music TEXT,
         music_title TEXT,
         tags TEXT,
+        version INTEGER DEFAULT 0,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )""")
 
@@ -557,6 +1174,10 @@ def create_tables():
         conn.execute("ALTER TABLE posts ADD COLUMN tags TEXT")
     except sqlite3.OperationalError:
         pass
+    try:
+        conn.execute("ALTER TABLE posts ADD COLUMN version INTEGER DEFAULT 0")
+    except sqlite3.OperationalError:
+        pass
     try:
         conn.execute("ALTER TABLE profile_posts ADD COLUMN music TEXT")
     except sqlite3.OperationalError:
@@ -572,8 +1193,20 @@ def create_tables():
         user_id INTEGER,
         content TEXT,
         image TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        expires_at TIMESTAMP
     )""")
+    try:
+        conn.execute("ALTER TABLE stories ADD COLUMN expires_at TIMESTAMP")
+    except sqlite3.OperationalError:
+        pass
+    # Stories created before expiry existed live 24 hours from creation
+    conn.execute(f"""
+        UPDATE stories SET expires_at = datetime(created_at, '+{STORY_TTL_HOURS} hours')
+        WHERE expires_at IS NULL
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stories_expires_at ON stories(expires_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stories_user_expires ON stories(user_id, expires_at)")
     conn.execute("""
         CREATE TABLE IF NOT EXISTS products (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -654,6 +1287,7 @@ def create_tables():
         content TEXT,
         sticker TEXT,
         money_amount REAL,
+        money_status TEXT,
         image TEXT,
         music TEXT,
         music_title TEXT,
@@ -668,6 +1302,11 @@ def create_tables():
         conn.execute("ALTER TABLE messages ADD COLUMN money_amount REAL")
     except sqlite3.OperationalError:
         pass
+    try:
+        # pending / settled / failed, set by transfers.settle_batch()
+        conn.execute("ALTER TABLE messages ADD COLUMN money_status TEXT")
+    except sqlite3.OperationalError:
+        pass
     try:
         conn.execute("ALTER TABLE messages ADD COLUMN image TEXT")
     except sqlite3.OperationalError:
@@ -745,17 +1384,551 @@ def create_tables():
     except sqlite3.OperationalError:
         pass
 
+    # Parsed audio headers, keyed by the stored file path (posts.music, messages.music, ...)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS audio_metadata (
+        path TEXT PRIMARY KEY,
+        format TEXT,
+        duration REAL,
+        bitrate INTEGER,
+        title TEXT,
+        artist TEXT,
+        waveform TEXT,
+        status TEXT DEFAULT 'pending',
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+    # Unified photo index behind /photos (one row per image from any source)
+    media_index_exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='media_items'"
+    ).fetchone() is not None
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS media_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        source_type TEXT,
+        source_id INTEGER,
+        image TEXT,
+        caption TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(source_type, source_id)
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_media_items_user_created ON media_items(user_id, created_at, id)")
+    # Keyset pagination for feeds and chat history (v1 API)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_created ON posts(created_at, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_user_created ON posts(user_id, created_at, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_profile_posts_user_created ON profile_posts(user_id, created_at, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_pair ON messages(sender_id, receiver_id, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_receiver ON messages(receiver_id, is_read)")
+    # Admin approval queues (a handful of rows in a large users table)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_pending ON users(is_verified, id) WHERE is_approved = 0")
+    if not media_index_exists:
+        for source_type in MEDIA_SOURCES:
+            index_media(conn, source_type)
+
+    # Global change counters behind page ETags (see bump_feed_version)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS site_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER DEFAULT 0
+    )""")
+    conn.execute("INSERT OR IGNORE INTO site_versions (name, version) VALUES ('feed', 0)")
+
+    # Tag vocabulary and normalized post tags (posts.tags stays the display copy)
+    post_tags_exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='post_tags'"
+    ).fetchone() is not None
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS tags (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE
+    )""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS post_tags (
+        post_id INTEGER,
+        tag_id INTEGER,
+        PRIMARY KEY (post_id, tag_id)
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_post_tags_tag ON post_tags(tag_id)")
+
+    # Friend graph adjacency: every friendships row mirrored once per endpoint,
+    # so "my friends" / "my relationship with X" is a primary-key range or point
+    # lookup from either side. friendships stays the canonical request record;
+    # the triggers below keep the edges in step with it.
+    friend_edges_exist = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='friend_edges'"
+    ).fetchone() is not None
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS friend_edges (
+        user_id INTEGER,
+        friend_id INTEGER,
+        status TEXT,
+        requested_by INTEGER,
+        request_id INTEGER,
+        PRIMARY KEY (user_id, friend_id)
+    ) WITHOUT ROWID""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_friend_edges_request ON friend_edges(request_id)")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_friendships_insert_edges AFTER INSERT ON friendships
+        BEGIN
+            INSERT OR IGNORE INTO friend_edges (user_id, friend_id, status, requested_by, request_id)
+            VALUES (NEW.user_id, NEW.friend_id, NEW.status, NEW.user_id, NEW.id),
+                   (NEW.friend_id, NEW.user_id, NEW.status, NEW.user_id, NEW.id);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_friendships_update_edges AFTER UPDATE OF status ON friendships
+        BEGIN
+            UPDATE friend_edges SET status = NEW.status WHERE request_id = NEW.id;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_friendships_delete_edges AFTER DELETE ON friendships
+        BEGIN
+            DELETE FROM friend_edges WHERE request_id = OLD.id;
+        END
+    """)
+    if not friend_edges_exist:
+        # Oldest request wins when both users once asked each other
+        conn.execute("""
+            INSERT OR IGNORE INTO friend_edges (user_id, friend_id, status, requested_by, request_id)
+            SELECT user_id, friend_id, status, user_id, id FROM friendships
+            UNION ALL
+            SELECT friend_id, user_id, status, user_id, id FROM friendships
+            ORDER BY 5
+        """)
+
+    # "People you may know", rebuilt offline by `flask suggest-people`
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS people_suggestions (
+        user_id INTEGER,
+        suggested_id INTEGER,
+        score REAL,
+        mutual_friends INTEGER DEFAULT 0,
+        mutual_follows INTEGER DEFAULT 0,
+        shared_interests INTEGER DEFAULT 0,
+        PRIMARY KEY (user_id, suggested_id)
+    ) WITHOUT ROWID""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_people_suggestions_rank ON people_suggestions(user_id, score DESC)")
+
+    # Per-user home timelines (see fan_out_post)
+    timelines_exist = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='timelines'"
+    ).fetchone() is not None
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS timelines (
+        user_id INTEGER,
+        post_id INTEGER,
+        author_id INTEGER,
+        created_at TIMESTAMP,
+        PRIMARY KEY (user_id, post_id)
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_timelines_user_created ON timelines(user_id, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_timelines_user_author ON timelines(user_id, author_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_timelines_post ON timelines(post_id)")
+    if not timelines_exist:
+        conn.execute("""
+            INSERT OR IGNORE INTO timelines (user_id, post_id, author_id, created_at)
+            SELECT f.follower_id, p.id, p.user_id, p.created_at
+            FROM followers f JOIN posts p ON p.user_id = f.following_id
+            UNION ALL
+            SELECT e.friend_id, p.id, p.user_id, p.created_at
+            FROM friend_edges e JOIN posts p ON p.user_id = e.user_id
+            WHERE e.status = 'accepted'
+            UNION ALL
+            SELECT p.user_id, p.id, p.user_id, p.created_at FROM posts p
+        """)
+        trim_timelines(conn, [row[0] for row in conn.execute("SELECT DISTINCT user_id FROM timelines")])
+    if not post_tags_exists:
+        tag_index.backfill_post_tags(conn)
+
+    # Monotonic change sequence behind /api/sync, filled by triggers so every
+    # write path is covered. audience_a/b restrict private rows (messages) to
+    # their two participants; NULL means visible to everyone.
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        entity TEXT,
+        entity_id INTEGER,
+        op TEXT,
+        audience_a INTEGER,
+        audience_b INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+    conn.execute("INSERT OR IGNORE INTO site_versions (name, version) VALUES ('change_log_floor', 0)")
+    for table, entity, audience in (
+        ('posts', 'post', None),
+        ('stories', 'story', None),
+        ('messages', 'message', ('sender_id', 'receiver_id')),
+    ):
+        for event, op, row in (('INSERT', 'upsert', 'NEW'), ('UPDATE', 'upsert', 'NEW'), ('DELETE', 'delete', 'OLD')):
+            if table == 'stories' and event == 'UPDATE':
+                continue
+            a, b = (f"{row}.{audience[0]}", f"{row}.{audience[1]}") if audience else ("NULL", "NULL")
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_changes AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO change_log (entity, entity_id, op, audience_a, audience_b)
+                    VALUES ('{entity}', {row}.id, '{op}', {a}, {b});
+                END
+            """)
+
+    # Denormalized per-user counters (see USER_STATS_SOURCES), kept current by triggers
+    user_stats_exist = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='user_stats'"
+    ).fetchone() is not None
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_stats (
+        user_id INTEGER PRIMARY KEY,
+        friend_count INTEGER DEFAULT 0,
+        follower_count INTEGER DEFAULT 0,
+        following_count INTEGER DEFAULT 0,
+        post_count INTEGER DEFAULT 0,
+        story_count INTEGER DEFAULT 0,
+        product_count INTEGER DEFAULT 0
+    )""")
+    # Indexes behind the per-user recount in check_user_stats()
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_followers_following ON followers(following_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_user ON products(user_id)")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_insert_stats AFTER INSERT ON users
+        BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.id);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_delete_stats AFTER DELETE ON users
+        BEGIN
+            DELETE FROM user_stats WHERE user_id = OLD.id;
+        END
+    """)
+    for column, (table, owner, condition) in USER_STATS_SOURCES.items():
+        new_match = condition.format(row='NEW') if condition else '1'
+        old_match = condition.format(row='OLD') if condition else '1'
+        increment = f"""
+            INSERT OR IGNORE INTO user_stats (user_id) SELECT NEW.{owner} WHERE {new_match};
+            UPDATE user_stats SET {column} = {column} + 1 WHERE user_id = NEW.{owner} AND {new_match};
+        """
+        decrement = f"""
+            UPDATE user_stats SET {column} = {column} - 1 WHERE user_id = OLD.{owner} AND {old_match};
+        """
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_insert_{column} AFTER INSERT ON {table}
+            BEGIN {increment} END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_delete_{column} AFTER DELETE ON {table}
+            BEGIN {decrement} END
+        """)
+        if condition:
+            # Rows can move in or out of the counted set (e.g. a request being accepted)
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_update_{column} AFTER UPDATE ON {table}
+                BEGIN {decrement} {increment} END
+            """)
+    if not user_stats_exist:
+        conn.execute("INSERT OR IGNORE INTO user_stats (user_id) SELECT id FROM users")
+        check_user_stats(conn, repair=True)
+
+    # Background account deletion (see purge_account) and the indexes its batches use
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS account_deletions (
+        user_id INTEGER PRIMARY KEY,
+        status TEXT DEFAULT 'pending',
+        step TEXT,
+        rows_deleted INTEGER DEFAULT 0,
+        files_deleted INTEGER DEFAULT 0,
+        requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_comments_post ON comments(post_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_comments_user ON comments(user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_likes_user ON likes(user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_album_images_user ON album_images(user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_purchases_user ON purchases(user_id)")
+    # Wallet history pages on (user_id, created_at, id); this also serves plain user_id lookups
+    conn.execute("DROP INDEX IF EXISTS idx_transactions_user")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_user_created ON transactions(user_id, created_at, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_music_library_user ON music_library(user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications(user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_from ON notifications(from_user)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_blocked_users_blocked ON blocked_users(blocked_user_id)")
+
+    # Outcomes of wallet operations by idempotency key (see wallet_service.py)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS wallet_operations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        idempotency_key TEXT NOT NULL,
+        operation TEXT NOT NULL,
+        result TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(user_id, idempotency_key)
+    )""")
+
+    # Double-entry wallet ledger; wallets that predate it get an opening balance
+    ledger.create_tables(conn)
+    # Give admin $1000 for testing, once
+    conn.execute("""
+        UPDATE users SET wallet_balance=1000.0
+        WHERE id=1 AND NOT EXISTS (SELECT 1 FROM ledger_entries WHERE user_id=1)
+    """)
+    opened = ledger.open_balances(conn)
+    if opened:
+        print(f"📒 Opened ledger balances for {opened} wallets")
+    # Queue of money sent in chat (see transfers.py)
+    transfers.create_tables(conn)
+
+    # Every foreign key column leads an index, so cascades and parent deletes
+    # are index lookups (the rest are covered by the indexes above)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_applications_user ON applications(user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_friendships_friend ON friendships(friend_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_friend_edges_friend ON friend_edges(friend_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_purchases_product ON purchases(product_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_watch_rooms_host ON watch_rooms(host_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_watch_participants_user ON watch_participants(user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_people_suggestions_suggested ON people_suggestions(suggested_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_timelines_author ON timelines(author_id)")
+    migrate_foreign_keys(conn)
+
     conn.commit()
     conn.close()
 
-# Initialize database with error handling
-try:
-    create_tables()
-    print("✅ Database tables created successfully")
-except Exception as e:
-    print(f"❌ Error creating database tables: {e}")
-    import traceback
-    traceback.print_exc()
+# -----------------------
+# Foreign keys
+# -----------------------
+# child table -> [(column, parent table, ON DELETE action)]; parents are listed
+# before their children and every key points at the parent's id
+FOREIGN_KEYS = {
+    'posts': [('user_id', 'users', 'CASCADE')],
+    'profile_posts': [('user_id', 'users', 'CASCADE')],
+    'likes': [('post_id', 'posts', 'CASCADE'), ('user_id', 'users', 'CASCADE')],
+    'comments': [('post_id', 'posts', 'CASCADE'), ('user_id', 'users', 'CASCADE')],
+    'post_tags': [('post_id', 'posts', 'CASCADE'), ('tag_id', 'tags', 'CASCADE')],
+    'timelines': [('user_id', 'users', 'CASCADE'), ('post_id', 'posts', 'CASCADE'),
+                  ('author_id', 'users', 'CASCADE')],
+    'messages': [('sender_id', 'users', 'CASCADE'), ('receiver_id', 'users', 'CASCADE')],
+    'notifications': [('user_id', 'users', 'CASCADE'), ('from_user', 'users', 'CASCADE')],
+    'applications': [('user_id', 'users', 'CASCADE')],
+    'friendships': [('user_id', 'users', 'CASCADE'), ('friend_id', 'users', 'CASCADE')],
+    'friend_edges': [('user_id', 'users', 'CASCADE'), ('friend_id', 'users', 'CASCADE'),
+                     ('request_id', 'friendships', 'CASCADE')],
+    'followers': [('follower_id', 'users', 'CASCADE'), ('following_id', 'users', 'CASCADE')],
+    'blocked_users': [('user_id', 'users', 'CASCADE'), ('blocked_user_id', 'users', 'CASCADE')],
+    'stories': [('user_id', 'users', 'CASCADE')],
+    'products': [('user_id', 'users', 'CASCADE')],
+    # A purchase stays in the buyer's history after the product is removed
+    'purchases': [('user_id', 'users', 'CASCADE'), ('product_id', 'products', 'SET NULL')],
+    'transactions': [('user_id', 'users', 'CASCADE')],
+    'music_library': [('user_id', 'users', 'CASCADE')],
+    'album_images': [('user_id', 'users', 'CASCADE')],
+    'media_items': [('user_id', 'users', 'CASCADE')],
+    'watch_rooms': [('host_id', 'users', 'CASCADE')],
+    'watch_participants': [('room_id', 'watch_rooms', 'CASCADE'), ('user_id', 'users', 'CASCADE')],
+    'people_suggestions': [('user_id', 'users', 'CASCADE'), ('suggested_id', 'users', 'CASCADE')],
+    'user_stats': [('user_id', 'users', 'CASCADE')],
+    'wallet_operations': [('user_id', 'users', 'CASCADE')],
+    'ledger_snapshots': [('user_id', 'users', 'CASCADE')],
+    # Money audit trail: a transfer outlives either party's account
+    'pending_transfers': [('sender_id', 'users', 'SET NULL'), ('receiver_id', 'users', 'SET NULL'),
+                          ('message_id', 'messages', 'SET NULL')],
+}
+
+# A table-level "FOREIGN KEY (...) REFERENCES ..." clause, as written by rebuild_with_foreign_keys()
+FOREIGN_KEY_CLAUSE = re.compile(
+    r",\s*FOREIGN KEY\s*\([^)]*\)\s*REFERENCES\s+\w+\s*\([^)]*\)"
+    r"(\s+ON\s+(DELETE|UPDATE)\s+(SET\s+NULL|SET\s+DEFAULT|CASCADE|RESTRICT|NO\s+ACTION))*",
+    re.IGNORECASE
+)
+
+# A column-level "REFERENCES ..." clause, as written by CREATE TABLE in create_tables()
+INLINE_REFERENCES_CLAUSE = re.compile(
+    r"\s+REFERENCES\s+\w+\s*\([^)]*\)"
+    r"(\s+ON\s+(DELETE|UPDATE)\s+(SET\s+NULL|SET\s+DEFAULT|CASCADE|RESTRICT|NO\s+ACTION))*",
+    re.IGNORECASE
+)
+
+def declared_foreign_keys(conn, table):
+    return {(row[3], row[2], row[6]) for row in conn.execute(f"PRAGMA foreign_key_list({table})")}
+
+def delete_orphans(conn):
+    """
+    Remove rows whose parent is gone (or null the reference for SET NULL keys).
+
+    Parents are cleaned before children, so e.g. the likes of a dead user's
+    posts go too. Returns {table: rows removed or updated}.
+    """
+    cleaned = {}
+    for table, keys in FOREIGN_KEYS.items():
+        for column, parent, action in keys:
+            orphaned = f"{column} IS NOT NULL AND {column} NOT IN (SELECT id FROM {parent})"
+            if action == 'SET NULL':
+                cur = conn.execute(f"UPDATE {table} SET {column} = NULL WHERE {orphaned}")
+            else:
+                cur = conn.execute(f"DELETE FROM {table} WHERE {orphaned}")
+            if cur.rowcount:
+                cleaned[table] = cleaned.get(table, 0) + cur.rowcount
+    return cleaned
+
+def rebuild_with_foreign_keys(conn, table):
+    """
+    Recreate a table with its FOREIGN_KEYS constraints (SQLite can't add them in place):
+    create a copy with the constraints, move the rows, drop the old table, rename
+    the copy, then restore the indexes, triggers and AUTOINCREMENT counter.
+    """
+    sql = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)
+    ).fetchone()[0]
+    dependents = [row[0] for row in conn.execute("""
+        SELECT sql FROM sqlite_master
+        WHERE tbl_name=? AND type IN ('index', 'trigger') AND sql IS NOT NULL
+    """, (table,))]
+    sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name=?", (table,)).fetchone()
+
+    # Every old constraint goes, table- and column-level, so only FOREIGN_KEYS remains
+    columns = FOREIGN_KEY_CLAUSE.sub("", sql[sql.index("(") + 1:sql.rindex(")")])
+    columns = INLINE_REFERENCES_CLAUSE.sub("", columns).rstrip()
+    constraints = "".join(
+        f",\n        FOREIGN KEY ({column}) REFERENCES {parent}(id) ON DELETE {action}"
+        for column, parent, action in FOREIGN_KEYS[table]
+    )
+    rebuilt = f"{table}_fk_rebuild"
+    conn.execute(f"CREATE TABLE {rebuilt} ({columns}{constraints}\n    ){sql[sql.rindex(')') + 1:]}")
+    conn.execute(f"INSERT INTO {rebuilt} SELECT * FROM {table}")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {rebuilt} RENAME TO {table}")
+    for statement in dependents:
+        conn.execute(statement)
+    if sequence is not None:
+        conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name=?", (sequence[0], table))
+
+def migrate_foreign_keys(conn):
+    """
+    Bring every table's declared foreign keys in line with FOREIGN_KEYS.
+
+    Runs in one transaction with enforcement off (required while tables are
+    swapped): orphans are cleaned up first so the copies satisfy every
+    constraint, and PRAGMA foreign_key_check must come back empty before it
+    commits. Tables that already match are left alone.
+    """
+    stale = [
+        table for table, keys in FOREIGN_KEYS.items()
+        if declared_foreign_keys(conn, table) != set(keys)
+    ]
+    if not stale:
+        return
+    conn.commit()
+    # Only takes effect outside a transaction
+    conn.execute("PRAGMA foreign_keys = OFF")
+    # Keep the rename from re-resolving other tables' triggers mid-swap
+    conn.execute("PRAGMA legacy_alter_table = ON")
+    try:
+        conn.execute("BEGIN")
+        cleaned = delete_orphans(conn)
+        for table in stale:
+            rebuild_with_foreign_keys(conn, table)
+        violations = conn.execute("PRAGMA foreign_key_check").fetchall()
+        if violations:
+            raise sqlite3.IntegrityError(f"foreign key violations after migration: {violations[:5]}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("PRAGMA legacy_alter_table = OFF")
+        conn.execute("PRAGMA foreign_keys = ON")
+    if cleaned:
+        print(f"🧹 Removed orphaned rows: {cleaned}")
+    print(f"🔗 Added foreign keys to {len(stale)} tables")
+
+# -----------------------
+# Per-user stats
+# -----------------------
+# user_stats column -> (source table, owning user column, counted-row condition)
+USER_STATS_SOURCES = {
+    'friend_count': ('friend_edges', 'user_id', "{row}.status = 'accepted'"),
+    'follower_count': ('followers', 'following_id', None),
+    'following_count': ('followers', 'follower_id', None),
+    'post_count': ('posts', 'user_id', None),
+    'story_count': ('stories', 'user_id', None),
+    'product_count': ('products', 'user_id', None),
+}
+USER_STATS_REPAIR_BATCH = 500
+
+def get_user_stats(conn, user_id):
+    """A user's counters as a dict (all zero if the row is missing)"""
+    row = conn.execute("SELECT * FROM user_stats WHERE user_id=?", (user_id,)).fetchone()
+    if row is None:
+        return dict.fromkeys(USER_STATS_SOURCES, 0)
+    return {column: row[column] for column in USER_STATS_SOURCES}
+
+def check_user_stats(conn, repair=False):
+    """
+    Compare user_stats with counts recomputed from the source tables.
+
+    Drift is detected with one grouped scan per counter; each drifted user is then
+    recounted in a single UPDATE, so a repair stays correct even while writes
+    (and their triggers) continue.
+
+    Returns:
+        list[int]: ids of users whose stored counters were wrong (or missing)
+    """
+    actual = {}
+    for column, (table, owner, condition) in USER_STATS_SOURCES.items():
+        where = f"WHERE {condition.format(row=table)}" if condition else ""
+        actual[column] = dict(conn.execute(
+            f"SELECT {owner}, COUNT(*) FROM {table} {where} GROUP BY {owner}"
+        ).fetchall())
+    stored = {row["user_id"]: row for row in conn.execute("SELECT * FROM user_stats")}
+
+    user_ids = [row[0] for row in conn.execute("SELECT id FROM users")]
+    drifted = []
+    for user_id in user_ids:
+        row = stored.get(user_id)
+        if row is None or any(row[column] != counts.get(user_id, 0) for column, counts in actual.items()):
+            drifted.append(user_id)
+    orphaned = set(stored).difference(user_ids)
+
+    if repair and (drifted or orphaned):
+        recount = ", ".join(
+            f"{column} = (SELECT COUNT(*) FROM {table} WHERE {owner} = user_stats.user_id"
+            + (f" AND {condition.format(row=table)})" if condition else ")")
+            for column, (table, owner, condition) in USER_STATS_SOURCES.items()
+        )
+        for i in range(0, len(drifted), USER_STATS_REPAIR_BATCH):
+            chunk = [(user_id,) for user_id in drifted[i:i + USER_STATS_REPAIR_BATCH]]
+            conn.executemany("INSERT OR IGNORE INTO user_stats (user_id) VALUES (?)", chunk)
+            conn.executemany(f"UPDATE user_stats SET {recount} WHERE user_id = ?", chunk)
+            conn.commit()
+        conn.executemany("DELETE FROM user_stats WHERE user_id = ?", [(user_id,) for user_id in orphaned])
+        conn.commit()
+    return drifted
+
+def schema_fingerprint():
+    """Identifies the current create_tables() code; stored in PRAGMA user_version once applied"""
+    def digest(code, crc=0):
+        crc = zlib.crc32(code.co_code, crc)
+        for const in code.co_consts:
+            # Nested code objects (comprehensions) repr with their memory address
+            if hasattr(const, "co_code"):
+                crc = digest(const, crc)
+            else:
+                crc = zlib.crc32(repr(const).encode(), crc)
+        return crc
+    crc = digest(create_tables.__code__)
+    crc = digest(ledger.create_tables.__code__, crc)
+    crc = digest(transfers.create_tables.__code__, crc)
+    # Schema tables kept outside create_tables() change the schema too
+    crc = zlib.crc32(repr((FOREIGN_KEYS, USER_STATS_SOURCES)).encode(), crc)
+    return crc & 0x7fffffff
+
+def current_schema_version():
+    conn = sqlite3.connect("users.db")
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
 
 # Error handlers
 @app.errorhandler(500)
@@ -934,6 +2107,48 @@ def logout():
 # -----------------------
 # Admin User Management
 # -----------------------
+ADMIN_PAGE_SIZE = 50
+
+def admin_user_page(conn, columns, where="1", cursor=None, descending=True, limit=ADMIN_PAGE_SIZE):
+    """
+    One keyset page of users for the admin listings, ordered by id.
+
+    cursor is the last id already shown. Returns (rows, next_cursor) where
+    next_cursor is None on the last page.
+    """
+    params = []
+    try:
+        last_id = int(cursor) if cursor else None
+    except ValueError:
+        last_id = None
+    if last_id is not None:
+        where += " AND id < ?" if descending else " AND id > ?"
+        params.append(last_id)
+    rows = conn.execute(f"""
+        SELECT {columns} FROM users
+        WHERE {where}
+        ORDER BY id {'DESC' if descending else 'ASC'}
+        LIMIT ?
+    """, params + [limit + 1]).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = str(rows[-1]["id"]) if has_more else None
+    return rows, next_cursor
+
+@app.route("/admin/export/<dataset>")
+def admin_export(dataset):
+    """Stream a whole table as CSV (default) or NDJSON (?format=ndjson)"""
+    if "user_id" not in session or session.get("user_id") != 1:
+        return jsonify({"error": "Admin only"}), 403
+    fmt = request.args.get("format", "csv")
+    if dataset not in exports.DATASETS or fmt not in exports.FORMATS:
+        return jsonify({"error": "Unknown export"}), 404
+
+    body = exports.export_dataset(get_db_connection, dataset, fmt)
+    response = app.response_class(body, mimetype=exports.FORMATS[fmt])
+    response.headers["Content-Disposition"] = f'attachment; filename="{dataset}.{fmt}"'
+    return response
+
 @app.route("/admin/approvals")
 def admin_approvals():
     if "user_id" not in session or session.get("user_id") != 1:
@@ -942,24 +2157,24 @@ def admin_approvals():
     
     conn = get_db_connection()
     
-    # Get users pending approval
-    pending = conn.execute("""
-        SELECT id, username, email, created_at, is_verified
-        FROM users
-        WHERE is_approved = 0
-        ORDER BY created_at DESC
-    """).fetchall()
-    
-    # Get all users for management
-    all_users = conn.execute("""
-        SELECT id, username, email, is_verified, is_approved, subscription, created_at
-        FROM users
-        ORDER BY created_at DESC
-    """).fetchall()
+    # Newest registrations first; users has no created_at, the verification
+    # email goes out at sign-up
+    pending, pending_cursor = admin_user_page(
+        conn, "id, username, email, verification_sent_at AS created_at, is_verified",
+        "is_approved = 0", request.args.get("pending_cursor")
+    )
+    all_users, users_cursor = admin_user_page(
+        conn, "id, username, email, is_verified, is_approved, subscription, verification_sent_at AS created_at",
+        cursor=request.args.get("users_cursor")
+    )
+    pending_count = conn.execute("SELECT COUNT(*) FROM users WHERE is_approved = 0").fetchone()[0]
+    user_count = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
     
     conn.close()
     
-    return render_template("admin_approvals.html", pending=pending, all_users=all_users)
+    return render_template("admin_approvals.html", pending=pending, all_users=all_users,
+                           pending_cursor=pending_cursor, users_cursor=users_cursor,
+                           pending_count=pending_count, user_count=user_count)
 
 @app.route("/admin/approve_user/<int:user_id>", methods=["POST"])
 def approve_user(user_id):
@@ -1003,19 +2218,10 @@ def dashboard():
         (session["user_id"],)
     ).fetchone()
 
-    friend_count = conn.execute("""
-        SELECT COUNT(*) FROM friendships
-        WHERE (user_id=? OR friend_id=?)
-        AND status='accepted'
-    """,(session["user_id"], session["user_id"])).fetchone()[0]
-
-    post_count = conn.execute("""
-        SELECT COUNT(*) FROM posts WHERE user_id=?
-    """,(session["user_id"],)).fetchone()[0]
-
-    story_count = conn.execute("""
-        SELECT COUNT(*) FROM stories WHERE user_id=?
-    """,(session["user_id"],)).fetchone()[0]
+    stats = get_user_stats(conn, session["user_id"])
+    friend_count = stats["friend_count"]
+    post_count = stats["post_count"]
+    story_count = stats["story_count"]
 
     # For admin: get pending applications count
     pending_apps = 0
@@ -1057,17 +2263,19 @@ def pending_users():
     
     conn = get_db_connection()
     
-    # Get all pending users (verified but not approved)
-    users = conn.execute("""
-        SELECT id, username, email, handle, about_me, verification_sent_at, is_verified
-        FROM users
-        WHERE is_approved=0 AND is_verified=1
-        ORDER BY verification_sent_at DESC
-    """).fetchall()
+    # Pending users (verified but not approved), newest first, one page at a time
+    users, next_cursor = admin_user_page(
+        conn, "id, username, email, handle, about_me, verification_sent_at, is_verified",
+        "is_approved=0 AND is_verified=1", request.args.get("cursor")
+    )
+    pending_count = conn.execute(
+        "SELECT COUNT(*) FROM users WHERE is_approved=0 AND is_verified=1"
+    ).fetchone()[0]
     
     conn.close()
     
-    return render_template("pending_users.html", users=users)
+    return render_template("pending_users.html", users=users, next_cursor=next_cursor,
+                           pending_count=pending_count)
 
 @app.route("/admin/approve-user/<int:user_id>", methods=["POST"])
 def approve_pending_user(user_id):
@@ -1110,17 +2318,250 @@ def search():
 
         conn = get_db_connection()
         results = conn.execute(
-            "SELECT id, username, avatar, subscription FROM users WHERE username LIKE ? AND id != ?",
+            "SELECT id, username, avatar, subscription FROM users WHERE username LIKE ? AND id != ? AND NOT retired",
             (f"%{query}%", session["user_id"])
         ).fetchall()
+        results = social_graph.without_blocked(results, social_graph.block_set(conn, session["user_id"]), key="id")
         conn.close()
 
     return render_template("search.html", results=results, query=query)
 
 
+# -----------------------
+# Forum post card fragment cache
+# -----------------------
+POST_CARD_CACHE = cache.FragmentCache(
+    maxsize=int(os.environ.get("POST_CARD_CACHE_SIZE", 2000)),
+    backend=cache.shared_backend()
+)
+ONLINE_SLOT_RE = re.compile(r'<!--online:(\d+)-->')
+OWNER_BLOCK_RE = re.compile(r'<!--owner:(\d+)-->(.*?)<!--/owner-->', re.S)
+
+def bump_post_version(conn, post_id):
+    """Invalidate a post's cached card (call on like, comment or edit)"""
+    conn.execute("UPDATE posts SET version = COALESCE(version, 0) + 1 WHERE id=?", (post_id,))
+    bump_feed_version(conn)
+
+def bump_commented_posts(conn, user_id):
+    """Invalidate the cached cards of every post user_id commented on (their name/avatar is baked in)"""
+    conn.execute("""
+        UPDATE posts SET version = COALESCE(version, 0) + 1
+        WHERE id IN (SELECT post_id FROM comments WHERE user_id=?)
+    """, (user_id,))
+    bump_feed_version(conn)
+
+def post_card_key(post):
+    """Cache key: post id + version + the joined author/audio fields shown on the card"""
+    joined = f"{post['username']}|{post['avatar']}|{post['user_subscription']}|{post['user_badge']}|{post['audio_duration']}"
+    return f"post:{post['id']}:{post['version'] or 0}:{zlib.crc32(joined.encode()):x}"
+
+def fill_fragment(html, viewer_id, online_ids):
+    """Resolve the per-viewer markers left in a cached fragment"""
+    html = OWNER_BLOCK_RE.sub(lambda m: m.group(2) if int(m.group(1)) == viewer_id else '', html)
+    return ONLINE_SLOT_RE.sub(lambda m: ONLINE_BADGE if int(m.group(1)) in online_ids else '', html)
+
+# Feed row: post + author + like count + parsed audio metadata
+FEED_POST_COLUMNS = f"""posts.*, users.username, users.avatar, users.subscription AS user_subscription, users.badge AS user_badge,
+        (SELECT COUNT(*) FROM likes WHERE likes.post_id = posts.id) AS like_count,
+        {AUDIO_COLUMNS}"""
+FEED_POST_JOINS = """JOIN users ON posts.user_id = users.id AND NOT users.retired
+        LEFT JOIN audio_metadata am ON am.path = posts.music"""
+
+def get_comments_by_post(conn, post_ids):
+    """{post_id: [comment rows with username/avatar]} for many posts in batched IN queries"""
+    comments_by_post = {}
+    post_ids = list(post_ids)
+    for i in range(0, len(post_ids), 500):
+        chunk = post_ids[i:i + 500]
+        placeholders = ','.join('?' for _ in chunk)
+        for comment in conn.execute(f"""
+            SELECT comments.*, users.username, users.avatar
+            FROM comments JOIN users ON comments.user_id = users.id
+            WHERE comments.post_id IN ({placeholders}) AND NOT users.retired
+            ORDER BY comments.id
+        """, chunk):
+            comments_by_post.setdefault(comment["post_id"], []).append(comment)
+    return comments_by_post
+
+def get_story_strip(conn, viewer_id):
+    """Live stories for the forum strip, newest first, grouped {user_id: [story dicts]}"""
+    blocked = social_graph.block_set(conn, viewer_id)
+    stories = conn.execute("""
+        SELECT stories.*, users.username, users.avatar, users.subscription AS user_subscription, users.badge AS user_badge
+        FROM stories JOIN users ON stories.user_id = users.id
+        WHERE stories.expires_at > CURRENT_TIMESTAMP AND NOT users.retired
+        ORDER BY stories.created_at DESC
+        LIMIT ?
+    """, (STORY_STRIP_LIMIT,)).fetchall()
+
+    stories_by_user = {}
+    for s in social_graph.without_blocked(stories, blocked):
+        sd = dict(s)
+        sd["image_url"] = file_url_filter(sd["image"])
+        stories_by_user.setdefault(sd["user_id"], []).append(sd)
+    return stories_by_user
+
+def render_post_cards(conn, posts, viewer_id):
+    """
+    Attach rendered card HTML to each post dict as post["card_html"].
+
+    Cards come from POST_CARD_CACHE; only posts whose version changed are
+    re-rendered, and their comments are loaded in one batched query.
+    """
+    missing = []
+    for post in posts:
+        post["card_key"] = post_card_key(post)
+        html = POST_CARD_CACHE.get(post["card_key"])
+        if html is None:
+            missing.append(post)
+        else:
+            post["card_html"] = html
+
+    if missing:
+        comments_by_post = get_comments_by_post(conn, [post["id"] for post in missing])
+        template = app.jinja_env.get_template("_post_card.html")
+        for post in missing:
+            post["comments"] = comments_by_post.get(post["id"], [])
+            html = template.render(post=post)
+            POST_CARD_CACHE.set(post["card_key"], html)
+            post["card_html"] = html
+
+    online_ids = get_online_user_ids(conn, {post["user_id"] for post in posts})
+    for post in posts:
+        post["card_html"] = Markup(fill_fragment(post["card_html"], viewer_id, online_ids))
+
+# -----------------------
+# Home timelines (fan-out on write)
+# -----------------------
+# New posts are pushed into the timelines of the author's followers and friends
+# by the background worker; authors with a bigger audience than FANOUT_MAX_DEGREE
+# are pulled at read time instead.
+FANOUT_BATCH = 500
+FANOUT_MAX_DEGREE = 5000
+TIMELINE_CAP = 800
+TIMELINE_TRIM_EVERY = 50    # trim recipients' timelines on every Nth post
+TIMELINE_BACKFILL = 50      # posts copied in when a follow/friendship starts
+
+# Everyone who sees :author's posts in their timeline (including the author)
+AUDIENCE_SQL = """
+    SELECT follower_id FROM followers WHERE following_id = :author
+    UNION
+    SELECT friend_id FROM friend_edges WHERE user_id = :author AND status = 'accepted'
+    UNION
+    SELECT :author
+"""
+
+def trim_timelines(conn, user_ids, cap=TIMELINE_CAP):
+    """Keep only the newest `cap` entries of each given timeline"""
+    user_ids = list(user_ids)
+    for i in range(0, len(user_ids), FANOUT_BATCH):
+        chunk = user_ids[i:i + FANOUT_BATCH]
+        placeholders = ','.join('?' for _ in chunk)
+        conn.execute(f"""
+            DELETE FROM timelines WHERE rowid IN (
+                SELECT rowid FROM (
+                    SELECT rowid, ROW_NUMBER() OVER (
+                        PARTITION BY user_id ORDER BY created_at DESC, post_id DESC
+                    ) AS rn
+                    FROM timelines WHERE user_id IN ({placeholders})
+                ) WHERE rn > ?
+            )
+        """, chunk + [cap])
+        conn.commit()
+
+def fan_out_post(post_id):
+    """Append a new post to its audience's timelines in batched transactions (task worker)"""
+    conn = get_db_connection()
+    try:
+        post = conn.execute("SELECT id, user_id, created_at FROM posts WHERE id=?", (post_id,)).fetchone()
+        if not post:
+            return
+        author_id = post["user_id"]
+        audience = [row[0] for row in conn.execute(AUDIENCE_SQL, {"author": author_id})]
+
+        # High-degree authors switch to fan-out-on-read
+        high_degree = len(audience) > FANOUT_MAX_DEGREE
+        conn.execute("UPDATE users SET fanout_on_read=? WHERE id=?", (int(high_degree), author_id))
+        conn.commit()
+        if high_degree:
+            audience = [author_id]
+
+        for i in range(0, len(audience), FANOUT_BATCH):
+            try:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO timelines (user_id, post_id, author_id, created_at) VALUES (?, ?, ?, ?)",
+                    [(uid, post_id, author_id, post["created_at"]) for uid in audience[i:i + FANOUT_BATCH]]
+                )
+                conn.commit()
+            except sqlite3.IntegrityError:
+                # The post (or a follower's account) was deleted mid fan-out
+                conn.rollback()
+                return
+
+        if post_id % TIMELINE_TRIM_EVERY == 0:
+            trim_timelines(conn, audience)
+    finally:
+        conn.close()
+
+def refresh_timeline_edge(user_id, author_id):
+    """
+    After a follow/friendship change: backfill the author's recent posts into
+    user_id's timeline if they are still in the audience, otherwise remove them.
+    """
+    conn = get_db_connection()
+    try:
+        in_audience = conn.execute(
+            f"SELECT 1 FROM ({AUDIENCE_SQL}) WHERE follower_id = :user",
+            {"author": author_id, "user": user_id}
+        ).fetchone() is not None
+        if in_audience:
+            conn.execute("""
+                INSERT OR IGNORE INTO timelines (user_id, post_id, author_id, created_at)
+                SELECT ?, id, user_id, created_at FROM posts
+                WHERE user_id=? ORDER BY created_at DESC LIMIT ?
+            """, (user_id, author_id, TIMELINE_BACKFILL))
+        else:
+            conn.execute("DELETE FROM timelines WHERE user_id=? AND author_id=?", (user_id, author_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+def queue_timeline_edge(user_a, user_b, mutual=True):
+    """Schedule refresh_timeline_edge for a changed relationship (both directions when mutual)"""
+    tasks.enqueue(refresh_timeline_edge, user_a, user_b)
+    if mutual:
+        tasks.enqueue(refresh_timeline_edge, user_b, user_a)
+
+def get_timeline_post_ids(conn, user_id, limit=TIMELINE_CAP):
+    """
+    Post ids from the user's network, newest first: one range scan of the
+    stored timeline plus recent posts of followed/friend high-degree authors.
+    """
+    ids = [row[0] for row in conn.execute("""
+        SELECT post_id FROM timelines
+        WHERE user_id=?
+        ORDER BY created_at DESC
+        LIMIT ?
+    """, (user_id, limit))]
+    ids += [row[0] for row in conn.execute("""
+        SELECT posts.id FROM posts
+        JOIN users ON users.id = posts.user_id AND users.fanout_on_read = 1
+        WHERE posts.user_id IN (
+            SELECT following_id FROM followers WHERE follower_id = :user
+            UNION
+            SELECT friend_id FROM friend_edges WHERE user_id = :user AND status = 'accepted'
+        )
+        ORDER BY posts.created_at DESC
+        LIMIT :limit
+    """, {"user": user_id, "limit": limit})]
+    return ids
+
 # -----------------------
 # Community / Forum
 # -----------------------
+# Most recent posts considered for personalized ranking
+FEED_CANDIDATE_WINDOW = 500
+
 @app.route("/forum", methods=["GET","POST"])
 def forum():
     if "user_id" not in session:
@@ -1157,72 +2598,89 @@ def forum():
             music_name = save_upload_file(music, 'music')
 
         if content or filename or music_name:
-            conn.execute("""
+            cur = conn.execute("""
                 INSERT INTO posts (user_id,content,image,music,music_title,tags)
                 VALUES (?,?,?,?,?,?)
             """,(session["user_id"], content, filename, music_name, music_title, tags))
+            if filename:
+                index_media(conn, 'forum_post', cur.lastrowid)
+            tag_index.index_post_tags(conn, cur.lastrowid, tags)
+            bump_user_version(conn, session["user_id"])
+            bump_feed_version(conn)
             conn.commit()
+            tasks.enqueue(fan_out_post, cur.lastrowid)
+            queue_audio_metadata(music_name)
             return redirect("/forum")
 
+    # Revalidation: feed version + the viewer fields that reorder it + next story expiry
+    next_story_expiry = conn.execute(
+        "SELECT MIN(expires_at) FROM stories WHERE expires_at > CURRENT_TIMESTAMP"
+    ).fetchone()[0]
+    etag = page_etag('forum', get_feed_version(conn), user["content_version"],
+                     user["interests"], user["subscription"], next_story_expiry)
+    if request.method == "GET" and is_not_modified(etag):
+        conn.close()
+        return not_modified(etag)
+
     # Get user interests for personalized feed
     user_interests = user["interests"] or ""
     user_interests_list = [i.strip().lower() for i in user_interests.split(",") if i.strip()]
     
-    posts = conn.execute("""
-        SELECT posts.*, users.username, users.avatar, users.subscription AS user_subscription, users.badge AS user_badge,
-        (SELECT COUNT(*) FROM likes WHERE likes.post_id = posts.id) AS like_count
-        FROM posts JOIN users ON posts.user_id = users.id
+    # Rank a bounded window of recent posts rather than the whole table
+    posts = conn.execute(f"""
+        SELECT {FEED_POST_COLUMNS}
+        FROM posts {FEED_POST_JOINS}
         ORDER BY posts.created_at DESC
-    """).fetchall()
+        LIMIT ?
+    """, (FEED_CANDIDATE_WINDOW,)).fetchall()
+
+    # Posts from followed users and friends are ranked even when older than the window
+    network_ids = set(get_timeline_post_ids(conn, session["user_id"]))
+    missing = network_ids - {p["id"] for p in posts}
+    if missing:
+        posts += fetch_by_ids(conn, f"""
+            SELECT {FEED_POST_COLUMNS}
+            FROM posts {FEED_POST_JOINS}
+            WHERE posts.id IN ({{ids}})
+        """, missing)
+
+    # Hide posts from anyone the viewer blocked or was blocked by
+    posts = social_graph.without_blocked(posts, social_graph.block_set(conn, session["user_id"]))
+
+    # Count how many user interests match each post's tags (precomputed tag ids)
+    interest_sets = tag_index.expand_interests(conn, user_interests_list)
+    tag_ids_by_post = tag_index.get_post_tag_ids(conn, [p["id"] for p in posts]) if interest_sets else {}
+    scores = tag_index.score_posts([tag_ids_by_post.get(p["id"], ()) for p in posts], interest_sets)
 
     final_posts = []
-    for p in posts:
-        comments = conn.execute("""
-            SELECT comments.*, users.username, users.avatar
-            FROM comments JOIN users ON comments.user_id = users.id
-            WHERE comments.post_id=?
-        """,(p["id"],)).fetchall()
-
-        post_dict = {**dict(p), "comments": comments}
-        
-        # Calculate interest match score
-        post_tags = (p["tags"] or "").lower()
-        post_tags_list = [t.strip() for t in post_tags.split(",") if t.strip()]
-        
-        # Count how many user interests match this post's tags
-        match_score = sum(1 for interest in user_interests_list 
-                         if any(interest in tag or tag in interest for tag in post_tags_list))
-        
+    for p, match_score in zip(posts, scores):
+        post_dict = dict(p)
         post_dict["interest_score"] = match_score
         
         # Premium users get priority
         is_premium = 1 if p["user_subscription"] == "premium" else 0
         post_dict["is_premium"] = is_premium
+        post_dict["in_network"] = 1 if p["id"] in network_ids and p["user_id"] != session["user_id"] else 0
         
         final_posts.append(post_dict)
     
-    # Sort posts: Premium users first, then highest interest match, then by creation date
-    final_posts.sort(key=lambda x: (x["is_premium"], x["interest_score"], x["created_at"]), reverse=True)
+    # Sort posts: Premium users first, then followed users and friends, then highest interest match, then by creation date
+    final_posts.sort(key=lambda x: (x["is_premium"], x["in_network"], x["interest_score"], x["created_at"]), reverse=True)
 
-    stories = conn.execute("""
-        SELECT stories.*, users.username, users.avatar, users.subscription AS user_subscription, users.badge AS user_badge
-        FROM stories JOIN users ON stories.user_id = users.id
-        ORDER BY stories.created_at DESC
-    """).fetchall()
+    # Cards are served from the fragment cache; only changed posts render
+    render_post_cards(conn, final_posts, session["user_id"])
 
-    # convert to plain dictionaries and group by user so each circle represents one person
-    stories_by_user = {}
-    for s in stories:
-        sd = dict(s)
-        uid = sd["user_id"]
-        stories_by_user.setdefault(uid, []).append(sd)
+    # grouped by user so each circle represents one person
+    stories_by_user = get_story_strip(conn, session["user_id"])
 
     conn.close()
 
-    return render_template("forum.html",
-                           posts=final_posts,
-                           stories_by_user=stories_by_user,
-                           user=user)
+    maybe_sweep_expired_stories()
+
+    return with_etag(render_template("forum.html",
+                                     posts=final_posts,
+                                     stories_by_user=stories_by_user,
+                                     user=user), etag)
 
 # -----------------------
 # Story Upload
@@ -1245,10 +2703,12 @@ def add_story():
         return redirect(next_url)
 
     conn = get_db_connection()
-    conn.execute("""
-        INSERT INTO stories (user_id,content,image)
-        VALUES (?,?,?)
+    conn.execute(f"""
+        INSERT INTO stories (user_id,content,image,expires_at)
+        VALUES (?,?,?,datetime('now', '+{STORY_TTL_HOURS} hours'))
     """,(session["user_id"], content, filename))
+    bump_user_version(conn, session["user_id"])
+    bump_feed_version(conn)
     conn.commit()
     conn.close()
 
@@ -1265,6 +2725,8 @@ def delete_story(story_id):
         DELETE FROM stories 
         WHERE id = ? AND user_id = ?
     """, (story_id, session["user_id"]))
+    bump_user_version(conn, session["user_id"])
+    bump_feed_version(conn)
 
     conn.commit()
     conn.close()
@@ -1284,7 +2746,8 @@ def reply_story(story_id):
 
     conn = get_db_connection()
     story = conn.execute(
-        "SELECT id, user_id FROM stories WHERE id=?",
+        """SELECT stories.id, stories.user_id FROM stories JOIN users ON users.id = stories.user_id
+           WHERE stories.id=? AND stories.expires_at > CURRENT_TIMESTAMP AND NOT users.retired""",
         (story_id,)
     ).fetchone()
 
@@ -1300,6 +2763,12 @@ def reply_story(story_id):
             return jsonify({"error": "self"}), 400
         return redirect("/forum")
 
+    if social_graph.user_graph(conn, session["user_id"]).is_blocked_with(story["user_id"]):
+        conn.close()
+        if request.headers.get("X-Requested-With") == "XMLHttpRequest":
+            return jsonify({"error": "blocked"}), 403
+        return redirect("/forum")
+
     msg_content = f"Story reply: {content}"
     conn.execute(
         "INSERT INTO messages (sender_id, receiver_id, content, sticker) VALUES (?, ?, ?, ?)",
@@ -1313,6 +2782,63 @@ def reply_story(story_id):
 
     return redirect(f"/messages/{story['user_id']}")
 
+# -----------------------
+# Story expiry
+# -----------------------
+_last_story_sweep = 0.0
+
+def sweep_expired_stories(batch_size=STORY_SWEEP_BATCH, max_batches=None):
+    """
+    Delete expired stories and their images in batches.
+
+    Each batch is its own short transaction on the expires_at index so the
+    write lock is released between batches. Returns the number deleted.
+    """
+    deleted = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        conn = get_db_connection()
+        try:
+            expired = conn.execute("""
+                SELECT id, image FROM stories
+                WHERE expires_at <= CURRENT_TIMESTAMP
+                ORDER BY expires_at
+                LIMIT ?
+            """, (batch_size,)).fetchall()
+            if not expired:
+                break
+            ids = [row["id"] for row in expired]
+            placeholders = ','.join('?' for _ in ids)
+            conn.execute(f"DELETE FROM stories WHERE id IN ({placeholders})", ids)
+            conn.commit()
+        finally:
+            conn.close()
+
+        # One unreachable file must not stop the sweep (the row is already gone)
+        for row in expired:
+            try:
+                delete_upload_file(row["image"])
+            except Exception as e:
+                print(f"⚠️  Could not delete story image {row['image']}: {e}")
+        deleted += len(expired)
+        batches += 1
+        if len(expired) < batch_size:
+            break
+    return deleted
+
+def maybe_sweep_expired_stories():
+    """
+    Queue one sweep batch at most every STORY_SWEEP_INTERVAL seconds per worker.
+    The sweep runs on the task worker, off the request that triggered it.
+    """
+    global _last_story_sweep
+    import time
+    now = time.time()
+    if now - _last_story_sweep < STORY_SWEEP_INTERVAL:
+        return
+    _last_story_sweep = now
+    tasks.enqueue(sweep_expired_stories, max_batches=1)
+
 # -----------------------
 # Album Upload
 # -----------------------
@@ -1332,10 +2858,12 @@ def add_album_image():
         return redirect("/profile")
 
     conn = get_db_connection()
-    conn.execute(
+    cur = conn.execute(
         "INSERT INTO album_images (user_id, image, caption) VALUES (?, ?, ?)",
         (session["user_id"], image_path, caption)
     )
+    index_media(conn, 'album', cur.lastrowid)
+    bump_user_version(conn, session["user_id"])
     conn.commit()
     conn.close()
 
@@ -1351,6 +2879,8 @@ def delete_album_image(img_id):
         "DELETE FROM album_images WHERE id=? AND user_id=?",
         (img_id, session["user_id"])
     )
+    unindex_media(conn, 'album', img_id, session["user_id"])
+    bump_user_version(conn, session["user_id"])
     conn.commit()
     conn.close()
     
@@ -1411,6 +2941,7 @@ def shop():
         # save main file if present
         if main_file and main_file.filename and allowed_file(main_file.filename):
             file_path = save_upload_file(main_file, 'products')
+            queue_audio_metadata(file_path)
 
         # save up to 5 images
         for img in images[:5]:
@@ -1429,6 +2960,7 @@ def shop():
                 """,
                 (session["user_id"], name, description, images_str, file_path, product_type, price)
             )
+            bump_user_version(conn, session["user_id"])
             conn.commit()
         return redirect("/shop")
 
@@ -1473,6 +3005,7 @@ def delete_product(prod_id):
         "DELETE FROM products WHERE id=? AND user_id=?",
         (prod_id, session['user_id'])
     )
+    bump_user_version(conn, session['user_id'])
     conn.commit()
     conn.close()
     return redirect('/shop')
@@ -1518,6 +3051,9 @@ def view_cart():
     conn.close()
     return render_template('cart.html', products=products)
 
+# Each rendered payment form gets its own key, so submitting it twice charges once
+app.jinja_env.globals['idempotency_key'] = lambda: uuid.uuid4().hex
+
 @app.route('/cart/checkout', methods=['POST'])
 def checkout():
     if 'user_id' not in session:
@@ -1526,103 +3062,58 @@ def checkout():
     if session.get('user_id') != 1:
         return redirect('/forum')
     
-    conn = get_db_connection()
-    user = conn.execute("SELECT wallet_balance FROM users WHERE id=?", (session['user_id'],)).fetchone()
-    
-    if not user:
-        conn.close()
-        return redirect('/login')
-    
     cart = session.get('cart', [])
     if not cart:
-        conn.close()
         return redirect('/cart?error=empty')
     
-    # Get product prices
-    placeholders = ','.join('?' for _ in cart)
-    query = f"SELECT id, price FROM products WHERE id IN ({placeholders})"
-    products = conn.execute(query, cart).fetchall()
-    
-    total_price = sum(float(p['price']) for p in products)
-    
-    # Check if user has enough balance
-    if float(user['wallet_balance']) < total_price:
-        conn.close()
-        return redirect('/cart?error=insufficient_funds')
-    
-    # Deduct from wallet
-    conn.execute(
-        "UPDATE users SET wallet_balance = wallet_balance - ? WHERE id=?",
-        (total_price, session['user_id'])
-    )
-    
-    # Record transaction
-    conn.execute(
-        "INSERT INTO transactions (user_id, type, amount, description) VALUES (?, 'purchase', ?, ?)",
-        (session['user_id'], -total_price, f"Purchased {len(cart)} product(s)")
-    )
-    
-    # Create purchase records
-    for prod_id in cart:
-        conn.execute(
-            "INSERT INTO purchases (user_id, product_id, purchased_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
-            (session['user_id'], prod_id)
+    # Balance check, debit, transaction and purchase rows commit together;
+    # a resubmitted form replays the recorded result instead of charging again
+    conn = get_db_connection()
+    try:
+        wallet_service.checkout(
+            conn, session['user_id'], cart,
+            key=wallet_service.clean_key(request.form.get('idempotency_key'))
         )
-    
-    conn.commit()
-    conn.close()
+    except wallet_service.EmptyCart:
+        session['cart'] = []
+        return redirect('/cart?error=empty')
+    except wallet_service.InsufficientFunds:
+        return redirect('/cart?error=insufficient')
+    finally:
+        conn.close()
     
     # Clear cart
     session['cart'] = []
     
     return redirect('/cart?success=1')
 
+SUBSCRIPTION_PRICES = {'basic': 4.0, 'pro': 12.0, 'premium': 24.0}
+
 @app.route('/subscription/buy/<plan>', methods=['POST'])
 def buy_subscription(plan):
     if 'user_id' not in session:
         return redirect('/login')
     
-    if plan not in ('basic', 'pro', 'premium'):
+    if plan not in SUBSCRIPTION_PRICES:
         return redirect('/subscription?error=invalid_plan')
     
-    prices = {'basic': 4.0, 'pro': 12.0, 'premium': 24.0}
-    price = prices[plan]
-    
     conn = get_db_connection()
-    user = conn.execute(
-        "SELECT wallet_balance, subscription FROM users WHERE id=?",
-        (session['user_id'],)
-    ).fetchone()
-    
-    if not user:
-        conn.close()
-        return redirect('/login')
-    
-    # Check if user already has this subscription
-    if user['subscription'] == plan:
-        conn.close()
+    try:
+        result = wallet_service.buy_subscription(
+            conn, session['user_id'], plan, SUBSCRIPTION_PRICES[plan],
+            key=wallet_service.clean_key(request.form.get('idempotency_key'))
+        )
+        if not result['replayed']:
+            # Subscription tier changes badges and premium ordering in the feed
+            bump_user_version(conn, session['user_id'])
+            bump_feed_version(conn)
+            conn.commit()
+    except wallet_service.AlreadySubscribed:
         return redirect('/subscription?error=already_subscribed')
-    
-    # Check if user has enough balance
-    if float(user['wallet_balance']) < price:
+    except wallet_service.InsufficientFunds:
+        return redirect('/subscription?error=insufficient')
+    finally:
         conn.close()
-        return redirect('/subscription?error=insufficient_funds')
-    
-    # Deduct from wallet
-    new_balance = float(user['wallet_balance']) - price
-    conn.execute(
-        "UPDATE users SET wallet_balance=?, subscription=? WHERE id=?",
-        (new_balance, plan, session['user_id'])
-    )
-    
-    # Record transaction
-    conn.execute(
-        "INSERT INTO transactions (user_id, type, amount, description) VALUES (?, 'subscription', ?, ?)",
-        (session['user_id'], -price, f"Purchased {plan.capitalize()} subscription")
-    )
-    
-    conn.commit()
-    conn.close()
     
     return redirect('/subscription?success=1')
 
@@ -1680,14 +3171,33 @@ def wallet():
         (session['user_id'],)
     ).fetchone()
     
-    transactions = conn.execute(
-        "SELECT * FROM transactions WHERE user_id=? ORDER BY created_at DESC LIMIT 20",
-        (session['user_id'],)
-    ).fetchall()
+    transactions, next_cursor = get_transaction_page(
+        conn, session['user_id'], request.args.get('cursor')
+    )
     
     conn.close()
     
-    return render_template('wallet.html', user=user, transactions=transactions)
+    return render_template('wallet.html', user=user, transactions=transactions, next_cursor=next_cursor)
+
+WALLET_PAGE_SIZE = 20
+
+def get_transaction_page(conn, user_id, cursor=None, limit=WALLET_PAGE_SIZE):
+    """
+    One keyset page of a user's wallet history, newest first, read from
+    idx_transactions_user_created. cursor is the "created_at|id" of the last
+    row already shown; returns (rows, next_cursor).
+    """
+    after, after_params = keyset_condition(cursor)
+    rows = conn.execute(f"""
+        SELECT * FROM transactions
+        WHERE user_id=?{after}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    """, [user_id] + after_params + [limit + 1]).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = f"{rows[-1]['created_at']}|{rows[-1]['id']}" if has_more else None
+    return rows, next_cursor
 
 # -----------------------
 # Applications (VIP, Ambassador, Team)
@@ -1894,16 +3404,23 @@ def profile():
             SET bio=?, avatar=?, username=?, badge=?, is_private=?, allow_messages=?, hide_followers=?, interests=?
             WHERE id=?
         """, (bio, avatar, username, badge, int(is_private), int(allow_messages), int(hide_followers), interests, session["user_id"]))
+        bump_user_version(conn, session["user_id"])
+        bump_feed_version(conn)
+        # Comment rows on cached cards show the commenter's name and avatar
+        if username != user["username"] or avatar != user["avatar"]:
+            bump_commented_posts(conn, session["user_id"])
 
         conn.commit()
         conn.close()
         return redirect("/profile")
 
     # Load user's profile posts
-    posts = conn.execute("""
-        SELECT profile_posts.*, users.username, users.avatar, users.subscription AS user_subscription, users.badge AS user_badge
+    posts = conn.execute(f"""
+        SELECT profile_posts.*, users.username, users.avatar, users.subscription AS user_subscription, users.badge AS user_badge,
+        {AUDIO_COLUMNS}
         FROM profile_posts
         JOIN users ON profile_posts.user_id = users.id
+        LEFT JOIN audio_metadata am ON am.path = profile_posts.music
         WHERE profile_posts.user_id=?
         ORDER BY profile_posts.created_at DESC
     """, (session["user_id"],)).fetchall()
@@ -1922,21 +3439,19 @@ def profile():
     stories = conn.execute("""
         SELECT id, image, created_at
         FROM stories
-        WHERE user_id=?
+        WHERE user_id=? AND expires_at > CURRENT_TIMESTAMP
         ORDER BY created_at DESC
     """, (session["user_id"],)).fetchall()
-    stories_list = [dict(s) for s in stories]
+    stories_list = [dict(s, image_url=file_url_filter(s["image"])) for s in stories]
 
     # Get follower counts
-    follower_count = conn.execute(
-        "SELECT COUNT(*) as count FROM followers WHERE following_id=?",
-        (session["user_id"],)
-    ).fetchone()["count"]
-    
-    following_count = conn.execute(
-        "SELECT COUNT(*) as count FROM followers WHERE follower_id=?",
-        (session["user_id"],)
-    ).fetchone()["count"]
+    stats = get_user_stats(conn, session["user_id"])
+    follower_count = stats["follower_count"]
+    following_count = stats["following_count"]
+
+    graph = social_graph.user_graph(conn, session["user_id"])
+
+    suggestions = get_people_suggestions(conn, graph)
 
     conn.close()
 
@@ -1948,10 +3463,29 @@ def profile():
         products=products,
         stories=stories_list,
         follower_count=follower_count,
-        following_count=following_count
+        following_count=following_count,
+        suggestions=suggestions
     )
 
 
+SUGGESTIONS_SHOWN = 6
+
+def get_people_suggestions(conn, graph, limit=SUGGESTIONS_SHOWN):
+    """Top precomputed suggestions, skipping anyone the user connected with or blocked since the last run"""
+    rows = conn.execute("""
+        SELECT u.id, u.username, u.avatar, u.subscription, s.mutual_friends, s.mutual_follows
+        FROM people_suggestions s
+        JOIN users u ON u.id = s.suggested_id
+        WHERE s.user_id=?
+        ORDER BY s.score DESC
+        LIMIT ?
+    """, (graph.user_id, limit * 2)).fetchall()
+    return [
+        row for row in rows
+        if row["id"] not in graph.edges and row["id"] not in graph.following
+        and not graph.is_blocked_with(row["id"])
+    ][:limit]
+
 # -----------------------
 # Photos Gallery
 # -----------------------
@@ -1968,75 +3502,39 @@ def photos():
         (session["user_id"],)
     ).fetchone()
     
-    # Get all photos from profile posts
-    post_photos = conn.execute("""
-        SELECT id, image, content AS caption, created_at, 
-               strftime('%Y-%m-%d', created_at) AS date
-        FROM profile_posts
-        WHERE user_id=? AND image IS NOT NULL AND image != ''
-        ORDER BY created_at DESC
-    """, (session["user_id"],)).fetchall()
-    
-    # Get all photos from forum posts
-    forum_photos = conn.execute("""
-        SELECT id, image, content AS caption, created_at,
-               strftime('%Y-%m-%d', created_at) AS date
-        FROM posts
-        WHERE user_id=? AND image IS NOT NULL AND image != ''
-        ORDER BY created_at DESC
-    """, (session["user_id"],)).fetchall()
-    
-    # Get all photos from album
-    album_photos = conn.execute("""
-        SELECT id, image, caption, created_at,
-               strftime('%Y-%m-%d', created_at) AS date
-        FROM album_images
-        WHERE user_id=?
-        ORDER BY created_at DESC
-    """, (session["user_id"],)).fetchall()
+    if not user:
+        conn.close()
+        session.clear()
+        return redirect("/login")
+
+    etag = page_etag('photos', user["content_version"])
+    if is_not_modified(etag):
+        conn.close()
+        return not_modified(etag)
+
+    # First page from the unified media index; older pages load from /api/photos
+    all_photos, next_cursor = get_media_page(conn, session["user_id"])
+    photo_count = conn.execute(
+        "SELECT COUNT(*) FROM media_items WHERE user_id=?",
+        (session["user_id"],)
+    ).fetchone()[0]
     
     conn.close()
     
-    # Combine all photos with type indicator
-    all_photos = []
-    
-    for photo in post_photos:
-        all_photos.append({
-            'id': photo['id'],
-            'image': photo['image'],
-            'caption': photo['caption'] or '',
-            'content': photo['caption'] or '',
-            'date': photo['date'],
-            'type': 'post',
-            'timestamp': photo['created_at']
-        })
-    
-    for photo in forum_photos:
-        all_photos.append({
-            'id': photo['id'],
-            'image': photo['image'],
-            'caption': photo['caption'] or '',
-            'content': photo['caption'] or '',
-            'date': photo['date'],
-            'type': 'forum_post',
-            'timestamp': photo['created_at']
-        })
-    
-    for photo in album_photos:
-        all_photos.append({
-            'id': photo['id'],
-            'image': photo['image'],
-            'caption': photo['caption'] or '',
-            'content': '',
-            'date': photo['date'],
-            'type': 'album',
-            'timestamp': photo['created_at']
-        })
+    return with_etag(render_template("photos.html", user=user, all_photos=all_photos,
+                                     next_cursor=next_cursor, photo_count=photo_count), etag)
+
+@app.route("/api/photos")
+def api_photos():
+    """Older pages of the current user's photo gallery"""
+    if "user_id" not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
     
-    # Sort by timestamp (newest first)
-    all_photos.sort(key=lambda x: x['timestamp'], reverse=True)
+    conn = get_db_connection()
+    photos, next_cursor = get_media_page(conn, session["user_id"], request.args.get("cursor"))
+    conn.close()
     
-    return render_template("photos.html", user=user, all_photos=all_photos)
+    return jsonify({'photos': photos, 'next_cursor': next_cursor})
 
 
 # -----------------------
@@ -2066,12 +3564,16 @@ def add_profile_post():
 
     if content or image_name or music_name:
         conn = get_db_connection()
-        conn.execute("""
+        cur = conn.execute("""
             INSERT INTO profile_posts (user_id,content,image,music,music_title)
             VALUES (?,?,?,?,?)
         """,(session["user_id"],content,image_name,music_name,music_title))
+        if image_name:
+            index_media(conn, 'post', cur.lastrowid)
+        bump_user_version(conn, session["user_id"])
         conn.commit()
         conn.close()
+        queue_audio_metadata(music_name)
 
     return redirect("/profile")
 
@@ -2089,6 +3591,7 @@ def like_post(post_id):
     try:
         conn.execute("INSERT INTO likes (post_id,user_id) VALUES (?,?)",
                      (post_id, session["user_id"]))
+        bump_post_version(conn, post_id)
         conn.commit()
     except sqlite3.IntegrityError:
         pass
@@ -2106,12 +3609,15 @@ def comment_post(post_id):
         return redirect("/forum")
 
     conn = get_db_connection()
-    conn.execute("""
-        INSERT INTO comments (post_id, user_id, content)
-        VALUES (?, ?, ?)
-    """, (post_id, session["user_id"], content))
-
-    conn.commit()
+    try:
+        conn.execute("""
+            INSERT INTO comments (post_id, user_id, content)
+            VALUES (?, ?, ?)
+        """, (post_id, session["user_id"], content))
+        bump_post_version(conn, post_id)
+        conn.commit()
+    except sqlite3.IntegrityError:
+        pass  # the post was deleted
     conn.close()
 
     return redirect("/forum")
@@ -2141,6 +3647,7 @@ def delete_comment(comment_id):
 
     # Delete the comment
     conn.execute("DELETE FROM comments WHERE id=?", (comment_id,))
+    bump_post_version(conn, comment["post_id"])
     conn.commit()
     conn.close()
 
@@ -2159,6 +3666,10 @@ def delete_post(post_id):
         "DELETE FROM posts WHERE id=? AND user_id=?",
         (post_id, session['user_id'])
     )
+    # Likes, comments, tags and timeline entries go with it (ON DELETE CASCADE)
+    unindex_media(conn, 'forum_post', post_id, session['user_id'])
+    bump_user_version(conn, session['user_id'])
+    bump_feed_version(conn)
 
     conn.commit()
     conn.close()
@@ -2182,25 +3693,23 @@ def friends():
 
     # accepted friends
     friends = conn.execute("""
-        SELECT u.* FROM users u
-        JOIN friendships f 
-          ON ((f.user_id = ? AND f.friend_id = u.id) 
-           OR (f.friend_id = ? AND f.user_id = u.id))
-        WHERE f.status = 'accepted'
-          AND u.id != ?
-    """, (session["user_id"], session["user_id"], session["user_id"])).fetchall()
+        SELECT u.* FROM friend_edges e
+        JOIN users u ON u.id = e.friend_id
+        WHERE e.user_id = ? AND e.status = 'accepted'
+    """, (session["user_id"],)).fetchall()
 
     # pending requests
     pending_requests = conn.execute("""
-        SELECT f.id,
+        SELECT e.request_id AS id,
                u.id AS user_id,
                u.username,
                u.avatar,
                u.subscription
-        FROM friendships f
-        JOIN users u ON f.user_id = u.id
-        WHERE f.friend_id = ?
-          AND f.status = 'pending'
+        FROM friend_edges e
+        JOIN users u ON u.id = e.friend_id
+        WHERE e.user_id = ?
+          AND e.status = 'pending'
+          AND e.requested_by = e.friend_id
     """, (session["user_id"],)).fetchall()
 
     conn.close()
@@ -2219,13 +3728,16 @@ def followers_page():
     conn = get_db_connection()
     
     # Get followers (users following me)
-    followers = conn.execute("""
-        SELECT u.*, 
-               EXISTS(SELECT 1 FROM followers WHERE follower_id=? AND following_id=u.id) as is_following_back
-        FROM users u
-        JOIN followers f ON f.follower_id = u.id
-        WHERE f.following_id = ?
-    """, (session["user_id"], session["user_id"])).fetchall()
+    graph = social_graph.user_graph(conn, session["user_id"])
+    followers = [
+        dict(row, is_following_back=row["id"] in graph.following)
+        for row in conn.execute("""
+            SELECT u.*
+            FROM users u
+            JOIN followers f ON f.follower_id = u.id
+            WHERE f.following_id = ?
+        """, (session["user_id"],))
+    ]
     
     # Get following (users I'm following)
     following = conn.execute("""
@@ -2251,14 +3763,14 @@ def friend_requests():
     conn = get_db_connection()
 
     requests = conn.execute("""
-        SELECT f.id AS request_id,
+        SELECT e.request_id,
                u.id AS user_id,
                u.username,
                u.avatar,
                u.subscription
-        FROM friendships f
-        JOIN users u ON f.user_id = u.id
-        WHERE f.friend_id = ? AND f.status = 'pending'
+        FROM friend_edges e
+        JOIN users u ON u.id = e.friend_id
+        WHERE e.user_id = ? AND e.status = 'pending' AND e.requested_by = e.friend_id
     """, (session["user_id"],)).fetchall()
 
     conn.close()
@@ -2272,17 +3784,35 @@ def send_friend_request(user_id):
         return redirect("/login")
 
     if user_id == session["user_id"]:
-        return redirect(f"/profile/{user_id}")
-
-    conn = get_db_connection()
-    try:
-        conn.execute(
-            "INSERT INTO friendships (user_id, friend_id, status) VALUES (?, ?, 'pending')",
-            (session["user_id"], user_id)
-        )
+        return redirect(f"/profile/{user_id}")
+
+    conn = get_db_connection()
+    if not conn.execute("SELECT 1 FROM users WHERE id=? AND NOT retired", (user_id,)).fetchone():
+        conn.close()
+        return "User not found", 404
+    edge = conn.execute(
+        "SELECT status, requested_by, request_id FROM friend_edges WHERE user_id=? AND friend_id=?",
+        (session["user_id"], user_id)
+    ).fetchone()
+    if edge is None:
+        try:
+            conn.execute(
+                "INSERT INTO friendships (user_id, friend_id, status) VALUES (?, ?, 'pending')",
+                (session["user_id"], user_id)
+            )
+            conn.commit()
+            social_graph.invalidate(session["user_id"], user_id)
+        except sqlite3.IntegrityError:
+            pass
+    elif edge["status"] == "pending" and edge["requested_by"] == user_id:
+        # They already asked us: treat the request as an accept rather than
+        # storing a second, opposite-direction row for the same pair
+        conn.execute("UPDATE friendships SET status='accepted' WHERE id=?", (edge["request_id"],))
         conn.commit()
-    except sqlite3.IntegrityError:
-        pass
+        conn.close()
+        social_graph.invalidate(session["user_id"], user_id)
+        queue_timeline_edge(session["user_id"], user_id)
+        return redirect(f"/profile/{user_id}")
     conn.close()
 
     return redirect(f"/profile/{user_id}")
@@ -2295,9 +3825,13 @@ def accept_friend(req_id):
         return redirect("/login")
 
     conn = get_db_connection()
+    req = conn.execute("SELECT user_id, friend_id FROM friendships WHERE id=?", (req_id,)).fetchone()
     conn.execute("UPDATE friendships SET status='accepted' WHERE id=?", (req_id,))
     conn.commit()
     conn.close()
+    if req:
+        social_graph.invalidate(req["user_id"], req["friend_id"])
+        queue_timeline_edge(req["user_id"], req["friend_id"])
 
     return redirect("/friend/requests")
 
@@ -2308,9 +3842,12 @@ def reject_friend(req_id):
         return redirect("/login")
 
     conn = get_db_connection()
+    req = conn.execute("SELECT user_id, friend_id FROM friendships WHERE id=?", (req_id,)).fetchone()
     conn.execute("DELETE FROM friendships WHERE id=?", (req_id,))
     conn.commit()
     conn.close()
+    if req:
+        social_graph.invalidate(req["user_id"], req["friend_id"])
 
     return redirect("/friend/requests")
 
@@ -2324,17 +3861,15 @@ def remove_friend(user_id):
 
     conn = get_db_connection()
 
-    conn.execute("""
-        DELETE FROM friendships
-        WHERE (user_id=? AND friend_id=?)
-           OR (user_id=? AND friend_id=?)
-    """, (
-        session["user_id"], user_id,
-        user_id, session["user_id"]
-    ))
+    conn.execute(
+        "DELETE FROM friendships WHERE id IN (SELECT request_id FROM friend_edges WHERE user_id=? AND friend_id=?)",
+        (session["user_id"], user_id)
+    )
 
     conn.commit()
     conn.close()
+    social_graph.invalidate(session["user_id"], user_id)
+    queue_timeline_edge(session["user_id"], user_id)
 
     return redirect("/friends")
 
@@ -2354,7 +3889,7 @@ def follow_user(user_id):
     # Check if current user is Premium
     current_user = conn.execute("SELECT subscription FROM users WHERE id=?", (session["user_id"],)).fetchone()
     # Check if target user is Premium
-    target_user = conn.execute("SELECT subscription FROM users WHERE id=?", (user_id,)).fetchone()
+    target_user = conn.execute("SELECT subscription FROM users WHERE id=? AND NOT retired", (user_id,)).fetchone()
     
     if current_user and current_user["subscription"] in ["basic", "pro", "premium"] and target_user and target_user["subscription"] in ["basic", "pro", "premium"]:
         try:
@@ -2362,7 +3897,10 @@ def follow_user(user_id):
                 "INSERT INTO followers (follower_id, following_id) VALUES (?, ?)",
                 (session["user_id"], user_id)
             )
+            bump_user_version(conn, session["user_id"], user_id)
             conn.commit()
+            social_graph.invalidate(session["user_id"], user_id)
+            queue_timeline_edge(session["user_id"], user_id, mutual=False)
             flash('✓ You are now following this user!', 'success')
         except sqlite3.IntegrityError:
             flash('You are already following this user.', 'info')
@@ -2382,8 +3920,11 @@ def unfollow_user(user_id):
         "DELETE FROM followers WHERE follower_id=? AND following_id=?",
         (session["user_id"], user_id)
     )
+    bump_user_version(conn, session["user_id"], user_id)
     conn.commit()
     conn.close()
+    social_graph.invalidate(session["user_id"], user_id)
+    queue_timeline_edge(session["user_id"], user_id, mutual=False)
     
     flash('You have unfollowed this user.', 'info')
     return redirect(f"/profile/{user_id}")
@@ -2413,11 +3954,14 @@ def block_user(user_id):
         
         # Remove any friend relationships
         conn.execute(
-            "DELETE FROM friendships WHERE (user_id=? AND friend_id=?) OR (user_id=? AND friend_id=?)",
-            (session["user_id"], user_id, user_id, session["user_id"])
+            "DELETE FROM friendships WHERE id IN (SELECT request_id FROM friend_edges WHERE user_id=? AND friend_id=?)",
+            (session["user_id"], user_id)
         )
+        bump_user_version(conn, session["user_id"], user_id)
         
         conn.commit()
+        social_graph.invalidate(session["user_id"], user_id)
+        queue_timeline_edge(session["user_id"], user_id)
     except sqlite3.IntegrityError:
         pass
     
@@ -2442,123 +3986,176 @@ def unblock_user(user_id):
         "DELETE FROM blocked_users WHERE user_id=? AND blocked_user_id=?",
         (session["user_id"], user_id)
     )
+    bump_user_version(conn, session["user_id"], user_id)
     conn.commit()
     conn.close()
+    social_graph.invalidate(session["user_id"], user_id)
     
     return redirect("/dashboard")
 
 # -----------------------
 # Public profile
 #------------------------
+def can_view_profile(conn, viewer_id, user):
+    """Private profiles are visible only to their owner and to users with a friendship row"""
+    if not user["is_private"] or viewer_id == user["id"]:
+        return True
+    return user["id"] in social_graph.user_graph(conn, viewer_id).edges
+
+# Each content section of a public profile shows this many items per page;
+# older ones come in through /profile/<id>/more/<section>
+PROFILE_SECTION_LIMIT = 10
+
+# section -> (query with an {after} slot for the keyset condition, created_at
+# column, id column). Every query is one index range scan on (user_id, created_at, id)
+PROFILE_SECTIONS = {
+    'stories': ("""
+        SELECT * FROM stories
+        WHERE user_id=? AND expires_at > CURRENT_TIMESTAMP{after}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    """, 'created_at', 'id'),
+    'profile_posts': ("""
+        SELECT profile_posts.*, users.username, users.avatar, users.subscription AS user_subscription, users.badge AS user_badge
+        FROM profile_posts
+        JOIN users ON profile_posts.user_id = users.id
+        WHERE profile_posts.user_id=?{after}
+        ORDER BY profile_posts.created_at DESC, profile_posts.id DESC
+        LIMIT ?
+    """, 'profile_posts.created_at', 'profile_posts.id'),
+    'forum_posts': ("""
+        SELECT posts.*, users.username, users.avatar, users.subscription AS user_subscription, users.badge AS user_badge
+        FROM posts
+        JOIN users ON posts.user_id = users.id
+        WHERE posts.user_id=?{after}
+        ORDER BY posts.created_at DESC, posts.id DESC
+        LIMIT ?
+    """, 'posts.created_at', 'posts.id'),
+}
+
+def load_profile_header(conn, viewer_id, user_id):
+    """
+    The profile user, their counters and the viewer's relationship to them in one query.
+
+    Returns:
+        dict: 'user' (row), 'stats', 'friendship' (dict or None), 'is_following'
+              and 'next_story_expiry'; None if the user doesn't exist
+    """
+    row = conn.execute("""
+        SELECT u.*,
+               s.friend_count, s.follower_count, s.following_count,
+               s.post_count, s.story_count, s.product_count,
+               e.status AS edge_status, e.requested_by AS edge_requested_by,
+               e.request_id AS edge_request_id,
+               EXISTS (SELECT 1 FROM followers
+                       WHERE follower_id=? AND following_id=u.id) AS viewer_follows,
+               (SELECT MIN(expires_at) FROM stories
+                WHERE user_id=u.id AND expires_at > CURRENT_TIMESTAMP) AS next_story_expiry
+        FROM users u
+        LEFT JOIN user_stats s ON s.user_id = u.id
+        LEFT JOIN friend_edges e ON e.user_id=? AND e.friend_id = u.id
+        WHERE u.id=? AND NOT u.retired
+    """, (viewer_id, viewer_id, user_id)).fetchone()
+    if row is None:
+        return None
+    edge = (row["edge_status"], row["edge_requested_by"], row["edge_request_id"])
+    return {
+        'user': row,
+        'stats': {column: row[column] or 0 for column in USER_STATS_SOURCES},
+        'edge': edge if edge[0] is not None else None,
+        'friendship': social_graph.edge_friendship(viewer_id, user_id, edge),
+        'is_following': viewer_id != user_id and bool(row["viewer_follows"]),
+        'next_story_expiry': row["next_story_expiry"],
+    }
+
+def get_profile_section(conn, section, user_id, cursor=None, limit=PROFILE_SECTION_LIMIT):
+    """
+    One keyset page of a profile section, newest first.
+
+    Returns:
+        tuple: (rows, next_cursor) where next_cursor is None on the last page
+    """
+    sql, created_column, id_column = PROFILE_SECTIONS[section]
+    after, after_params = keyset_condition(cursor, created_column, id_column)
+    rows = conn.execute(sql.format(after=after), [user_id] + after_params + [limit + 1]).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = f"{rows[-1]['created_at']}|{rows[-1]['id']}" if has_more else None
+    return rows, next_cursor
+
 @app.route("/profile/<int:user_id>")
 def view_user_profile(user_id):
     if "user_id" not in session:
         return redirect("/login")
 
     conn = get_db_connection()
+    current_user_id = session["user_id"]
 
-    user = conn.execute(
-        "SELECT * FROM users WHERE id=?",
-        (user_id,)
-    ).fetchone()
-
-    if not user:
+    # Everything the page depends on, in one query: the user and their counters,
+    # the viewer's friendship/follow state and the next story expiry
+    header = load_profile_header(conn, current_user_id, user_id)
+    if header is None:
         conn.close()
         return "User not found", 404
 
-    # Check if profile is private and if current user can view it
-    is_private = user["is_private"]
-    current_user_id = session["user_id"]
-    is_profile_owner = current_user_id == user_id
-    
-    # Check if users are friends
-    is_friends = False
-    if not is_profile_owner:
-        friendship = conn.execute("""
-            SELECT * FROM friendships
-            WHERE (user_id=? AND friend_id=?)
-               OR (user_id=? AND friend_id=?)
-        """, (
-            current_user_id, user_id,
-            user_id, current_user_id
-        )).fetchone()
-        is_friends = friendship is not None
-    
-    # If profile is private and not owner/friend, show restricted message
-    if is_private and not is_profile_owner and not is_friends:
+    user = header["user"]
+    etag = page_etag(
+        'profile', user_id, user["content_version"],
+        header["edge"], header["is_following"], header["next_story_expiry"]
+    )
+    if is_not_modified(etag):
         conn.close()
-        return render_template("public_profile.html", user=user, is_restricted=True)
-
-    profile_posts = conn.execute("""
-        SELECT profile_posts.*, users.username, users.avatar, users.subscription AS user_subscription, users.badge AS user_badge
-        FROM profile_posts
-        JOIN users ON profile_posts.user_id = users.id
-        WHERE profile_posts.user_id=?
-        ORDER BY profile_posts.created_at DESC
-    """, (user_id,)).fetchall()
-
-    forum_posts = conn.execute("""
-        SELECT posts.*, users.username, users.avatar, users.subscription AS user_subscription, users.badge AS user_badge
-        FROM posts
-        JOIN users ON posts.user_id = users.id
-        WHERE posts.user_id=?
-        ORDER BY posts.created_at DESC
-    """, (user_id,)).fetchall()
-
-    # Get user's stories
-    user_stories = conn.execute("""
-        SELECT * FROM stories 
-        WHERE user_id=? 
-        ORDER BY created_at DESC
-    """, (user_id,)).fetchall()
-
-    products = conn.execute("""
-        SELECT * FROM products WHERE user_id=? ORDER BY created_at DESC
-    """, (user_id,)).fetchall()
+        return not_modified(etag)
 
-    friendship = conn.execute("""
-        SELECT * FROM friendships
-        WHERE (user_id=? AND friend_id=?)
-           OR (user_id=? AND friend_id=?)
-    """, (
-        session["user_id"], user_id,
-        user_id, session["user_id"]
-    )).fetchone()
-
-    # Get follower counts
-    follower_count = conn.execute(
-        "SELECT COUNT(*) as count FROM followers WHERE following_id=?",
-        (user_id,)
-    ).fetchone()["count"]
-    
-    following_count = conn.execute(
-        "SELECT COUNT(*) as count FROM followers WHERE follower_id=?",
-        (user_id,)
-    ).fetchone()["count"]
-    
-    # Check if current user is following this user
-    is_following = False
-    if not is_profile_owner:
-        is_following = conn.execute(
-            "SELECT * FROM followers WHERE follower_id=? AND following_id=?",
-            (current_user_id, user_id)
-        ).fetchone() is not None
+    # If profile is private and not owner/friend, show restricted message
+    if user["is_private"] and current_user_id != user_id and header["edge"] is None:
+        conn.close()
+        return with_etag(render_template("public_profile.html", user=user, is_restricted=True,
+                                         author_online=is_recently_active(user["last_activity"])), etag)
 
+    sections = {}
+    for section in PROFILE_SECTIONS:
+        sections[section] = get_profile_section(conn, section, user_id)
     conn.close()
 
-    return render_template(
+    return with_etag(render_template(
         "public_profile.html",
         user=user,
-        profile_posts=profile_posts,
-        forum_posts=forum_posts,
-        user_stories=user_stories,
-        products=products,
-        friendship=friendship,
+        profile_posts=sections["profile_posts"][0],
+        forum_posts=sections["forum_posts"][0],
+        user_stories=sections["stories"][0],
+        next_cursors={section: page[1] for section, page in sections.items()},
+        friendship=header["friendship"],
+        author_online=is_recently_active(user["last_activity"]),
         is_restricted=False,
-        follower_count=follower_count,
-        following_count=following_count,
-        is_following=is_following
-    )
+        follower_count=header["stats"]["follower_count"],
+        following_count=header["stats"]["following_count"],
+        is_following=header["is_following"]
+    ), etag)
+
+@app.route("/profile/<int:user_id>/more/<section>")
+def profile_section_page(user_id, section):
+    """Older items of one profile section, rendered as HTML for its "load more" button"""
+    if "user_id" not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    if section not in PROFILE_SECTIONS:
+        return jsonify({'error': 'Unknown section'}), 404
+
+    conn = get_db_connection()
+    user = conn.execute("SELECT * FROM users WHERE id=? AND NOT retired", (user_id,)).fetchone()
+    if not user:
+        conn.close()
+        return jsonify({'error': 'User not found'}), 404
+    if not can_view_profile(conn, session["user_id"], user):
+        conn.close()
+        return jsonify({'error': 'This profile is private'}), 403
+
+    rows, next_cursor = get_profile_section(conn, section, user_id, request.args.get("cursor"))
+    conn.close()
+
+    html = render_template("_profile_section.html", section=section, items=rows, user=user,
+                           author_online=is_recently_active(user["last_activity"]))
+    return jsonify({'html': html, 'next_cursor': next_cursor})
 
 # -----------------------
 # Messages
@@ -2579,10 +4176,11 @@ def messages():
         FROM users u
         JOIN messages m
             ON (m.sender_id = u.id OR m.receiver_id = u.id)
-        WHERE u.id != ?
+        WHERE u.id != ? AND NOT u.retired
             AND (m.sender_id = ? OR m.receiver_id = ?)
         ORDER BY u.username
     """, (session["user_id"], session["user_id"], session["user_id"])).fetchall()
+    friends = social_graph.without_blocked(friends, social_graph.block_set(conn, session["user_id"]), key="id")
 
     stickers = conn.execute(
         "SELECT id, name, images FROM products WHERE type='sticker' ORDER BY created_at DESC"
@@ -2618,20 +4216,22 @@ def open_chat(user_id):
         FROM users u
         JOIN messages m
             ON (m.sender_id = u.id OR m.receiver_id = u.id)
-        WHERE u.id != ?
+        WHERE u.id != ? AND NOT u.retired
             AND (m.sender_id = ? OR m.receiver_id = ?)
         ORDER BY u.username
     """, (session["user_id"], session["user_id"], session["user_id"])).fetchall()
+    blocked = social_graph.block_set(conn, session["user_id"])
+    friends = social_graph.without_blocked(friends, blocked, key="id")
 
     active_user = conn.execute("""
         SELECT id, username, avatar, subscription, badge, allow_messages
         FROM users
-        WHERE id=?
+        WHERE id=? AND NOT retired
     """, (user_id,)).fetchone()
 
-    # Check if active user allows messages
+    # Check if active user allows messages (and neither side has blocked the other)
     allow_messaging = True
-    if active_user and not active_user["allow_messages"]:
+    if not active_user or not active_user["allow_messages"] or user_id in blocked:
         allow_messaging = False
 
     messages = conn.execute("""
@@ -2683,6 +4283,7 @@ def upload_message_file():
     
     if file_type == "music":
         filepath = save_upload_file(file, 'music')
+        queue_audio_metadata(filepath)
     else:  # image
         filepath = save_upload_file(file, 'uploads')
     
@@ -2691,6 +4292,132 @@ def upload_message_file():
     
     return {"success": True, "filepath": filepath, "filename": file.filename}
 
+# -----------------------
+# Chat money transfers
+# -----------------------
+_settlement_lock = threading.Lock()
+_settlement_scheduled = False
+SETTLEMENT_RETRY_DELAY = 5  # seconds before a failed settlement run is retried
+
+def schedule_settlement():
+    """Queue a settlement run on the background worker unless one is already waiting"""
+    global _settlement_scheduled
+    with _settlement_lock:
+        if _settlement_scheduled:
+            return
+        _settlement_scheduled = True
+    tasks.enqueue(run_settlement)
+
+def run_settlement():
+    """Drain the transfer queue; transfers queued after this starts schedule the next run"""
+    global _settlement_scheduled
+    with _settlement_lock:
+        _settlement_scheduled = False
+    conn = get_db_connection()
+    try:
+        settled, failed = transfers.settle_all(conn)
+    except Exception as e:
+        # e.g. a busy timeout: settled batches are committed, the rest stay queued
+        print(f"⚠️  Transfer settlement failed, retrying in {SETTLEMENT_RETRY_DELAY}s: {e}")
+        retry = threading.Timer(SETTLEMENT_RETRY_DELAY, schedule_settlement)
+        retry.daemon = True
+        retry.start()
+        return
+    finally:
+        conn.close()
+    if failed:
+        print(f"💸 Settled {settled} transfers, {failed} failed")
+
+def send_money_message(conn, sender_id, receiver_id, amount, content=None, key=None):
+    """
+    Post a money message and queue its transfer (committed together).
+
+    The replay check and both inserts run under one write lock, so two
+    overlapping submits with the same key leave one message and one transfer.
+
+    Returns:
+        tuple: (transfer dict from transfers.request_transfer, None) or (None, error code)
+    """
+    try:
+        cents = ledger.to_minor(amount)
+    except (ArithmeticError, ValueError):
+        return None, 'invalid_amount'
+
+    with wallet_service.immediate(conn):
+        replay = transfers.find_replay(conn, sender_id, key)
+        if replay is not None:
+            return replay, None
+        if cents <= 0 or sender_id == receiver_id:
+            return None, 'invalid_amount'
+
+        sender = conn.execute(
+            "SELECT subscription, wallet_cents FROM users WHERE id=?", (sender_id,)
+        ).fetchone()
+        receiver = conn.execute(
+            "SELECT allow_messages FROM users WHERE id=? AND NOT retired", (receiver_id,)
+        ).fetchone()
+        if sender is None or receiver is None:
+            return None, 'not_found'
+        # Money in chat is a Pro/Premium feature
+        if sender['subscription'] not in ('pro', 'premium'):
+            return None, 'upgrade_required'
+        if not receiver['allow_messages'] or social_graph.user_graph(conn, sender_id).is_blocked_with(receiver_id):
+            return None, 'messages_blocked'
+        # Early answer only; settlement checks the balance again in order
+        if (sender['wallet_cents'] or 0) < cents:
+            return None, 'insufficient_funds'
+
+        message_id = conn.execute("""
+            INSERT INTO messages (sender_id, receiver_id, content, money_amount, money_status)
+            VALUES (?, ?, ?, ?, 'pending')
+        """, (sender_id, receiver_id, content, ledger.to_major(cents))).lastrowid
+        transfer = transfers.request_transfer(conn, sender_id, receiver_id, ledger.to_major(cents),
+                                              message_id=message_id, key=key)
+    schedule_settlement()
+    return transfer, None
+
+@app.route('/messages/<int:user_id>/send-money', methods=['POST'])
+def send_money(user_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    data = request.get_json(silent=True) or request.form
+
+    conn = get_db_connection()
+    try:
+        transfer, error = send_money_message(
+            conn, session['user_id'], user_id, data.get('amount') or 0,
+            content=(data.get('content') or '').strip() or None,
+            key=data.get('idempotency_key')
+        )
+        if error:
+            return jsonify({'error': error}), 404 if error == 'not_found' else 400
+        # Settlement may already have run (it is quick when the queue is short)
+        status = conn.execute(
+            "SELECT status FROM pending_transfers WHERE id=?", (transfer['id'],)
+        ).fetchone()
+    finally:
+        conn.close()
+    return jsonify({
+        'transfer_id': transfer['id'],
+        'message_id': transfer['message_id'],
+        'status': status['status'] if status else transfer['status'],
+    })
+
+@app.route('/transfers/<int:transfer_id>')
+def transfer_status(transfer_id):
+    """Settlement result of a chat transfer, for its sender or receiver"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    conn = get_db_connection()
+    row = conn.execute("""
+        SELECT id, sender_id, receiver_id, amount, message_id, status, failure_reason, settled_at
+        FROM pending_transfers WHERE id=? AND (sender_id=? OR receiver_id=?)
+    """, (transfer_id, session['user_id'], session['user_id'])).fetchone()
+    conn.close()
+    if row is None:
+        return jsonify({'error': 'not_found'}), 404
+    return jsonify(dict(row, amount=ledger.to_major(row['amount'])))
+
 # @socketio.on('join')  # Disabled for deployment
 # def handle_join(data):
 #     join_room(data['room'])
@@ -2724,53 +4451,29 @@ def upload_message_file():
 #             conn.close()
 #             emit('message_blocked', {'error': 'This user has disabled direct messages'})
 #             return
+# 
+#         if social_graph.user_graph(conn, sender).is_blocked_with(receiver):
+#             conn.close()
+#             emit('message_blocked', {'error': 'You can no longer message this user'})
+#             return
 #         
-#         # If sending money, verify balance and process transfer
-#         if money_amount and float(money_amount) > 0:
-#             sender_user = conn.execute(
-#                 "SELECT wallet_balance, subscription FROM users WHERE id=?",
-#                 (sender,)
-#             ).fetchone()
-#             
-#             # Check if user has Pro or Premium subscription
-#             if sender_user['subscription'] not in ('pro', 'premium'):
-#                 conn.close()
-#                 return
-#             
-#             amount = float(money_amount)
-#             if sender_user['wallet_balance'] < amount:
-#                 conn.close()
+#         # Money goes through the transfer queue and settles in the background
+#         if money_amount:
+#             transfer, error = send_money_message(conn, sender, receiver, money_amount, content,
+#                                                  key=data.get('idempotency_key'))
+#             conn.close()
+#             if error:
+#                 emit('error', {'message': error})
 #                 return
-#             
-#             # Deduct from sender
-#             conn.execute(
-#                 "UPDATE users SET wallet_balance = wallet_balance - ? WHERE id=?",
-#                 (amount, sender)
-#             )
-#             
-#             # Add to receiver
-#             conn.execute(
-#                 "UPDATE users SET wallet_balance = wallet_balance + ? WHERE id=?",
-#                 (amount, receiver)
-#             )
-#             
-#             # Record transactions
-#             conn.execute(
-#                 "INSERT INTO transactions (user_id, type, amount, description) VALUES (?, 'transfer_out', ?, ?)",
-#                 (sender, -amount, f"Sent to user #{receiver}")
-#             )
-#             conn.execute(
-#                 "INSERT INTO transactions (user_id, type, amount, description) VALUES (?, 'transfer_in', ?, ?)",
-#                 (receiver, amount, f"Received from user #{sender}")
-#             )
-#         
-#         cur = conn.execute("""
-#             INSERT INTO messages (sender_id, receiver_id, content, sticker, money_amount, image, music, music_title)
-#             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-#         """, (sender, receiver, content, sticker, money_amount, image, music, music_title))
-#         conn.commit()
-#         msg_id = cur.lastrowid
-#         conn.close()
+#             msg_id = transfer['message_id']
+#         else:
+#             cur = conn.execute("""
+#                 INSERT INTO messages (sender_id, receiver_id, content, sticker, image, music, music_title)
+#                 VALUES (?, ?, ?, ?, ?, ?, ?)
+#             """, (sender, receiver, content, sticker, image, music, music_title))
+#             conn.commit()
+#             msg_id = cur.lastrowid
+#             conn.close()
 # 
 #         room = f"chat_{min(sender,receiver)}_{max(sender,receiver)}"
 # 
@@ -2780,6 +4483,8 @@ def upload_message_file():
 #             "content": content,
 #             "sticker": sticker,
 #             "money_amount": money_amount,
+#             "money_status": 'pending' if money_amount else None,
+#             "transfer_id": transfer['id'] if money_amount else None,
 #             "image": image,
 #             "music": music,
 #             "music_title": music_title
@@ -2972,6 +4677,8 @@ def cancel_subscription():
         "UPDATE users SET subscription='none' WHERE id=?",
         (session['user_id'],)
     )
+    bump_user_version(conn, session['user_id'])
+    bump_feed_version(conn)
     
     conn.execute(
         "INSERT INTO transactions (user_id, type, amount, description) VALUES (?, 'subscription_cancel', ?, ?)",
@@ -3145,10 +4852,7 @@ def delete_watch_room(room_id):
     
     conn = get_db_connection()
     
-    # Delete all participants first
-    conn.execute("DELETE FROM watch_participants WHERE room_id=?", (room_id,))
-    
-    # Delete the room
+    # Participants go with the room (ON DELETE CASCADE)
     conn.execute("DELETE FROM watch_rooms WHERE id=?", (room_id,))
     
     conn.commit()
@@ -3184,6 +4888,21 @@ def purchases():
     
     return render_template('purchases.html', products=purchased_products)
 
+@app.route('/admin/metrics')
+def admin_metrics():
+    """Runtime counters for this worker: compression, fragment and social graph caches"""
+    if 'user_id' not in session:
+        return redirect('/login')
+    if session.get('email') != ADMIN_EMAIL:
+        return redirect('/dashboard')
+
+    return jsonify({
+        'compression': compression.metrics.snapshot(),
+        'post_card_cache': {'hits': POST_CARD_CACHE.hits, 'misses': POST_CARD_CACHE.misses},
+        'social_graph_cache': social_graph.graphs.snapshot(),
+        'background_tasks_pending': tasks.pending(),
+    })
+
 @app.route('/admin/users', methods=['GET','POST'])
 def admin_users():
     if 'user_id' not in session:
@@ -3205,6 +4924,8 @@ def admin_users():
                 "UPDATE users SET subscription=? WHERE id=?",
                 (subscription, user_id)
             )
+            bump_user_version(conn, user_id)
+            bump_feed_version(conn)
             conn.commit()
         
         elif action == 'send_money':
@@ -3213,23 +4934,19 @@ def admin_users():
             try:
                 amount = float(amount)
                 if amount > 0:
-                    conn.execute(
-                        "UPDATE users SET wallet_balance = wallet_balance + ? WHERE id=?",
-                        (amount, user_id)
+                    wallet_service.credit(
+                        conn, int(user_id), amount, 'admin_credit', "Admin credit",
+                        key=wallet_service.clean_key(request.form.get('idempotency_key'))
                     )
-                    conn.execute(
-                        "INSERT INTO transactions (user_id, type, amount, description) VALUES (?, 'admin_credit', ?, ?)",
-                        (user_id, amount, "Admin credit")
-                    )
-                    conn.commit()
-            except ValueError:
+            except (TypeError, ValueError):
                 pass
 
-    users = conn.execute(
-        "SELECT id, username, email, subscription, wallet_balance FROM users ORDER BY id"
-    ).fetchall()
+    users, next_cursor = admin_user_page(
+        conn, "id, username, email, subscription, wallet_balance",
+        cursor=request.args.get('cursor'), descending=False
+    )
     conn.close()
-    return render_template('admin_users.html', users=users)
+    return render_template('admin_users.html', users=users, next_cursor=next_cursor)
 
 
 # -----------------------
@@ -3243,14 +4960,11 @@ def api_get_friends():
     
     conn = get_db_connection()
     friends = conn.execute("""
-        SELECT DISTINCT u.id, u.username FROM users u
-        JOIN friendships f ON (
-            (f.user_id = ? AND f.friend_id = u.id) OR
-            (f.friend_id = ? AND f.user_id = u.id)
-        )
-        WHERE f.status = 'accepted'
+        SELECT u.id, u.username FROM friend_edges e
+        JOIN users u ON u.id = e.friend_id
+        WHERE e.user_id = ? AND e.status = 'accepted'
         ORDER BY u.username
-    """, (session['user_id'], session['user_id'])).fetchall()
+    """, (session['user_id'],)).fetchall()
     conn.close()
     
     return jsonify({
@@ -3268,29 +4982,18 @@ def api_search_users():
         return jsonify({'users': []})
     
     conn = get_db_connection()
+    graph = social_graph.user_graph(conn, session['user_id'])
     users = conn.execute("""
-        SELECT u.id, u.username, 
-               CASE 
-                   WHEN EXISTS (SELECT 1 FROM friendships WHERE 
-                       ((user_id=? AND friend_id=u.id) OR (friend_id=? AND user_id=u.id)))
-                   THEN CASE 
-                       WHEN EXISTS (SELECT 1 FROM friendships WHERE 
-                           ((user_id=? AND friend_id=u.id) OR (friend_id=? AND user_id=u.id)) 
-                           AND status='accepted')
-                       THEN 'accepted'
-                       ELSE 'pending'
-                   END
-                   ELSE 'none'
-               END as friendship_status
+        SELECT u.id, u.username
         FROM users u
-        WHERE u.id != ? AND LOWER(u.username) LIKE LOWER(?)
+        WHERE u.id != ? AND NOT u.retired AND LOWER(u.username) LIKE LOWER(?)
         LIMIT 10
-    """, (session['user_id'], session['user_id'], session['user_id'], 
-          session['user_id'], session['user_id'], f'%{query}%')).fetchall()
+    """, (session['user_id'], f'%{query}%')).fetchall()
     conn.close()
     
     return jsonify({
-        'users': [dict(u) for u in users]
+        'users': [dict(u, friendship_status=graph.friendship_status(u['id']))
+                  for u in social_graph.without_blocked(users, graph.block_set, key='id')]
     })
 
 @app.route('/api/send-room-invite/<int:friend_id>', methods=['POST'])
@@ -3315,10 +5018,687 @@ def api_check_user_online(user_id):
         'online': is_user_online(user_id)
     })
 
+# -----------------------
+# JSON API v1 (iOS / PWA client)
+# -----------------------
+# Session-cookie auth like the web UI. Collections are keyset-paginated with an
+# opaque `cursor` and `limit`; `fields=a,b` keeps only those top-level keys.
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+
+def api_json(payload, status=200):
+    """Compact JSON response (orjson when installed)"""
+    if orjson is not None:
+        body = orjson.dumps(payload, default=str)
+    else:
+        body = json.dumps(payload, separators=(',', ':'), ensure_ascii=False, default=str)
+    return app.response_class(body, status=status, mimetype='application/json')
+
+def api_error(message, status):
+    return api_json({'error': message}, status)
+
+def api_page_size():
+    try:
+        limit = int(request.args.get('limit', API_PAGE_SIZE))
+    except ValueError:
+        limit = API_PAGE_SIZE
+    return max(1, min(limit, API_MAX_PAGE_SIZE))
+
+def api_fields():
+    """Requested sparse field set, or None for everything"""
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    return {f.strip() for f in fields.split(',') if f.strip()}
+
+def api_sparse(item, fields):
+    if fields is None:
+        return item
+    return {key: value for key, value in item.items() if key in fields}
+
+def api_page(items, next_cursor):
+    fields = api_fields()
+    return {'data': [api_sparse(item, fields) for item in items], 'next_cursor': next_cursor}
+
+def api_user(user_id, username, avatar, subscription, badge, online_ids):
+    return {
+        'id': user_id,
+        'username': username,
+        'avatar_url': file_url_filter(avatar or 'avatars/default.png'),
+        'subscription': subscription,
+        'badge': badge,
+        'online': user_id in online_ids,
+    }
+
+def api_music(path, title, row=None):
+    if not path:
+        return None
+    music = {'url': file_url_filter(path), 'title': title}
+    if row is not None and row['audio_duration'] is not None:
+        music.update({
+            'duration': row['audio_duration'],
+            'bitrate': row['audio_bitrate'],
+            'artist': row['audio_artist'],
+            'track_title': row['audio_title'],
+            'waveform': json.loads(row['audio_waveform']) if row['audio_waveform'] else None,
+        })
+    return music
+
+def api_post_page(conn, rows, limit, viewer_id):
+    """
+    Serialize one page of FEED_POST_COLUMNS rows (fetched with limit + 1).
+
+    Comments, the viewer's likes and online badges are loaded with one
+    batched query each, skipped when sparse fields leave them out. Posts and
+    comments by users in the viewer's block set are dropped after paging, so
+    a page can come back short but the cursor still advances.
+    """
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    cursor_row = rows[-1] if rows else None
+    blocked = social_graph.block_set(conn, viewer_id)
+    rows = social_graph.without_blocked(rows, blocked)
+    fields = api_fields()
+    post_ids = [row['id'] for row in rows]
+
+    comments_by_post = {}
+    if post_ids and (fields is None or 'comments' in fields):
+        comments_by_post = get_comments_by_post(conn, post_ids)
+
+    liked = set()
+    if post_ids and (fields is None or 'liked' in fields):
+        placeholders = ','.join('?' for _ in post_ids)
+        liked = {r['post_id'] for r in conn.execute(
+            f"SELECT post_id FROM likes WHERE user_id=? AND post_id IN ({placeholders})",
+            [viewer_id] + post_ids
+        )}
+
+    author_ids = {row['user_id'] for row in rows}
+    for comments in comments_by_post.values():
+        author_ids.update(c['user_id'] for c in comments)
+    online_ids = get_online_user_ids(conn, author_ids) if author_ids else set()
+
+    posts = [{
+        'id': row['id'],
+        'author': api_user(row['user_id'], row['username'], row['avatar'],
+                           row['user_subscription'], row['user_badge'], online_ids),
+        'content': row['content'],
+        'image_url': file_url_filter(row['image']),
+        'music': api_music(row['music'], row['music_title'], row),
+        'tags': [t.strip() for t in (row['tags'] or '').split(',') if t.strip()],
+        'like_count': row['like_count'],
+        'liked': row['id'] in liked,
+        'comments': [{
+            'id': c['id'],
+            'author': api_user(c['user_id'], c['username'], c['avatar'], None, None, online_ids),
+            'content': c['content'],
+            'created_at': c['created_at'],
+        } for c in social_graph.without_blocked(comments_by_post.get(row['id'], []), blocked)],
+        'created_at': row['created_at'],
+    } for row in rows]
+
+    next_cursor = f"{cursor_row['created_at']}|{cursor_row['id']}" if has_more else None
+    return posts, next_cursor
+
+def api_story(story):
+    return {
+        'id': story['id'],
+        'image_url': file_url_filter(story['image']),
+        'content': story['content'],
+        'created_at': story['created_at'],
+        'expires_at': story['expires_at'],
+    }
+
+def api_message(row, viewer_id):
+    return {
+        'id': row['id'],
+        'from_me': row['sender_id'] == viewer_id,
+        'content': row['content'],
+        'sticker': row['sticker'],
+        'image_url': file_url_filter(row['image']),
+        'music': api_music(row['music'], row['music_title']),
+        'money_amount': row['money_amount'],
+        'money_status': row['money_status'],
+        'is_read': bool(row['is_read']),
+        'created_at': row['created_at'],
+    }
+
+@app.route('/api/v1/feed')
+def api_v1_feed():
+    """Forum posts, newest first"""
+    if 'user_id' not in session:
+        return api_error('Not authenticated', 401)
+
+    limit = api_page_size()
+    after, params = keyset_condition(request.args.get('cursor'), 'posts.created_at', 'posts.id')
+    conn = get_db_connection()
+    rows = conn.execute(f"""
+        SELECT {FEED_POST_COLUMNS}
+        FROM posts {FEED_POST_JOINS}
+        WHERE 1=1{after}
+        ORDER BY posts.created_at DESC, posts.id DESC
+        LIMIT ?
+    """, params + [limit + 1]).fetchall()
+    posts, next_cursor = api_post_page(conn, rows, limit, session['user_id'])
+    conn.close()
+    return api_json(api_page(posts, next_cursor))
+
+@app.route('/api/v1/stories')
+def api_v1_stories():
+    """The forum story strip: live stories grouped by author"""
+    if 'user_id' not in session:
+        return api_error('Not authenticated', 401)
+
+    conn = get_db_connection()
+    stories_by_user = get_story_strip(conn, session['user_id'])
+    online_ids = get_online_user_ids(conn, set(stories_by_user))
+    conn.close()
+
+    groups = [{
+        'user': api_user(uid, stories[0]['username'], stories[0]['avatar'],
+                         stories[0]['user_subscription'], stories[0]['user_badge'], online_ids),
+        'stories': [api_story(story) for story in stories],
+    } for uid, stories in stories_by_user.items()]
+    return api_json(api_page(groups, None))
+
+@app.route('/api/v1/users/<int:user_id>')
+def api_v1_user(user_id):
+    """Profile header: user, counts, relationship and live stories"""
+    if 'user_id' not in session:
+        return api_error('Not authenticated', 401)
+
+    viewer_id = session['user_id']
+    conn = get_db_connection()
+    user = conn.execute("SELECT * FROM users WHERE id=? AND NOT retired", (user_id,)).fetchone()
+    if not user:
+        conn.close()
+        return api_error('User not found', 404)
+
+    online_ids = get_online_user_ids(conn, {user_id})
+    profile = api_user(user['id'], user['username'], user['avatar'],
+                       user['subscription'], user['badge'], online_ids)
+    profile.update({
+        'handle': user['handle'],
+        'bio': user['bio'],
+        'about_me': user['about_me'],
+        'is_private': bool(user['is_private']),
+        'restricted': not can_view_profile(conn, viewer_id, user),
+    })
+
+    if not profile['restricted']:
+        viewer_graph = social_graph.user_graph(conn, viewer_id)
+        stats = get_user_stats(conn, user_id)
+        friendship = viewer_graph.friendship(user_id)
+        stories = conn.execute("""
+            SELECT * FROM stories
+            WHERE user_id=? AND expires_at > CURRENT_TIMESTAMP
+            ORDER BY created_at DESC
+        """, (user_id,)).fetchall()
+        profile.update({
+            'follower_count': stats['follower_count'],
+            'following_count': stats['following_count'],
+            'is_following': user_id in viewer_graph.following,
+            'friendship': None if not friendship else {
+                'status': friendship['status'],
+                'requested_by_me': friendship['user_id'] == viewer_id,
+            },
+            'stories': [api_story(story) for story in stories],
+        })
+    conn.close()
+
+    return api_json({'data': api_sparse(profile, api_fields())})
+
+@app.route('/api/v1/users/<int:user_id>/posts')
+def api_v1_user_posts(user_id):
+    """A user's forum posts, newest first"""
+    if 'user_id' not in session:
+        return api_error('Not authenticated', 401)
+
+    conn = get_db_connection()
+    user = conn.execute("SELECT id, is_private FROM users WHERE id=? AND NOT retired", (user_id,)).fetchone()
+    if not user:
+        conn.close()
+        return api_error('User not found', 404)
+    if not can_view_profile(conn, session['user_id'], user):
+        conn.close()
+        return api_error('Profile is private', 403)
+
+    limit = api_page_size()
+    after, params = keyset_condition(request.args.get('cursor'), 'posts.created_at', 'posts.id')
+    rows = conn.execute(f"""
+        SELECT {FEED_POST_COLUMNS}
+        FROM posts {FEED_POST_JOINS}
+        WHERE posts.user_id=?{after}
+        ORDER BY posts.created_at DESC, posts.id DESC
+        LIMIT ?
+    """, [user_id] + params + [limit + 1]).fetchall()
+    posts, next_cursor = api_post_page(conn, rows, limit, session['user_id'])
+    conn.close()
+    return api_json(api_page(posts, next_cursor))
+
+@app.route('/api/v1/users/<int:user_id>/wall')
+def api_v1_user_wall(user_id):
+    """A user's profile (wall) posts, newest first"""
+    if 'user_id' not in session:
+        return api_error('Not authenticated', 401)
+
+    conn = get_db_connection()
+    user = conn.execute("SELECT id, is_private FROM users WHERE id=? AND NOT retired", (user_id,)).fetchone()
+    if not user:
+        conn.close()
+        return api_error('User not found', 404)
+    if not can_view_profile(conn, session['user_id'], user):
+        conn.close()
+        return api_error('Profile is private', 403)
+
+    limit = api_page_size()
+    after, params = keyset_condition(request.args.get('cursor'))
+    rows = conn.execute(f"""
+        SELECT * FROM profile_posts
+        WHERE user_id=?{after}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    """, [user_id] + params + [limit + 1]).fetchall()
+    conn.close()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    posts = [{
+        'id': row['id'],
+        'content': row['content'],
+        'image_url': file_url_filter(row['image']),
+        'music': api_music(row['music'], row['music_title']),
+        'created_at': row['created_at'],
+    } for row in rows]
+    next_cursor = f"{rows[-1]['created_at']}|{rows[-1]['id']}" if has_more else None
+    return api_json(api_page(posts, next_cursor))
+
+@app.route('/api/v1/inbox')
+def api_v1_inbox():
+    """Conversations ordered by latest message, with unread counts"""
+    if 'user_id' not in session:
+        return api_error('Not authenticated', 401)
+
+    viewer_id = session['user_id']
+    limit = api_page_size()
+    try:
+        before = int(request.args.get('cursor', 0)) or None
+    except ValueError:
+        before = None
+
+    conn = get_db_connection()
+    rows = conn.execute(f"""
+        SELECT c.partner_id, c.last_id, c.unread,
+               u.username, u.avatar, u.subscription, u.badge,
+               m.sender_id, m.content, m.sticker, m.image, m.music, m.money_amount, m.created_at
+        FROM (
+            SELECT CASE WHEN sender_id=? THEN receiver_id ELSE sender_id END AS partner_id,
+                   MAX(id) AS last_id,
+                   SUM(CASE WHEN receiver_id=? AND is_read=0 THEN 1 ELSE 0 END) AS unread
+            FROM messages
+            WHERE sender_id=? OR receiver_id=?
+            GROUP BY partner_id
+        ) c
+        JOIN users u ON u.id = c.partner_id
+        JOIN messages m ON m.id = c.last_id
+        {"WHERE c.last_id < ?" if before else ""}
+        ORDER BY c.last_id DESC
+        LIMIT ?
+    """, [viewer_id, viewer_id, viewer_id, viewer_id] + ([before] if before else []) + [limit + 1]).fetchall()
+    blocked = social_graph.block_set(conn, viewer_id)
+    online_ids = get_online_user_ids(conn, {row['partner_id'] for row in rows})
+    conn.close()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = str(rows[-1]['last_id']) if has_more else None
+    rows = social_graph.without_blocked(rows, blocked, key='partner_id')
+    conversations = [{
+        'user': api_user(row['partner_id'], row['username'], row['avatar'],
+                         row['subscription'], row['badge'], online_ids),
+        'unread': row['unread'],
+        'last_message': {
+            'id': row['last_id'],
+            'from_me': row['sender_id'] == viewer_id,
+            'content': row['content'],
+            'kind': 'sticker' if row['sticker'] else 'image' if row['image'] else
+                    'music' if row['music'] else 'money' if row['money_amount'] else 'text',
+            'created_at': row['created_at'],
+        },
+    } for row in rows]
+    return api_json(api_page(conversations, next_cursor))
+
+@app.route('/api/v1/messages/<int:user_id>')
+def api_v1_messages(user_id):
+    """
+    Chat history with one user, newest first (cursor = oldest message id seen).
+
+    Like opening the chat page, loading the first page marks incoming messages read.
+    """
+    if 'user_id' not in session:
+        return api_error('Not authenticated', 401)
+
+    viewer_id = session['user_id']
+    limit = api_page_size()
+    try:
+        before = int(request.args.get('cursor', 0)) or None
+    except ValueError:
+        before = None
+
+    conn = get_db_connection()
+    rows = conn.execute(f"""
+        SELECT * FROM messages
+        WHERE ((sender_id=? AND receiver_id=?) OR (sender_id=? AND receiver_id=?))
+        {"AND id < ?" if before else ""}
+        ORDER BY id DESC
+        LIMIT ?
+    """, [viewer_id, user_id, user_id, viewer_id] + ([before] if before else []) + [limit + 1]).fetchall()
+
+    if before is None:
+        conn.execute("""
+            UPDATE messages SET is_read=1
+            WHERE receiver_id=? AND sender_id=? AND is_read=0
+        """, (viewer_id, user_id))
+        conn.commit()
+    conn.close()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    messages = [api_message(row, viewer_id) for row in rows]
+    next_cursor = str(rows[-1]['id']) if has_more else None
+    return api_json(api_page(messages, next_cursor))
+
+# -----------------------
+# Delta sync
+# -----------------------
+# Changes returned per call; clients keep calling while has_more is true
+SYNC_BATCH = 500
+CHANGE_LOG_RETENTION_DAYS = 30
+
+def fetch_by_ids(conn, query, ids):
+    """Run `query` (with an {ids} placeholder list) in chunks of 500 ids"""
+    ids = list(ids)
+    rows = []
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        rows.extend(conn.execute(query.format(ids=','.join('?' for _ in chunk)), chunk).fetchall())
+    return rows
+
+@app.route('/api/sync')
+@app.route('/api/v1/sync')
+def api_sync():
+    """
+    Everything that changed for this viewer since `since` (a change_log seq).
+
+    Without `since`, or when the cursor predates pruned history, the response
+    has reset=true and only a fresh cursor: reload through the paged endpoints.
+    """
+    if 'user_id' not in session:
+        return api_error('Not authenticated', 401)
+
+    viewer_id = session['user_id']
+    try:
+        since = int(request.args['since'])
+    except (KeyError, ValueError):
+        since = None
+
+    conn = get_db_connection()
+    head = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+    floor = conn.execute("SELECT version FROM site_versions WHERE name='change_log_floor'").fetchone()
+    floor = floor['version'] if floor else 0
+    counts = get_notification_counts(viewer_id)
+
+    if since is None or since < floor or since > head:
+        conn.close()
+        return api_json({'cursor': str(head), 'reset': True, 'has_more': False, 'counts': counts})
+
+    changes = conn.execute("""
+        SELECT seq, entity, entity_id, op FROM change_log
+        WHERE seq > ? AND (audience_a IS NULL OR audience_a = ? OR audience_b = ?)
+        ORDER BY seq
+        LIMIT ?
+    """, (since, viewer_id, viewer_id, SYNC_BATCH + 1)).fetchall()
+    has_more = len(changes) > SYNC_BATCH
+    changes = changes[:SYNC_BATCH]
+    # Private changes of other users are skipped, so a complete batch jumps to head
+    cursor = changes[-1]['seq'] if has_more else head
+
+    # Only the latest op per entity matters
+    latest = {}
+    for change in changes:
+        latest[(change['entity'], change['entity_id'])] = change['op']
+    upserts = {'post': set(), 'story': set(), 'message': set()}
+    deleted = {'post': set(), 'story': set(), 'message': set()}
+    for (entity, entity_id), op in latest.items():
+        (deleted if op == 'delete' else upserts)[entity].add(entity_id)
+
+    posts = []
+    if upserts['post']:
+        rows = fetch_by_ids(conn, f"""
+            SELECT {FEED_POST_COLUMNS}
+            FROM posts {FEED_POST_JOINS}
+            WHERE posts.id IN ({{ids}})
+        """, upserts['post'])
+        posts, _ = api_post_page(conn, rows, len(rows), viewer_id)
+        deleted['post'] |= upserts['post'] - {p['id'] for p in posts}
+
+    stories = []
+    if upserts['story']:
+        rows = fetch_by_ids(conn, """
+            SELECT * FROM stories
+            WHERE id IN ({ids}) AND expires_at > CURRENT_TIMESTAMP
+        """, upserts['story'])
+        rows = social_graph.without_blocked(rows, social_graph.block_set(conn, viewer_id))
+        stories = [dict(api_story(row), user_id=row['user_id']) for row in rows]
+        deleted['story'] |= upserts['story'] - {s['id'] for s in stories}
+
+    conversations = {}
+    if upserts['message']:
+        rows = fetch_by_ids(conn, """
+            SELECT * FROM messages WHERE id IN ({ids}) ORDER BY id
+        """, upserts['message'])
+        for row in rows:
+            partner_id = row['receiver_id'] if row['sender_id'] == viewer_id else row['sender_id']
+            conversations.setdefault(str(partner_id), []).append(api_message(row, viewer_id))
+        deleted['message'] |= upserts['message'] - {row['id'] for row in rows}
+    conn.close()
+
+    return api_json({
+        'cursor': str(cursor),
+        'reset': False,
+        'has_more': has_more,
+        'posts': posts,
+        'stories': stories,
+        'conversations': conversations,
+        'deleted': {
+            'posts': sorted(deleted['post']),
+            'stories': sorted(deleted['story']),
+            'messages': sorted(deleted['message']),
+        },
+        'counts': counts,
+    })
+
+def prune_change_log(days=CHANGE_LOG_RETENTION_DAYS):
+    """Drop change_log rows older than `days`; clients behind the new floor get reset=true"""
+    conn = get_db_connection()
+    floor = conn.execute(
+        "SELECT MAX(seq) FROM change_log WHERE created_at < datetime('now', ?)",
+        (f'-{int(days)} days',)
+    ).fetchone()[0]
+    if floor:
+        conn.execute("DELETE FROM change_log WHERE seq <= ?", (floor,))
+        conn.execute("UPDATE site_versions SET version=? WHERE name='change_log_floor'", (floor,))
+        conn.commit()
+    conn.close()
+    return floor or 0
+
+# -----------------------
+# Maintenance commands (flask --app app <command>)
+# -----------------------
+@app.cli.command("gc-media")
+@click.option("--dry-run/--delete", default=True, help="Only report orphans (default) or actually delete them")
+@click.option("--grace-hours", default=24, type=int, help="Never delete files younger than this")
+def gc_media_command(dry_run, grace_hours):
+    """Delete uploaded files that no database row references"""
+    if storage is None:
+        print("❌ Storage module unavailable - cannot list files")
+        return
+    import media_gc
+
+    bootstrap()
+    conn = get_db_connection()
+    try:
+        stats = media_gc.collect_garbage(conn, dry_run=dry_run, grace_seconds=grace_hours * 3600)
+    finally:
+        conn.close()
+
+    verb = "Would free" if dry_run else "Freed"
+    print(f"Scanned {stats['scanned_files']} files ({stats['scanned_bytes']} bytes), "
+          f"{stats['referenced']} referenced paths")
+    print(f"{verb} {stats['orphan_bytes'] if dry_run else stats['deleted_bytes']} bytes in "
+          f"{stats['orphan_files'] if dry_run else stats['deleted_files']} orphaned files")
+
+@app.cli.command("expire-stories")
+@click.option("--batch-size", default=STORY_SWEEP_BATCH, type=int)
+def expire_stories_command(batch_size):
+    """Delete stories past their expires_at together with their images"""
+    bootstrap()
+    deleted = sweep_expired_stories(batch_size=batch_size)
+    print(f"Deleted {deleted} expired stories")
+
+@app.cli.command("purge-accounts")
+@click.option("--batch-size", default=ACCOUNT_PURGE_BATCH, type=int)
+def purge_accounts_command(batch_size):
+    """Finish account deletions that were interrupted (worker restart or failure)"""
+    bootstrap()
+    conn = get_db_connection()
+    user_ids = [row["user_id"] for row in conn.execute(
+        "SELECT user_id FROM account_deletions WHERE status != 'done' ORDER BY requested_at"
+    )]
+    conn.close()
+    for user_id in user_ids:
+        purge_account(user_id, batch_size=batch_size)
+    print(f"Purged {len(user_ids)} accounts")
+
+@app.cli.command("prune-changes")
+@click.option("--days", default=CHANGE_LOG_RETENTION_DAYS, type=int, help="Keep this much sync history")
+def prune_changes_command(days):
+    """Trim the /api/sync change log"""
+    bootstrap()
+    floor = prune_change_log(days)
+    print(f"Change log floor is now seq {floor}")
+
+@app.cli.command("check-stats")
+@click.option("--repair", is_flag=True, help="Recount drifted users instead of only reporting them")
+def check_stats_command(repair):
+    """Verify the trigger-maintained user_stats counters against the source tables"""
+    bootstrap()
+    conn = get_db_connection()
+    try:
+        drifted = check_user_stats(conn, repair=repair)
+    finally:
+        conn.close()
+    if not drifted:
+        print("✅ user_stats is consistent")
+    else:
+        shown = ", ".join(str(user_id) for user_id in drifted[:20])
+        more = f" (+{len(drifted) - 20} more)" if len(drifted) > 20 else ""
+        print(f"{'🔧 Repaired' if repair else '⚠️  Drift in'} {len(drifted)} users: {shown}{more}")
+
+@app.cli.command("reconcile-ledger")
+@click.option("--repair", is_flag=True, help="Reset drifted balances from the ledger")
+def reconcile_ledger_command(repair):
+    """Verify wallet balances and snapshots against the append-only ledger"""
+    bootstrap()
+    conn = get_db_connection()
+    try:
+        report = ledger.reconcile(conn, repair=repair)
+    finally:
+        conn.close()
+    problems = {name: ids for name, ids in report.items() if ids}
+    if not problems:
+        print("✅ Ledger reconciles with every wallet")
+        return
+    for name, ids in problems.items():
+        shown = ", ".join(str(i) for i in ids[:20])
+        more = f" (+{len(ids) - 20} more)" if len(ids) > 20 else ""
+        print(f"⚠️  {name.replace('_', ' ')}: {len(ids)}: {shown}{more}")
+    if repair:
+        print("🔧 Balances reset from the ledger")
+
+@app.cli.command("settle-transfers")
+@click.option("--batch-size", default=transfers.TRANSFER_BATCH, type=int, help="Transfers settled per transaction")
+def settle_transfers_command(batch_size):
+    """Settle queued chat transfers (e.g. ones left pending by a restart)"""
+    bootstrap()
+    conn = get_db_connection()
+    try:
+        settled, failed = transfers.settle_all(conn, batch_size)
+    finally:
+        conn.close()
+    print(f"💸 Settled {settled} transfers, {failed} failed")
+
+@app.cli.command("suggest-people")
+@click.option("--top-k", default=20, type=int, help="Suggestions kept per user")
+@click.option("--block-size", default=2000, type=int, help="Users processed per batch")
+@click.option("--pure-python", is_flag=True, help="Skip the SciPy path even when it is installed")
+def suggest_people_command(top_k, block_size, pure_python):
+    """Recompute "people you may know" for every user"""
+    import time
+    import people_suggestions
+
+    bootstrap()
+    started = time.perf_counter()
+    conn = get_db_connection()
+    try:
+        result = people_suggestions.compute_suggestions(
+            conn, top_k=top_k, block_size=block_size, use_scipy=False if pure_python else None
+        )
+    finally:
+        conn.close()
+    print(f"✅ Wrote {result['suggestions']} suggestions for {result['users']} users "
+          f"in {time.perf_counter() - started:.1f}s")
+
+@app.cli.command("audio-metadata")
+@click.option("--all", "reparse", is_flag=True, help="Re-parse tracks that already have metadata")
+def audio_metadata_command(reparse):
+    """Parse headers for uploaded tracks that have no stored metadata"""
+    bootstrap()
+    conn = get_db_connection()
+    paths = set()
+    for query in (
+        "SELECT music FROM posts WHERE music IS NOT NULL AND music != ''",
+        "SELECT music FROM profile_posts WHERE music IS NOT NULL AND music != ''",
+        "SELECT music FROM messages WHERE music IS NOT NULL AND music != ''",
+        "SELECT file_path FROM music_library WHERE file_path IS NOT NULL AND file_path != ''",
+        "SELECT file FROM products WHERE file IS NOT NULL AND file != ''",
+    ):
+        paths.update(row[0] for row in conn.execute(query))
+    if not reparse:
+        paths -= {row[0] for row in conn.execute("SELECT path FROM audio_metadata WHERE status != 'pending'")}
+    conn.close()
+
+    paths = sorted(p for p in paths if is_audio_file(p))
+    for path in paths:
+        extract_audio_metadata(path)
+    print(f"Parsed {len(paths)} tracks")
+
+@app.cli.command("bootstrap")
+@click.option("--precompile/--no-precompile", default=True, help="Also compile every template into the bytecode cache")
+def bootstrap_command(precompile):
+    """Migrate the database and warm the template cache (run at deploy time)"""
+    import time
+    started = time.perf_counter()
+    bootstrap(precompile=False)
+    if precompile:
+        print(f"Compiled {precompile_templates()} templates into {JINJA_CACHE_DIR}")
+    print(f"Bootstrap finished in {time.perf_counter() - started:.2f}s")
+
 # -----------------------
 # Run
 # -----------------------
 if __name__ == "__main__":
+    bootstrap()
     port = int(os.environ.get("PORT", 5000))
     debug_mode = os.environ.get("FLASK_ENV") != "production"
     app.run(host="0.0.0.0", port=port, debug=debug_mode)
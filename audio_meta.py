@@ -0,0 +1,495 @@
+"""
+Audio Metadata
+Pure-Python header parsing for uploaded tracks (MP3/ID3, MP4/M4A, Ogg Vorbis/Opus, WAV)
+Extracts duration, bitrate, title/artist and a downsampled loudness waveform
+"""
+import os
+import struct
+from array import array
+
+# Number of bars in the precomputed waveform
+WAVEFORM_POINTS = 64
+
+# Larger files are still parsed for headers, but not walked for a waveform
+MAX_WAVEFORM_BYTES = 64 * 1024 * 1024
+
+
+def read_metadata(path, points=WAVEFORM_POINTS):
+    """
+    Parse an audio file's headers
+
+    Args:
+        path: Local path of the audio file
+        points: Number of waveform bars to produce
+
+    Returns:
+        dict: format, duration (seconds), bitrate (bits/s), title, artist and
+              waveform (list of 0..1 floats); values that cannot be determined
+              are None. Returns None for unrecognised files.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        head = f.read(12)
+        f.seek(0)
+        if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+            return _read_wav(f, size, points)
+        if head[:4] == b"OggS":
+            return _read_ogg(f, size)
+        if head[4:8] == b"ftyp":
+            return _read_mp4(f, size)
+        if head[:3] == b"ID3" or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+            return _read_mp3(f, size, points)
+        # Some MP3s start with junk; accept them if a frame follows shortly
+        result = _read_mp3(f, size, points)
+        if result and result["duration"]:
+            return result
+    return None
+
+
+def _result(fmt, duration=None, bitrate=None, title=None, artist=None, waveform=None):
+    return {
+        "format": fmt,
+        "duration": round(duration, 3) if duration else None,
+        "bitrate": int(bitrate) if bitrate else None,
+        "title": title or None,
+        "artist": artist or None,
+        "waveform": waveform,
+    }
+
+
+def downsample(values, points):
+    """Reduce a loudness series to `points` peak values normalised to 0..1"""
+    if not values:
+        return None
+    points = min(points, len(values))
+    step = len(values) / points
+    peaks = [max(values[int(i * step):max(int((i + 1) * step), int(i * step) + 1)])
+             for i in range(points)]
+    top = max(peaks)
+    if top <= 0:
+        return [0.0] * points
+    return [round(p / top, 3) for p in peaks]
+
+
+# -----------------------
+# MP3 (ID3v2/ID3v1 tags, MPEG audio frames)
+# -----------------------
+_MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 25: [11025, 12000, 8000]}
+
+
+def _parse_frame_header(data, pos):
+    """Decode the 4-byte MPEG audio header at pos, or return None"""
+    if pos + 4 > len(data):
+        return None
+    b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+    if data[pos] != 0xFF or b1 & 0xE0 != 0xE0:
+        return None
+    version_bits = (b1 >> 3) & 3
+    layer_bits = (b1 >> 1) & 3
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 3
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    version = {3: 1, 2: 2, 0: 25}[version_bits]
+    layer = 4 - layer_bits
+    bitrate = _MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 1
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if (layer == 2 or version == 1) else 576
+        length = samples // 8 * bitrate // sample_rate + padding
+    return {
+        "version": version, "layer": layer, "bitrate": bitrate,
+        "sample_rate": sample_rate, "samples": samples, "length": length,
+        "crc": not (b1 & 1), "mono": (b3 >> 6) == 3,
+    }
+
+
+def _side_info_length(header):
+    if header["version"] == 1:
+        return 17 if header["mono"] else 32
+    return 9 if header["mono"] else 17
+
+
+def _global_gains(data, pos, header):
+    """
+    Read the Layer III global_gain of every granule/channel in a frame.
+
+    global_gain sets the quantiser step size, so it tracks the frame's
+    loudness closely enough for a waveform without decoding any audio.
+    """
+    start = pos + 4 + (2 if header["crc"] else 0)
+    side = data[start:start + _side_info_length(header)]
+    bits = int.from_bytes(side, "big")
+    total = len(side) * 8
+    channels = 1 if header["mono"] else 2
+    if header["version"] == 1:
+        offset = 9 + (5 if header["mono"] else 3) + channels * 4
+        granules, block = 2, 59
+    else:
+        offset = 8 + (1 if header["mono"] else 2)
+        granules, block = 1, 63
+    gains = []
+    for i in range(granules * channels):
+        at = offset + i * block
+        part2_3_length = (bits >> (total - at - 12)) & 0xFFF
+        gain = (bits >> (total - at - 29)) & 0xFF
+        gains.append(gain if part2_3_length else 0)
+    return gains
+
+
+def _gain_waveform(gains, points, range_steps=40):
+    """
+    Map per-frame global_gain values onto a 0..1 waveform.
+
+    Each gain step is 1.5 dB, so the bars cover the loudest `range_steps`
+    steps (60 dB) of the track; quieter frames and silence draw as 0.
+    """
+    peaks = downsample(gains, points)
+    if not peaks:
+        return None
+    top = max(gains)
+    floor = top - range_steps
+    return [round(max(0.0, (p * top - floor) / range_steps), 3) for p in peaks]
+
+
+def _read_id3v2(data):
+    """Return (tag_length, title, artist) for an ID3v2 tag at the start of data"""
+    if data[:3] != b"ID3" or len(data) < 10:
+        return 0, None, None
+    major, flags = data[3], data[5]
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    tag_length = 10 + size + (10 if flags & 0x10 else 0)
+    frames = {}
+    pos = 10
+    end = min(10 + size, len(data))
+    id_len, header_len = (3, 6) if major == 2 else (4, 10)
+    while pos + header_len <= end:
+        frame_id = data[pos:pos + id_len]
+        if not frame_id.strip(b"\x00"):
+            break
+        if major == 2:
+            frame_size = int.from_bytes(data[pos + 3:pos + 6], "big")
+        elif major == 4:
+            raw = data[pos + 4:pos + 8]
+            frame_size = (raw[0] << 21) | (raw[1] << 14) | (raw[2] << 7) | raw[3]
+        else:
+            frame_size = int.from_bytes(data[pos + 4:pos + 8], "big")
+        body = data[pos + header_len:pos + header_len + frame_size]
+        frames[frame_id.decode("latin-1")] = body
+        pos += header_len + frame_size
+    title = _id3_text(frames.get("TIT2") or frames.get("TT2"))
+    artist = _id3_text(frames.get("TPE1") or frames.get("TP1"))
+    return tag_length, title, artist
+
+
+def _id3_text(body):
+    if not body:
+        return None
+    encoding, raw = body[0], body[1:]
+    codec = {0: "latin-1", 1: "utf-16", 2: "utf-16-be", 3: "utf-8"}.get(encoding, "latin-1")
+    try:
+        text = raw.decode(codec)
+    except UnicodeDecodeError:
+        return None
+    return text.split("\x00")[0].strip() or None
+
+
+def _read_mp3(f, size, points):
+    data = f.read(min(size, MAX_WAVEFORM_BYTES))
+    tag_length, title, artist = _read_id3v2(data)
+
+    # ID3v1 fallback for title/artist
+    if (not title or not artist) and size >= 128:
+        f.seek(size - 128)
+        tail = f.read(128)
+        if tail[:3] == b"TAG":
+            title = title or tail[3:33].split(b"\x00")[0].decode("latin-1").strip() or None
+            artist = artist or tail[33:63].split(b"\x00")[0].decode("latin-1").strip() or None
+
+    # Find the first frame header that is followed by another valid header
+    pos = tag_length
+    header = None
+    limit = min(len(data), tag_length + 64 * 1024)
+    while pos < limit:
+        pos = data.find(b"\xff", pos, limit)
+        if pos < 0:
+            break
+        candidate = _parse_frame_header(data, pos)
+        if candidate and _parse_frame_header(data, pos + candidate["length"]):
+            header = candidate
+            break
+        pos += 1
+    if header is None:
+        return _result("mp3", title=title, artist=artist)
+
+    first = pos
+    audio_bytes = size - first
+    duration = None
+    bitrate = header["bitrate"]
+
+    # Xing/Info (VBR) or VBRI headers carry the total frame count
+    xing_at = first + 4 + _side_info_length(header)
+    frame_count = None
+    if data[xing_at:xing_at + 4] in (b"Xing", b"Info"):
+        flags = int.from_bytes(data[xing_at + 4:xing_at + 8], "big")
+        if flags & 1:
+            frame_count = int.from_bytes(data[xing_at + 8:xing_at + 12], "big")
+        if flags & 2:
+            audio_bytes = int.from_bytes(data[xing_at + 12:xing_at + 16], "big") or audio_bytes
+    elif data[first + 36:first + 40] == b"VBRI":
+        audio_bytes = int.from_bytes(data[first + 46:first + 50], "big") or audio_bytes
+        frame_count = int.from_bytes(data[first + 50:first + 54], "big")
+
+    # Walk frames for the waveform (and the frame count if no VBR header had it)
+    gains = []
+    walked_frames = 0
+    pos = first
+    while True:
+        frame = _parse_frame_header(data, pos)
+        if not frame or frame["length"] <= 0:
+            break
+        # A cut-off last frame ends the walk; the complete frames still count
+        if pos + frame["length"] > len(data):
+            break
+        walked_frames += 1
+        if frame["layer"] == 3:
+            gains.append(max(_global_gains(data, pos, frame)))
+        pos += frame["length"]
+
+    if frame_count is None and walked_frames and pos >= len(data) - 128 and len(data) == size:
+        frame_count = walked_frames
+    if frame_count:
+        duration = frame_count * header["samples"] / header["sample_rate"]
+        bitrate = audio_bytes * 8 / duration if duration else bitrate
+    elif bitrate:
+        # Constant bitrate estimate
+        duration = audio_bytes * 8 / bitrate
+
+    return _result("mp3", duration, bitrate, title, artist, _gain_waveform(gains, points))
+
+
+# -----------------------
+# WAV (RIFF)
+# -----------------------
+def _read_wav(f, size, points):
+    f.seek(12)
+    fmt = None
+    data_offset = data_size = None
+    title = artist = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            break
+        chunk_id, chunk_size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+        if chunk_id == b"fmt ":
+            body = f.read(chunk_size)
+            fmt = struct.unpack("<HHIIHH", body[:16])
+        elif chunk_id == b"data":
+            data_offset, data_size = f.tell(), min(chunk_size, size - f.tell())
+            f.seek(chunk_size, 1)
+        elif chunk_id == b"LIST":
+            body = f.read(chunk_size)
+            if body[:4] == b"INFO":
+                i = 4
+                while i + 8 <= len(body):
+                    sub_id = body[i:i + 4]
+                    sub_size = struct.unpack("<I", body[i + 4:i + 8])[0]
+                    value = body[i + 8:i + 8 + sub_size].split(b"\x00")[0].decode("latin-1").strip()
+                    if sub_id == b"INAM":
+                        title = value or None
+                    elif sub_id == b"IART":
+                        artist = value or None
+                    i += 8 + sub_size + (sub_size & 1)
+        else:
+            f.seek(chunk_size, 1)
+        if chunk_size & 1:
+            f.seek(1, 1)
+
+    if not fmt or data_size is None:
+        return _result("wav", title=title, artist=artist)
+    audio_format, channels, sample_rate, byte_rate, block_align, bits = fmt
+    duration = data_size / byte_rate if byte_rate else None
+
+    waveform = None
+    if audio_format == 1 and bits in (8, 16) and block_align:
+        # Peak of a short window at the start of each bar
+        peaks = []
+        bar_bytes = data_size // points if points else 0
+        window = min(bar_bytes - bar_bytes % block_align, block_align * 2048)
+        if window > 0:
+            for i in range(points):
+                f.seek(data_offset + i * bar_bytes - (i * bar_bytes) % block_align)
+                raw = f.read(window)
+                if bits == 16:
+                    samples = array("h")
+                    samples.frombytes(raw[:len(raw) - len(raw) % 2])
+                    if samples.itemsize == 2 and struct.pack("=h", 1) != struct.pack("<h", 1):
+                        samples.byteswap()
+                    peaks.append(max((abs(s) for s in samples), default=0))
+                else:
+                    peaks.append(max((abs(b - 128) for b in raw), default=0))
+            waveform = downsample(peaks, points)
+
+    return _result("wav", duration, byte_rate * 8, title, artist, waveform)
+
+
+# -----------------------
+# Ogg (Vorbis / Opus)
+# -----------------------
+def _ogg_packets(f, max_bytes=1024 * 1024):
+    """Yield the first packets of an Ogg stream (enough for the headers)"""
+    packet = b""
+    read = 0
+    while read < max_bytes:
+        header = f.read(27)
+        if len(header) < 27 or header[:4] != b"OggS":
+            return
+        segments = f.read(header[26])
+        read += 27 + len(segments)
+        for length in segments:
+            packet += f.read(length)
+            read += length
+            if length < 255:
+                yield packet
+                packet = b""
+
+
+def _vorbis_comments(body):
+    """Parse a Vorbis comment block into an upper-cased dict"""
+    comments = {}
+    try:
+        vendor_length = struct.unpack("<I", body[:4])[0]
+        pos = 4 + vendor_length
+        count = struct.unpack("<I", body[pos:pos + 4])[0]
+        pos += 4
+        for _ in range(count):
+            length = struct.unpack("<I", body[pos:pos + 4])[0]
+            entry = body[pos + 4:pos + 4 + length].decode("utf-8", "replace")
+            pos += 4 + length
+            if "=" in entry:
+                key, value = entry.split("=", 1)
+                comments.setdefault(key.upper(), value.strip())
+    except struct.error:
+        pass
+    return comments
+
+
+def _read_ogg(f, size):
+    packets = _ogg_packets(f)
+    ident = next(packets, b"")
+    comment = next(packets, b"")
+
+    pre_skip = 0
+    nominal_bitrate = None
+    if ident[:7] == b"\x01vorbis":
+        fmt = "ogg"
+        sample_rate = struct.unpack("<I", ident[12:16])[0]
+        nominal_bitrate = struct.unpack("<i", ident[20:24])[0]
+        comments = _vorbis_comments(comment[7:]) if comment[:7] == b"\x03vorbis" else {}
+    elif ident[:8] == b"OpusHead":
+        fmt = "opus"
+        pre_skip = struct.unpack("<H", ident[10:12])[0]
+        sample_rate = 48000  # Opus granule positions always count 48 kHz samples
+        comments = _vorbis_comments(comment[8:]) if comment[:8] == b"OpusTags" else {}
+    else:
+        return _result("ogg")
+
+    # The granule position of the last page is the total sample count
+    f.seek(max(0, size - 65536))
+    tail = f.read()
+    last = tail.rfind(b"OggS")
+    duration = None
+    if last >= 0 and last + 14 <= len(tail):
+        granule = struct.unpack("<q", tail[last + 6:last + 14])[0]
+        if granule > 0 and sample_rate:
+            duration = (granule - pre_skip) / sample_rate
+
+    bitrate = nominal_bitrate if nominal_bitrate and nominal_bitrate > 0 else None
+    if not bitrate and duration:
+        bitrate = size * 8 / duration
+    return _result(fmt, duration, bitrate, comments.get("TITLE"), comments.get("ARTIST"))
+
+
+# -----------------------
+# MP4 / M4A
+# -----------------------
+_MP4_CONTAINERS = {b"moov", b"udta", b"ilst", b"trak", b"mdia"}
+
+
+def _mp4_atoms(data, start, end):
+    """Yield (type, body_start, body_end) for atoms in data[start:end]"""
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack(">I4s", data[pos:pos + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", data[pos + 8:pos + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield kind, pos + header, min(pos + size, end)
+        pos += size
+
+
+def _read_mp4(f, size):
+    # Find moov at the top level without reading mdat
+    moov = None
+    pos = 0
+    while pos + 8 <= size:
+        f.seek(pos)
+        header = f.read(16)
+        atom_size, kind = struct.unpack(">I4s", header[:8])
+        if atom_size == 1:
+            atom_size = struct.unpack(">Q", header[8:16])[0]
+        elif atom_size == 0:
+            atom_size = size - pos
+        if atom_size < 8:
+            break
+        if kind == b"moov":
+            f.seek(pos)
+            moov = f.read(atom_size)
+            break
+        pos += atom_size
+    if moov is None:
+        return _result("m4a")
+
+    found = {}
+
+    def walk(start, end):
+        for kind, body_start, body_end in _mp4_atoms(moov, start, end):
+            if kind == b"mvhd":
+                version = moov[body_start]
+                if version == 1:
+                    timescale, duration = struct.unpack(">IQ", moov[body_start + 20:body_start + 32])
+                else:
+                    timescale, duration = struct.unpack(">II", moov[body_start + 12:body_start + 20])
+                if timescale:
+                    found["duration"] = duration / timescale
+            elif kind == b"meta":
+                walk(body_start + 4, body_end)  # meta has version/flags before its children
+            elif kind in (b"\xa9nam", b"\xa9ART"):
+                for data_kind, data_start, data_end in _mp4_atoms(moov, body_start, body_end):
+                    if data_kind == b"data":
+                        value = moov[data_start + 8:data_end].decode("utf-8", "replace").strip()
+                        found["title" if kind == b"\xa9nam" else "artist"] = value
+            elif kind in _MP4_CONTAINERS:
+                walk(body_start, body_end)
+
+    walk(8, len(moov))
+    duration = found.get("duration")
+    bitrate = size * 8 / duration if duration else None
+    return _result("m4a", duration, bitrate, found.get("title"), found.get("artist"))
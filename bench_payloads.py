@@ -0,0 +1,54 @@
+"""
+Payload Benchmark
+Compares the size of server-rendered pages with their /api/v1 equivalents
+Runs in-process against the local users.db, signed in as --user-id
+
+Usage:
+    python bench_payloads.py [--user-id 1] [--other-id 2]
+"""
+import argparse
+import gzip
+
+
+def pairs(user_id, other_id):
+    """(label, html path, api path) for each screen the native client replaces"""
+    return [
+        ("forum feed", "/forum", "/api/v1/feed"),
+        ("stories", "/forum", "/api/v1/stories"),
+        ("profile", f"/profile/{other_id}", f"/api/v1/users/{other_id}"),
+        ("profile posts", f"/profile/{other_id}", f"/api/v1/users/{other_id}/posts"),
+        ("inbox", "/messages", "/api/v1/inbox"),
+        ("chat history", f"/messages/{other_id}", f"/api/v1/messages/{other_id}"),
+    ]
+
+
+def measure(client, path):
+    response = client.get(path, headers={"Accept-Encoding": "identity"})
+    body = response.get_data()
+    return response.status_code, len(body), len(gzip.compress(body, 6))
+
+
+def run(app_module, user_id, other_id, log=print):
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = user_id
+
+    rows = []
+    log(f"{'screen':<15}{'html':>10}{'html.gz':>10}{'api':>10}{'api.gz':>10}{'saved':>8}")
+    for label, html_path, api_path in pairs(user_id, other_id):
+        html_status, html_raw, html_gz = measure(client, html_path)
+        api_status, api_raw, api_gz = measure(client, api_path)
+        saved = 1 - api_gz / html_gz if html_gz else 0
+        rows.append((label, html_status, html_raw, html_gz, api_status, api_raw, api_gz))
+        log(f"{label:<15}{html_raw:>10}{html_gz:>10}{api_raw:>10}{api_gz:>10}{saved:>7.0%}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare HTML page and JSON API payload sizes")
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--other-id", type=int, default=2)
+    args = parser.parse_args()
+
+    import app
+    run(app, args.user_id, args.other_id)
@@ -0,0 +1,92 @@
+"""
+Startup Benchmark
+Measures worker cold start in fresh processes: `python -X importtime` for app.py
+and time-to-first-response (bootstrap + first template render)
+
+Usage:
+    python bench_startup.py [--runs 5] [--path /login] [--top 10]
+Set PRECOMPILE_TEMPLATES=1 or clear .jinja_cache/ to compare configurations.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+first = client.get(sys.argv[1])
+responded = time.perf_counter()
+client.get(sys.argv[1])
+warm = time.perf_counter()
+print(json.dumps({
+    "status": first.status_code,
+    "import_ms": (imported - started) * 1000,
+    "first_response_ms": (responded - imported) * 1000,
+    "warm_response_ms": (warm - responded) * 1000,
+}))
+"""
+
+
+def parse_importtime(stderr):
+    """Top-level modules from -X importtime output as {module: cumulative microseconds}"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        # Nested imports are indented below their parent
+        name = parts[2]
+        if name[1:2] == " ":
+            continue
+        modules[name.strip()] = int(parts[1])
+    return modules
+
+
+def run_once(path):
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD, path],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    result_line = proc.stdout.strip().splitlines()[-1] if proc.stdout.strip() else ""
+    if proc.returncode != 0 or not result_line.startswith("{"):
+        raise RuntimeError(f"benchmark child failed:\n{proc.stdout}\n{proc.stderr[-2000:]}")
+    return json.loads(result_line), parse_importtime(proc.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/login")
+    parser.add_argument("--top", type=int, default=10, help="Slowest top-level imports to list")
+    args = parser.parse_args()
+
+    results = []
+    imports = {}
+    for _ in range(args.runs):
+        result, modules = run_once(args.path)
+        results.append(result)
+        for name, us in modules.items():
+            imports.setdefault(name, []).append(us)
+
+    print(f"Cold start over {args.runs} runs (GET {args.path} -> {results[-1]['status']}), median:")
+    for key in ("import_ms", "first_response_ms", "warm_response_ms"):
+        print(f"  {key:<18} {statistics.median(r[key] for r in results):8.1f}")
+    total = statistics.median(r["import_ms"] + r["first_response_ms"] for r in results)
+    print(f"  {'time_to_first_ms':<18} {total:8.1f}")
+
+    print(f"\nSlowest top-level imports (cumulative, median):")
+    slowest = sorted(imports.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for name, samples in slowest[:args.top]:
+        print(f"  {statistics.median(samples) / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Wallet Concurrency Benchmark
+Hammers a few wallets from many threads (one SQLite connection each) and checks
+the books afterwards: every successful debit must be reflected in the balance,
+no balance may go negative, a resubmitted idempotency key must charge once and
+the ledger must reconcile
+
+Compares the old read-check-write pattern (deferred transaction, balance checked
+in Python, new balance written back) with wallet_service, then peer-to-peer
+transfers settled one per transaction against the queued, batched settlement of
+transfers.py. Runs against a scratch database in a temporary directory, never
+users.db.
+
+Usage:
+    python bench_wallet.py [--threads 32] [--ops 200] [--wallets 4] [--balance 1000]
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import ledger
+import transfers
+import wallet_service
+
+SCHEMA = """
+CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, wallet_balance REAL DEFAULT 0.0,
+                    wallet_cents INTEGER DEFAULT 0, subscription TEXT DEFAULT 'none');
+CREATE TABLE transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, type TEXT,
+                           amount REAL, description TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE wallet_operations (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
+                                idempotency_key TEXT NOT NULL, operation TEXT NOT NULL, result TEXT,
+                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                UNIQUE(user_id, idempotency_key));
+CREATE TABLE account_deletions (user_id INTEGER PRIMARY KEY);
+"""
+AMOUNT = 1.0
+
+
+def setup(path, wallets, balance):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    ledger.create_tables(conn)
+    transfers.create_tables(conn)
+    conn.executemany("INSERT INTO users (wallet_balance) VALUES (?)", [(balance,)] * wallets)
+    ledger.open_balances(conn)
+    conn.commit()
+    conn.close()
+
+
+def naive_debit(conn, user_id, amount):
+    """The pre-wallet_service pattern: read, check in Python, write the new balance"""
+    row = conn.execute("SELECT wallet_balance FROM users WHERE id=?", (user_id,)).fetchone()
+    if row[0] < amount:
+        return False
+    conn.execute("UPDATE users SET wallet_balance=? WHERE id=?", (row[0] - amount, user_id))
+    conn.execute(
+        "INSERT INTO transactions (user_id, type, amount, description) VALUES (?, 'purchase', ?, 'bench')",
+        (user_id, -amount)
+    )
+    conn.commit()
+    return True
+
+
+def service_debit(conn, user_id, amount, key=None):
+    try:
+        result = wallet_service.debit(conn, user_id, amount, "purchase", "bench", key=key)
+    except wallet_service.InsufficientFunds:
+        return False
+    return not result["replayed"]
+
+
+def run(mode, threads, ops, wallets, balance, log=print):
+    """
+    Run one scenario and audit the result.
+
+    Returns:
+        dict: successes, errors, lost updates, elapsed seconds and ops/s
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        setup(path, wallets, balance)
+        counts = {"ok": 0, "refused": 0, "errors": 0}
+        counts_lock = threading.Lock()
+        start_gate = threading.Barrier(threads)
+
+        def worker(n):
+            conn = sqlite3.connect(path, timeout=30)
+            local = {"ok": 0, "refused": 0, "errors": 0}
+            start_gate.wait()
+            for i in range(ops):
+                user_id = (n + i) % wallets + 1
+                try:
+                    if mode == "naive":
+                        done = naive_debit(conn, user_id, AMOUNT)
+                    elif mode == "service":
+                        done = service_debit(conn, user_id, AMOUNT)
+                    else:
+                        # Every operation is submitted twice with the same key
+                        key = f"{n}-{i}"
+                        done = service_debit(conn, user_id, AMOUNT, key)
+                        service_debit(conn, user_id, AMOUNT, key)
+                    local["ok" if done else "refused"] += 1
+                except sqlite3.OperationalError:
+                    if conn.in_transaction:
+                        conn.rollback()
+                    local["errors"] += 1
+            conn.close()
+            with counts_lock:
+                for name, value in local.items():
+                    counts[name] += value
+
+        started = time.perf_counter()
+        pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        conn = sqlite3.connect(path)
+        remaining = conn.execute("SELECT SUM(wallet_balance) FROM users").fetchone()[0]
+        negative = conn.execute("SELECT COUNT(*) FROM users WHERE wallet_balance < 0").fetchone()[0]
+        recorded = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+        # The naive path bypasses the ledger, so only the service runs must reconcile
+        problems = 0 if mode == "naive" else sum(map(len, ledger.reconcile(conn).values()))
+        conn.close()
+
+    # Every recorded debit should be missing from the balances; any excess was lost
+    lost = round((wallets * balance - remaining) / AMOUNT) - recorded
+    result = dict(counts, lost_updates=-lost, negative_wallets=negative, ledger_problems=problems,
+                  elapsed=elapsed, ops_per_s=(counts["ok"] + counts["refused"]) / elapsed)
+    log(f"{mode:<12}{counts['ok']:>8}{counts['refused']:>9}{counts['errors']:>8}"
+        f"{-lost:>8}{negative:>10}{problems:>9}{result['ops_per_s']:>10.0f}")
+    return result
+
+
+def run_transfers(mode, threads, ops, wallets, balance, log=print):
+    """
+    Send `ops` transfers per thread between random wallets. "direct" settles each
+    transfer in its own transaction on the requesting thread; "queued" only
+    queues them while one settlement thread drains the queue in batches.
+
+    Returns:
+        dict: settled, failed, leftover pending, money created or destroyed,
+        ledger problems and settled transfers per second
+    """
+    import random
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        setup(path, wallets, balance)
+        start_gate = threading.Barrier(threads + (1 if mode == "queued" else 0))
+        senders_done = threading.Event()
+
+        def sender(n):
+            rng = random.Random(n)
+            conn = sqlite3.connect(path, timeout=30)
+            start_gate.wait()
+            for _ in range(ops):
+                a, b = rng.sample(range(1, wallets + 1), 2)
+                transfers.request_transfer(conn, a, b, AMOUNT)
+                conn.commit()
+                if mode == "direct":
+                    transfers.settle_batch(conn, limit=1)
+            conn.close()
+
+        def settler():
+            conn = sqlite3.connect(path, timeout=30)
+            start_gate.wait()
+            while True:
+                done = senders_done.is_set()
+                settled, failed = transfers.settle_batch(conn)
+                if not settled and not failed:
+                    if done:
+                        break
+                    time.sleep(0.005)
+            conn.close()
+
+        started = time.perf_counter()
+        pool = [threading.Thread(target=sender, args=(n,)) for n in range(threads)]
+        if mode == "queued":
+            pool.append(threading.Thread(target=settler))
+        for thread in pool:
+            thread.start()
+        for thread in pool[:threads]:
+            thread.join()
+        senders_done.set()
+        for thread in pool[threads:]:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        conn = sqlite3.connect(path)
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM pending_transfers GROUP BY status").fetchall())
+        total = conn.execute("SELECT SUM(wallet_cents) FROM users").fetchone()[0]
+        negative = conn.execute("SELECT COUNT(*) FROM users WHERE wallet_cents < 0").fetchone()[0]
+        problems = sum(map(len, ledger.reconcile(conn).values()))
+        conn.close()
+
+    drift = total - ledger.to_minor(balance) * wallets
+    settled = counts.get("settled", 0)
+    result = dict(settled=settled, failed=counts.get("failed", 0), pending=counts.get("pending", 0),
+                  drift_cents=drift, negative_wallets=negative, ledger_problems=problems,
+                  elapsed=elapsed, settled_per_s=settled / elapsed)
+    log(f"{mode:<12}{settled:>8}{result['failed']:>9}{result['pending']:>8}{drift:>8}{negative:>10}"
+        f"{problems:>9}{result['settled_per_s']:>10.0f}")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check wallet debits for lost updates under concurrency")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--ops", type=int, default=200, help="debits per thread")
+    parser.add_argument("--wallets", type=int, default=4)
+    parser.add_argument("--balance", type=float, default=1000.0)
+    args = parser.parse_args()
+
+    print(f"{'mode':<12}{'ok':>8}{'refused':>9}{'errors':>8}{'lost':>8}{'negative':>10}{'ledger':>9}{'ops/s':>10}")
+    for mode in ("naive", "service", "idempotent"):
+        run(mode, args.threads, args.ops, args.wallets, args.balance)
+
+    print(f"\n{'transfers':<12}{'settled':>8}{'failed':>9}{'pending':>8}{'drift':>8}{'negative':>10}"
+          f"{'ledger':>9}{'settled/s':>10}")
+    for mode in ("direct", "queued"):
+        run_transfers(mode, args.threads, args.ops, args.wallets, args.balance)
@@ -0,0 +1,121 @@
+"""
+In-process caches
+Bounded LRU maps shared by the storage URL resolver and the rendered-fragment cache
+A shared backend (Redis) can sit behind the fragment cache when REDIS_URL is set
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+    REDIS_LIB_AVAILABLE = True
+except ImportError:
+    REDIS_LIB_AVAILABLE = False
+
+
+class LRUCache:
+    """Small thread-safe LRU map with optional per-entry expiry (epoch seconds)"""
+
+    def __init__(self, maxsize):
+        self.maxsize = max(1, int(maxsize))
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at=None):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def pop_matching(self, predicate):
+        """Drop every entry whose key satisfies predicate(key)"""
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FragmentCache:
+    """
+    Rendered HTML fragments keyed by a string that embeds the content version.
+
+    Lookups hit the local LRU first and then the shared backend (if any), so
+    several workers can reuse each other's renders. Stale versions are never
+    invalidated explicitly: a bumped version produces a new key and the old
+    entry ages out of the LRU (and the backend TTL).
+    """
+
+    def __init__(self, maxsize=2000, backend=None, ttl=24 * 3600, prefix="frag:"):
+        self.local = LRUCache(maxsize)
+        self.backend = backend
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        html = self.local.get(key)
+        if html is None and self.backend is not None:
+            try:
+                raw = self.backend.get(self.prefix + key)
+            except Exception as e:
+                print(f"⚠️  Fragment backend error: {e}")
+                raw = None
+            if raw is not None:
+                html = raw.decode("utf-8") if isinstance(raw, bytes) else raw
+                self.local.set(key, html)
+        if html is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return html
+
+    def set(self, key, html):
+        self.local.set(key, html)
+        if self.backend is not None:
+            try:
+                self.backend.set(self.prefix + key, html, ex=self.ttl)
+            except Exception as e:
+                print(f"⚠️  Fragment backend error: {e}")
+
+    def clear(self):
+        self.local.clear()
+
+
+def shared_backend():
+    """Redis client for REDIS_URL, or None when not configured/installed"""
+    url = os.environ.get("REDIS_URL")
+    if not url or not REDIS_LIB_AVAILABLE:
+        return None
+    try:
+        client = redis.Redis.from_url(url)
+        client.ping()
+        return client
+    except Exception as e:
+        print(f"⚠️  Redis unavailable - using in-process cache only: {e}")
+        return None
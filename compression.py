@@ -0,0 +1,267 @@
+"""
+Response Compression
+Content-negotiated gzip/brotli for dynamic responses and precompressed static assets
+Brotli is used when the optional `brotli` package is installed; gzip always works
+
+Build step (run at deploy time, no app import needed):
+    python compression.py static
+"""
+import os
+import sys
+import threading
+import time
+import zlib
+
+from flask import send_from_directory
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# Responses smaller than this are not worth the CPU (and often grow when compressed)
+MIN_SIZE = 1024
+
+# Dynamic responses favour speed; static files are compressed once at deploy time
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+STATIC_GZIP_LEVEL = 9
+STATIC_BROTLI_QUALITY = 11
+
+COMPRESSIBLE_TYPES = (
+    "text/", "application/json", "application/javascript",
+    "application/xml", "application/x-ndjson", "image/svg+xml",
+)
+
+# Static files worth precompressing; user uploads are skipped
+STATIC_EXTENSIONS = (".css", ".js", ".svg", ".html", ".json", ".txt", ".map")
+UPLOAD_DIRS = {"avatars", "uploads", "stories", "music", "products", "images"}
+
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+class CompressionMetrics:
+    """Per-encoding byte and CPU counters for dynamic compression plus static hits"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.encodings = {}
+        self.static_hits = {}
+
+    def record(self, encoding, bytes_in, bytes_out, cpu_seconds):
+        with self._lock:
+            entry = self.encodings.setdefault(
+                encoding, {"responses": 0, "bytes_in": 0, "bytes_out": 0, "cpu_seconds": 0.0}
+            )
+            entry["responses"] += 1
+            entry["bytes_in"] += bytes_in
+            entry["bytes_out"] += bytes_out
+            entry["cpu_seconds"] += cpu_seconds
+
+    def record_static(self, encoding):
+        with self._lock:
+            self.static_hits[encoding] = self.static_hits.get(encoding, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            encodings = {}
+            for encoding, entry in self.encodings.items():
+                encodings[encoding] = dict(
+                    entry,
+                    ratio=round(entry["bytes_in"] / entry["bytes_out"], 2) if entry["bytes_out"] else None,
+                    cpu_ms_per_response=round(entry["cpu_seconds"] * 1000 / entry["responses"], 3),
+                )
+            return {
+                "brotli_available": BROTLI_AVAILABLE,
+                "dynamic": encodings,
+                "static_hits": dict(self.static_hits),
+            }
+
+
+metrics = CompressionMetrics()
+
+
+def choose_encoding(request):
+    """Best encoding the client accepts ("br", "gzip") or None"""
+    offered = ["br", "gzip"] if BROTLI_AVAILABLE else ["gzip"]
+    return request.accept_encodings.best_match(offered)
+
+
+def _compressor(encoding, static=False):
+    """Object with compress(bytes)/flush() -> bytes for the given encoding"""
+    if encoding == "br":
+        return _BrotliCompressor(STATIC_BROTLI_QUALITY if static else BROTLI_QUALITY)
+    # wbits=31 -> gzip container
+    return _GzipCompressor(STATIC_GZIP_LEVEL if static else GZIP_LEVEL)
+
+
+class _GzipCompressor:
+    def __init__(self, level):
+        self._c = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data, sync=False):
+        out = self._c.compress(data)
+        if sync:
+            out += self._c.flush(zlib.Z_SYNC_FLUSH)
+        return out
+
+    def finish(self):
+        return self._c.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self, quality):
+        self._c = brotli.Compressor(quality=quality)
+
+    def compress(self, data, sync=False):
+        out = self._c.process(data)
+        if sync:
+            out += self._c.flush()
+        return out
+
+    def finish(self):
+        return self._c.finish()
+
+
+def _is_compressible(response):
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    if response.direct_passthrough or "Content-Encoding" in response.headers:
+        return False
+    mimetype = response.mimetype or ""
+    return mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def _stream(chunks, encoding):
+    """Compress a streamed body chunk by chunk, flushing each so the client sees bytes immediately"""
+    compressor = _compressor(encoding)
+    bytes_in = bytes_out = 0
+    cpu = 0.0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            if not chunk:
+                continue
+            started = time.thread_time()
+            out = compressor.compress(chunk, sync=True)
+            cpu += time.thread_time() - started
+            bytes_in += len(chunk)
+            bytes_out += len(out)
+            if out:
+                yield out
+        started = time.thread_time()
+        out = compressor.finish()
+        cpu += time.thread_time() - started
+        bytes_out += len(out)
+        yield out
+    finally:
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
+        metrics.record(encoding, bytes_in, bytes_out, cpu)
+
+
+def compress_response(response, request):
+    """
+    after_request hook: gzip/brotli-encode a response the client can accept.
+
+    Buffered bodies under MIN_SIZE are left alone; streamed bodies are always
+    compressed incrementally so time-to-first-byte is unchanged.
+    """
+    if not _is_compressible(response):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding(request)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_SIZE:
+            return response
+        started = time.thread_time()
+        compressor = _compressor(encoding)
+        body = compressor.compress(data) + compressor.finish()
+        metrics.record(encoding, len(data), len(body), time.thread_time() - started)
+        response.set_data(body)
+
+    response.headers["Content-Encoding"] = encoding
+    # The encoded body differs byte-for-byte, so only a weak validator still holds
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def send_precompressed(static_folder, filename, request):
+    """
+    Serve static/<filename>.br or .gz when the client accepts it and the
+    variant is at least as new as the original. Returns None to fall back.
+    """
+    if not filename.endswith(STATIC_EXTENSIONS):
+        return None
+    encoding = choose_encoding(request)
+    if encoding is None:
+        return None
+    original = os.path.join(static_folder, filename)
+    variant = original + SUFFIXES[encoding]
+    try:
+        if os.path.getmtime(variant) < os.path.getmtime(original):
+            return None
+    except OSError:
+        return None
+
+    import mimetypes
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    response = send_from_directory(static_folder, filename + SUFFIXES[encoding], mimetype=mimetype)
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    metrics.record_static(encoding)
+    return response
+
+
+def precompress_static(static_folder, log=print):
+    """
+    Write .gz (and .br when brotli is installed) next to every text asset.
+
+    Returns:
+        dict: files written and total original/compressed bytes
+    """
+    encodings = ["gzip", "br"] if BROTLI_AVAILABLE else ["gzip"]
+    stats = {"files": 0, "bytes_in": 0, "bytes_out": 0}
+    for root, dirs, files in os.walk(static_folder):
+        if root == static_folder:
+            dirs[:] = [d for d in dirs if d not in UPLOAD_DIRS]
+        for name in files:
+            if not name.endswith(STATIC_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            if len(data) < MIN_SIZE:
+                continue
+            for encoding in encodings:
+                compressor = _compressor(encoding, static=True)
+                body = compressor.compress(data) + compressor.finish()
+                with open(path + SUFFIXES[encoding], "wb") as f:
+                    f.write(body)
+                stats["files"] += 1
+                stats["bytes_in"] += len(data)
+                stats["bytes_out"] += len(body)
+                log(f"{os.path.relpath(path, static_folder)}.{SUFFIXES[encoding][1:]}: "
+                    f"{len(data)} -> {len(body)} bytes")
+    return stats
+
+
+if __name__ == "__main__":
+    folder = sys.argv[1] if len(sys.argv) > 1 else "static"
+    result = precompress_static(folder)
+    print(f"✅ Precompressed {result['files']} files: {result['bytes_in']} -> {result['bytes_out']} bytes")
@@ -10,3 +10,10 @@ BUCKET_UPLOADS = "uploads"
 BUCKET_MUSIC = "music"
 BUCKET_STORIES = "stories"
 BUCKET_IMAGES = "images"
+
+# Buckets served through signed URLs instead of public ones
+PRIVATE_BUCKETS = []
+
+# URL resolver cache size (entries) and signed URL lifetime (seconds)
+URL_CACHE_SIZE = 4096
+SIGNED_URL_TTL = 3600
@@ -34,19 +34,22 @@ TABLES = {
             verification_sent_at TIMESTAMP,
             last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             about_me TEXT DEFAULT '',
-            interests TEXT DEFAULT ''
+            interests TEXT DEFAULT '',
+            content_version INTEGER DEFAULT 0,
+            fanout_on_read {BOOL} DEFAULT 0
         )
     """,
     
     "posts": f"""
         CREATE TABLE IF NOT EXISTS posts (
             id {PK},
-            user_id INTEGER,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
             content TEXT,
             image TEXT,
             music TEXT,
             music_title TEXT,
             tags TEXT,
+            version INTEGER DEFAULT 0,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """,
@@ -54,7 +57,7 @@ TABLES = {
     "profile_posts": f"""
         CREATE TABLE IF NOT EXISTS profile_posts (
             id {PK},
-            user_id INTEGER,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
             content TEXT,
             image TEXT,
             music TEXT,
@@ -66,8 +69,8 @@ TABLES = {
     "likes": f"""
         CREATE TABLE IF NOT EXISTS likes (
             id {PK},
-            post_id INTEGER,
-            user_id INTEGER,
+            post_id INTEGER REFERENCES posts(id) ON DELETE CASCADE,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             UNIQUE(post_id, user_id)
         )
@@ -76,8 +79,8 @@ TABLES = {
     "messages": f"""
         CREATE TABLE IF NOT EXISTS messages (
             id {PK},
-            sender_id INTEGER,
-            receiver_id INTEGER,
+            sender_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            receiver_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
             content TEXT,
             sticker TEXT,
             money_amount REAL,
@@ -92,8 +95,8 @@ TABLES = {
     "notifications": f"""
         CREATE TABLE IF NOT EXISTS notifications (
             id {PK},
-            user_id INTEGER,
-            from_user INTEGER,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            from_user INTEGER REFERENCES users(id) ON DELETE CASCADE,
             type TEXT,
             content TEXT,
             is_read {BOOL} DEFAULT 0,
@@ -104,7 +107,7 @@ TABLES = {
     "applications": f"""
         CREATE TABLE IF NOT EXISTS applications (
             id {PK},
-            user_id INTEGER,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
             application_type TEXT,
             reason TEXT,
             experience TEXT,
@@ -117,8 +120,8 @@ TABLES = {
     "friendships": f"""
         CREATE TABLE IF NOT EXISTS friendships (
             id {PK},
-            user_id INTEGER,
-            friend_id INTEGER,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            friend_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
             status TEXT DEFAULT 'pending',
             UNIQUE(user_id, friend_id)
         )
@@ -127,8 +130,8 @@ TABLES = {
     "followers": f"""
         CREATE TABLE IF NOT EXISTS followers (
             id {PK},
-            follower_id INTEGER,
-            following_id INTEGER,
+            follower_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            following_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             UNIQUE(follower_id, following_id)
         )
@@ -137,8 +140,8 @@ TABLES = {
     "comments": f"""
         CREATE TABLE IF NOT EXISTS comments (
             id {PK},
-            post_id INTEGER,
-            user_id INTEGER,
+            post_id INTEGER REFERENCES posts(id) ON DELETE CASCADE,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
             content TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
@@ -147,17 +150,18 @@ TABLES = {
     "stories": f"""
         CREATE TABLE IF NOT EXISTS stories (
             id {PK},
-            user_id INTEGER,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
             content TEXT,
             image TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP
         )
     """,
     
     "products": f"""
         CREATE TABLE IF NOT EXISTS products (
             id {PK},
-            user_id INTEGER,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
             name TEXT,
             description TEXT,
             images TEXT,
@@ -171,7 +175,7 @@ TABLES = {
     "music_library": f"""
         CREATE TABLE IF NOT EXISTS music_library (
             id {PK},
-            user_id INTEGER,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
             title TEXT,
             filename TEXT,
             file_path TEXT,
@@ -182,7 +186,7 @@ TABLES = {
     "album_images": f"""
         CREATE TABLE IF NOT EXISTS album_images (
             id {PK},
-            user_id INTEGER,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
             image TEXT,
             caption TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -192,7 +196,7 @@ TABLES = {
     "transactions": f"""
         CREATE TABLE IF NOT EXISTS transactions (
             id {PK},
-            user_id INTEGER,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
             type TEXT,
             amount REAL,
             description TEXT,
@@ -203,8 +207,8 @@ TABLES = {
     "purchases": f"""
         CREATE TABLE IF NOT EXISTS purchases (
             id {PK},
-            user_id INTEGER,
-            product_id INTEGER,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            product_id INTEGER REFERENCES products(id) ON DELETE SET NULL,
             purchased_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """,
@@ -212,8 +216,8 @@ TABLES = {
     "blocked_users": f"""
         CREATE TABLE IF NOT EXISTS blocked_users (
             id {PK},
-            user_id INTEGER,
-            blocked_user_id INTEGER,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            blocked_user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             UNIQUE(user_id, blocked_user_id)
         )
@@ -222,7 +226,7 @@ TABLES = {
     "watch_rooms": f"""
         CREATE TABLE IF NOT EXISTS watch_rooms (
             id {PK},
-            host_id INTEGER,
+            host_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
             room_name TEXT,
             video_id TEXT,
             current_time REAL DEFAULT 0,
@@ -236,10 +240,129 @@ TABLES = {
     "watch_participants": f"""
         CREATE TABLE IF NOT EXISTS watch_participants  (
             id {PK},
-            room_id INTEGER,
-            user_id INTEGER,
+            room_id INTEGER REFERENCES watch_rooms(id) ON DELETE CASCADE,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
             joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             UNIQUE(room_id, user_id)
         )
+    """,
+    
+    "media_items": f"""
+        CREATE TABLE IF NOT EXISTS media_items (
+            id {PK},
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            source_type TEXT,
+            source_id INTEGER,
+            image TEXT,
+            caption TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(source_type, source_id)
+        )
+    """,
+    
+    "audio_metadata": f"""
+        CREATE TABLE IF NOT EXISTS audio_metadata (
+            path TEXT PRIMARY KEY,
+            format TEXT,
+            duration REAL,
+            bitrate INTEGER,
+            title TEXT,
+            artist TEXT,
+            waveform TEXT,
+            status TEXT DEFAULT 'pending',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    
+    "site_versions": f"""
+        CREATE TABLE IF NOT EXISTS site_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER DEFAULT 0
+        )
+    """,
+    
+    "change_log": f"""
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq {PK},
+            entity TEXT,
+            entity_id INTEGER,
+            op TEXT,
+            audience_a INTEGER,
+            audience_b INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    
+    "tags": f"""
+        CREATE TABLE IF NOT EXISTS tags (
+            id {PK},
+            name TEXT UNIQUE
+        )
+    """,
+    
+    "post_tags": f"""
+        CREATE TABLE IF NOT EXISTS post_tags (
+            post_id INTEGER REFERENCES posts(id) ON DELETE CASCADE,
+            tag_id INTEGER REFERENCES tags(id) ON DELETE CASCADE,
+            PRIMARY KEY (post_id, tag_id)
+        )
+    """,
+
+    "people_suggestions": f"""
+        CREATE TABLE IF NOT EXISTS people_suggestions (
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            suggested_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            score REAL,
+            mutual_friends INTEGER DEFAULT 0,
+            mutual_follows INTEGER DEFAULT 0,
+            shared_interests INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, suggested_id)
+        )
+    """,
+
+    "user_stats": f"""
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE PRIMARY KEY,
+            friend_count INTEGER DEFAULT 0,
+            follower_count INTEGER DEFAULT 0,
+            following_count INTEGER DEFAULT 0,
+            post_count INTEGER DEFAULT 0,
+            story_count INTEGER DEFAULT 0,
+            product_count INTEGER DEFAULT 0
+        )
+    """,
+
+    "friend_edges": f"""
+        CREATE TABLE IF NOT EXISTS friend_edges (
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            friend_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            status TEXT,
+            requested_by INTEGER,
+            request_id INTEGER REFERENCES friendships(id) ON DELETE CASCADE,
+            PRIMARY KEY (user_id, friend_id)
+        )
+    """,
+
+    "account_deletions": f"""
+        CREATE TABLE IF NOT EXISTS account_deletions (
+            user_id INTEGER PRIMARY KEY,
+            status TEXT DEFAULT 'pending',
+            step TEXT,
+            rows_deleted INTEGER DEFAULT 0,
+            files_deleted INTEGER DEFAULT 0,
+            requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """,
+
+    "timelines": f"""
+        CREATE TABLE IF NOT EXISTS timelines (
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            post_id INTEGER REFERENCES posts(id) ON DELETE CASCADE,
+            author_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            created_at TIMESTAMP,
+            PRIMARY KEY (user_id, post_id)
+        )
     """
 }
@@ -0,0 +1,202 @@
+"""
+Data Exports
+Streaming CSV/NDJSON exports of whole tables for admins, and each user's
+"download my data" zip archive
+
+Rows are read in keyset chunks (WHERE id > last ORDER BY id LIMIT n) and each
+chunk is encoded and yielded before the next one is read. Memory therefore
+stays flat whatever the table size, and no read transaction is held open for
+the whole download, so a long export never stalls writers or WAL checkpoints.
+"""
+import csv
+import io
+import json
+import zipfile
+
+CHUNK_SIZE = 1000
+
+# dataset -> (table, exported columns). Password hashes and verification codes are never exported
+DATASETS = {
+    "users": ("users", [
+        "id", "username", "email", "handle", "subscription", "wallet_balance", "badge",
+        "is_private", "is_verified", "is_approved", "verification_sent_at", "last_activity",
+    ]),
+    "transactions": ("transactions", ["id", "user_id", "type", "amount", "description", "created_at"]),
+    "purchases": ("purchases", ["id", "user_id", "product_id", "purchased_at"]),
+}
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+# Profile fields included in a user's own archive
+PROFILE_COLUMNS = DATASETS["users"][1] + [
+    "bio", "about_me", "interests", "avatar", "allow_messages", "hide_followers",
+]
+
+# (file in the archive, table, condition on the user's id, keyset column)
+ARCHIVE_SECTIONS = [
+    ("posts", "posts", "user_id=?", "id"),
+    ("profile_posts", "profile_posts", "user_id=?", "id"),
+    ("comments", "comments", "user_id=?", "id"),
+    ("likes", "likes", "user_id=?", "id"),
+    ("stories", "stories", "user_id=?", "id"),
+    ("album_images", "album_images", "user_id=?", "id"),
+    ("music_library", "music_library", "user_id=?", "id"),
+    ("products", "products", "user_id=?", "id"),
+    ("purchases", "purchases", "user_id=?", "id"),
+    ("transactions", "transactions", "user_id=?", "id"),
+    ("ledger", "ledger_entries", "user_id=?", "id"),
+    # Sent and received separately so each side uses its own messages index
+    ("messages_sent", "messages", "sender_id=?", "id"),
+    ("messages_received", "messages", "receiver_id=?", "id"),
+    ("notifications", "notifications", "user_id=?", "id"),
+    ("applications", "applications", "user_id=?", "id"),
+    ("friends", "friend_edges", "user_id=?", "friend_id"),
+    ("following", "followers", "follower_id=?", "id"),
+    ("followers", "followers", "following_id=?", "id"),
+    ("blocked_users", "blocked_users", "user_id=?", "id"),
+]
+
+
+def iter_chunks(conn, table, columns=None, where=None, params=(), key="id", chunk_size=CHUNK_SIZE):
+    """
+    Read a table in keyset order, one chunk at a time.
+
+    Args:
+        conn: database connection
+        table: table to read
+        columns: columns to select (None for all)
+        where: optional SQL condition, with `params` for its placeholders
+        key: unique, indexed column the chunks are keyed on
+        chunk_size: rows per query
+
+    Yields:
+        tuple: (column names, list of row tuples) for each non-empty chunk
+    """
+    select = ", ".join(columns) if columns else "*"
+    condition = f"({where}) AND " if where else ""
+    last = None
+    while True:
+        after = f"{key} > ?" if last is not None else "1"
+        cursor = conn.execute(
+            f"SELECT {select} FROM {table} WHERE {condition}{after} ORDER BY {key} LIMIT ?",
+            tuple(params) + ((last,) if last is not None else ()) + (chunk_size,)
+        )
+        names = [d[0] for d in cursor.description]
+        rows = [tuple(row) for row in cursor.fetchall()]
+        if not rows:
+            return
+        yield names, rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1][names.index(key)]
+
+
+def _csv_cell(value):
+    # Keep spreadsheet apps from evaluating user-supplied text as a formula
+    if isinstance(value, str) and value[:1] in ("=", "+", "-", "@"):
+        return "'" + value
+    return value
+
+
+def csv_lines(columns, chunks):
+    """CSV text for `chunks` (see iter_chunks), one string per chunk after the header"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for _, rows in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_csv_cell(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+
+
+def ndjson_lines(chunks):
+    """One JSON object per row, one string per chunk"""
+    for names, rows in chunks:
+        yield "".join(
+            json.dumps(dict(zip(names, row)), ensure_ascii=False, default=str) + "\n"
+            for row in rows
+        )
+
+
+def export_dataset(connect, dataset, fmt, chunk_size=CHUNK_SIZE):
+    """
+    Stream a whole admin dataset as CSV or NDJSON.
+
+    The generator opens its own connection with `connect` (the request's one is
+    gone by the time a streamed body is sent) and closes it when the download
+    ends or is abandoned.
+
+    Yields:
+        str: encoded chunks
+    """
+    table, columns = DATASETS[dataset]
+    conn = connect()
+    try:
+        chunks = iter_chunks(conn, table, columns, chunk_size=chunk_size)
+        if fmt == "csv":
+            yield from csv_lines(columns, chunks)
+        else:
+            yield from ndjson_lines(chunks)
+    finally:
+        conn.close()
+
+
+class _Pipe:
+    """Write-only file object; the archive generator drains what zipfile wrote"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def user_archive(connect, user_id, chunk_size=CHUNK_SIZE):
+    """
+    Stream a zip of everything stored about one user: profile.json plus one
+    NDJSON file per ARCHIVE_SECTIONS entry.
+
+    Members are deflated as they are written and the zip is built on a
+    non-seekable pipe, so nothing bigger than one chunk is ever buffered.
+
+    Yields:
+        bytes: pieces of the zip file
+    """
+    pipe = _Pipe()
+    conn = connect()
+    try:
+        with zipfile.ZipFile(pipe, "w", zipfile.ZIP_DEFLATED) as archive:
+            profile = conn.execute(
+                f"SELECT {', '.join(PROFILE_COLUMNS)} FROM users WHERE id=?", (user_id,)
+            ).fetchone()
+            archive.writestr("profile.json", json.dumps(
+                dict(zip(PROFILE_COLUMNS, profile)) if profile else {},
+                ensure_ascii=False, indent=2, default=str
+            ))
+            yield pipe.drain()
+
+            for name, table, where, key in ARCHIVE_SECTIONS:
+                with archive.open(f"{name}.ndjson", "w", force_zip64=True) as member:
+                    chunks = iter_chunks(conn, table, where=where, params=(user_id,),
+                                         key=key, chunk_size=chunk_size)
+                    for lines in ndjson_lines(chunks):
+                        member.write(lines.encode("utf-8"))
+                        yield pipe.drain()
+                yield pipe.drain()
+        yield pipe.drain()
+    finally:
+        conn.close()
@@ -0,0 +1,266 @@
+"""
+Wallet Ledger
+Append-only double-entry record of every money movement, in integer minor units (cents)
+
+Each posting is a journal of two or more entries that sum to zero: a wallet
+entry (user_id set) against a system account (user_id NULL) such as 'shop',
+'subscriptions' or 'admin_credit', or two wallet entries for a transfer.
+Triggers reject UPDATE and DELETE, so history can only be corrected by posting
+a reversing journal. Entries outlive the account they belong to, which keeps
+the audit trail intact after an account is deleted.
+
+users.wallet_cents is the running balance, moved in the same transaction as
+the entries. Every SNAPSHOT_INTERVAL wallet entries a user gets a
+ledger_snapshots row, so balance_at() costs one snapshot lookup plus the replay
+of at most SNAPSHOT_INTERVAL entries. reconcile() checks the whole ledger
+against the balances.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+MINOR_UNITS = 100
+SNAPSHOT_INTERVAL = 100
+
+# System accounts (entries with user_id NULL)
+OPENING_BALANCE = "opening_balance"
+SHOP = "shop"
+SUBSCRIPTIONS = "subscriptions"
+ADMIN_CREDIT = "admin_credit"
+CLOSED_ACCOUNTS = "closed_accounts"
+WALLET = "wallet"
+
+
+class UnbalancedJournal(ValueError):
+    pass
+
+
+def to_minor(amount):
+    """Currency amount (float, str or Decimal) as integer minor units, rounded half up"""
+    return int((Decimal(str(amount)) * MINOR_UNITS).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def to_major(cents):
+    return cents / MINOR_UNITS
+
+
+def create_tables(conn):
+    """Ledger tables, indexes and append-only triggers (idempotent)"""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS ledger_entries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        journal_id INTEGER NOT NULL,
+        account TEXT NOT NULL,
+        user_id INTEGER,
+        amount INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        description TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ledger_journal ON ledger_entries(journal_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger_entries(user_id, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user_created ON ledger_entries(user_id, created_at)")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS ledger_snapshots (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        entry_id INTEGER NOT NULL,
+        balance INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ledger_snapshots_user ON ledger_snapshots(user_id, entry_id)")
+    for action in ("UPDATE", "DELETE"):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_ledger_entries_no_{action.lower()}
+            BEFORE {action} ON ledger_entries
+            BEGIN SELECT RAISE(ABORT, 'ledger_entries is append-only'); END
+        """)
+
+
+def post(conn, kind, description, entries):
+    """
+    Append one balanced journal. Must run inside the caller's write
+    transaction, after the matching users.wallet_cents updates.
+
+    Args:
+        conn: database connection
+        kind: posting type (matches transactions.type)
+        description: shown in audits
+        entries: (account, user_id or None, amount in cents) tuples summing to zero
+
+    Returns:
+        int: the journal id
+    """
+    return post_many(conn, [(kind, description, entries)])[0]
+
+
+def post_many(conn, journals):
+    """
+    Append several balanced journals with one insert (see post).
+
+    Args:
+        journals: (kind, description, entries) tuples, in posting order
+
+    Returns:
+        list[int]: their journal ids
+    """
+    for kind, _, entries in journals:
+        if sum(amount for _, _, amount in entries) != 0:
+            raise UnbalancedJournal(f"{kind} journal does not balance: {entries}")
+    if not journals:
+        return []
+    # The caller holds the write lock, so MAX + 1 can't collide
+    first = conn.execute(
+        "SELECT COALESCE(MAX(journal_id), 0) + 1 FROM ledger_entries"
+    ).fetchone()[0]
+    rows = []
+    for journal_id, (kind, description, entries) in enumerate(journals, first):
+        rows.extend((journal_id, account, user_id, amount, kind, description)
+                    for account, user_id, amount in entries)
+    conn.executemany(
+        "INSERT INTO ledger_entries (journal_id, account, user_id, amount, kind, description) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        rows
+    )
+    for user_id in {row[2] for row in rows if row[2] is not None}:
+        _maybe_snapshot(conn, user_id)
+    return list(range(first, first + len(journals)))
+
+
+def _last_snapshot(conn, user_id, before_entry=None):
+    if before_entry is None:
+        return conn.execute(
+            "SELECT entry_id, balance FROM ledger_snapshots WHERE user_id=? ORDER BY entry_id DESC LIMIT 1",
+            (user_id,)
+        ).fetchone()
+    return conn.execute(
+        "SELECT entry_id, balance FROM ledger_snapshots WHERE user_id=? AND entry_id <= ? "
+        "ORDER BY entry_id DESC LIMIT 1",
+        (user_id, before_entry)
+    ).fetchone()
+
+
+def _maybe_snapshot(conn, user_id):
+    """Snapshot the balance once SNAPSHOT_INTERVAL entries have piled up since the last one"""
+    last = _last_snapshot(conn, user_id)
+    since = conn.execute("""
+        SELECT COUNT(*) FROM (
+            SELECT id FROM ledger_entries WHERE user_id=? AND id > ? ORDER BY id LIMIT ?
+        )
+    """, (user_id, last[0] if last else 0, SNAPSHOT_INTERVAL)).fetchone()[0]
+    if since < SNAPSHOT_INTERVAL:
+        return
+    entry_id = conn.execute(
+        "SELECT MAX(id) FROM ledger_entries WHERE user_id=?", (user_id,)
+    ).fetchone()[0]
+    balance = conn.execute("SELECT wallet_cents FROM users WHERE id=?", (user_id,)).fetchone()
+    if balance is not None:
+        conn.execute(
+            "INSERT INTO ledger_snapshots (user_id, entry_id, balance) VALUES (?, ?, ?)",
+            (user_id, entry_id, balance[0])
+        )
+
+
+def balance_at(conn, user_id, at=None):
+    """
+    A wallet's balance in cents as of timestamp `at` ("YYYY-MM-DD HH:MM:SS",
+    None for now): the newest snapshot no later than `at` plus the entries
+    after it.
+    """
+    if at is None:
+        last_entry = None
+    else:
+        last_entry = conn.execute(
+            "SELECT MAX(id) FROM ledger_entries WHERE user_id=? AND created_at <= ?", (user_id, at)
+        ).fetchone()[0]
+        if last_entry is None:
+            return 0
+    snapshot = _last_snapshot(conn, user_id, last_entry)
+    start, balance = (snapshot[0], snapshot[1]) if snapshot else (0, 0)
+    condition, params = ("AND id <= ?", [last_entry]) if last_entry is not None else ("", [])
+    replayed = conn.execute(
+        f"SELECT COALESCE(SUM(amount), 0) FROM ledger_entries WHERE user_id=? AND id > ? {condition}",
+        [user_id, start] + params
+    ).fetchone()[0]
+    return balance + replayed
+
+
+def open_balances(conn):
+    """
+    Seed the ledger for wallets that predate it: one opening_balance journal
+    per user with money but no wallet entries, and wallet_cents set from the
+    old float balance. Users already on the ledger are left alone.
+
+    Returns:
+        int: wallets opened
+    """
+    rows = conn.execute("""
+        SELECT id, wallet_balance FROM users
+        WHERE NOT EXISTS (SELECT 1 FROM ledger_entries e WHERE e.user_id = users.id)
+    """).fetchall()
+    opened = 0
+    for user_id, balance in rows:
+        cents = to_minor(balance or 0)
+        conn.execute(
+            "UPDATE users SET wallet_cents=?, wallet_balance=? WHERE id=?",
+            (cents, to_major(cents), user_id)
+        )
+        if cents:
+            post(conn, OPENING_BALANCE, "Opening balance",
+                 [(WALLET, user_id, cents), (OPENING_BALANCE, None, -cents)])
+            opened += 1
+    return opened
+
+
+def reconcile(conn, repair=False):
+    """
+    Verify the ledger against the stored balances.
+
+    Checks that every journal sums to zero, that each user's wallet_cents
+    equals the sum of their wallet entries, that wallet_balance matches
+    wallet_cents, that deleted accounts were closed to zero, and that each
+    user's latest snapshot matches a replay of the entries up to it. With
+    `repair`, drifted balances are reset from the ledger and bad snapshots
+    dropped (the ledger itself is never changed).
+
+    Returns:
+        dict: unbalanced journal ids, drifted user ids, deleted user ids with
+        money left on the ledger, and user ids with a bad snapshot
+    """
+    unbalanced = [row[0] for row in conn.execute(
+        "SELECT journal_id FROM ledger_entries GROUP BY journal_id HAVING SUM(amount) != 0"
+    )]
+    totals = dict(conn.execute(
+        "SELECT user_id, SUM(amount) FROM ledger_entries WHERE user_id IS NOT NULL GROUP BY user_id"
+    ).fetchall())
+    drifted = []
+    user_ids = set()
+    for user_id, cents, balance in conn.execute("SELECT id, wallet_cents, wallet_balance FROM users"):
+        user_ids.add(user_id)
+        expected = totals.get(user_id, 0)
+        if cents != expected or balance is None or to_minor(balance) != expected:
+            drifted.append(user_id)
+    unclosed = [user_id for user_id, total in totals.items() if user_id not in user_ids and total]
+    bad_snapshots = []
+    for user_id, entry_id, balance in conn.execute("""
+        SELECT s.user_id, s.entry_id, s.balance FROM ledger_snapshots s
+        WHERE s.entry_id = (SELECT MAX(entry_id) FROM ledger_snapshots WHERE user_id = s.user_id)
+    """).fetchall():
+        replayed = conn.execute(
+            "SELECT COALESCE(SUM(amount), 0) FROM ledger_entries WHERE user_id=? AND id <= ?",
+            (user_id, entry_id)
+        ).fetchone()[0]
+        if replayed != balance:
+            bad_snapshots.append(user_id)
+
+    if repair and (drifted or bad_snapshots):
+        for user_id in drifted:
+            cents = totals.get(user_id, 0)
+            conn.execute(
+                "UPDATE users SET wallet_cents=?, wallet_balance=? WHERE id=?",
+                (cents, to_major(cents), user_id)
+            )
+        if bad_snapshots:
+            # Snapshots are derived data; later postings write fresh ones
+            conn.executemany("DELETE FROM ledger_snapshots WHERE user_id=?", [(u,) for u in bad_snapshots])
+        conn.commit()
+    return {"unbalanced_journals": unbalanced, "drifted_users": drifted,
+            "unclosed_accounts": unclosed, "bad_snapshots": bad_snapshots}
@@ -0,0 +1,106 @@
+"""
+Media Garbage Collector
+Mark-and-sweep cleanup of uploaded files that no database row references
+Works against Supabase Storage buckets or the local static/ folders
+"""
+import time
+
+import storage
+
+# (table, column, is_comma_separated) for every column that stores an upload path
+MEDIA_COLUMNS = [
+    ("users", "avatar", False),
+    ("posts", "image", False),
+    ("posts", "music", False),
+    ("profile_posts", "image", False),
+    ("profile_posts", "music", False),
+    ("messages", "image", False),
+    ("messages", "music", False),
+    ("messages", "sticker", False),
+    ("stories", "image", False),
+    ("album_images", "image", False),
+    ("products", "images", True),
+    ("products", "file", False),
+    ("music_library", "file_path", False),
+]
+
+# Buckets (local: static/<bucket>) that hold user uploads
+MEDIA_BUCKETS = ["avatars", "uploads", "stories", "music", "products", "images"]
+
+# Files that are part of the app rather than user uploads
+KEEP_FILES = {"avatars/default.png"}
+
+def normalize_path(path):
+    """Turn a stored value ("/static/uploads/x.jpg", "uploads/x.jpg") into "uploads/x.jpg" """
+    path = (path or "").strip()
+    if not path or "://" in path:
+        return None
+    path = path.lstrip("/")
+    if path.startswith("static/"):
+        path = path[len("static/"):]
+    return path or None
+
+def collect_references(conn, columns=MEDIA_COLUMNS):
+    """
+    Mark phase: build the set of every file path referenced by a media column
+
+    Rows are streamed from the cursor so only the set itself is held in memory.
+    Tables or columns missing from an older schema are skipped.
+    """
+    referenced = set()
+    for table, column, is_list in columns:
+        try:
+            cursor = conn.execute(
+                f"SELECT {column} FROM {table} WHERE {column} IS NOT NULL AND {column} != ''"
+            )
+        except Exception as e:
+            print(f"⚠️  Skipping {table}.{column}: {e}")
+            continue
+        for (value,) in cursor:
+            values = value.split(",") if is_list else [value]
+            for v in values:
+                path = normalize_path(v)
+                if path:
+                    referenced.add(path)
+    return referenced
+
+def collect_garbage(conn, dry_run=True, grace_seconds=24 * 3600, buckets=MEDIA_BUCKETS, log=print):
+    """
+    Sweep phase: delete files that are unreferenced and older than the grace period
+
+    The grace period protects files uploaded moments ago whose row has not
+    been committed yet.
+
+    Returns:
+        dict: scanned/orphaned/deleted file counts and byte totals
+    """
+    referenced = collect_references(conn)
+    cutoff = time.time() - grace_seconds
+    stats = {
+        "referenced": len(referenced),
+        "scanned_files": 0, "scanned_bytes": 0,
+        "orphan_files": 0, "orphan_bytes": 0,
+        "deleted_files": 0, "deleted_bytes": 0,
+    }
+
+    for bucket in buckets:
+        for path, size, modified in storage.list_files(bucket):
+            stats["scanned_files"] += 1
+            stats["scanned_bytes"] += size
+
+            name = path.rsplit("/", 1)[-1]
+            if path in referenced or path in KEEP_FILES or name.startswith("."):
+                continue
+            if modified > cutoff:
+                continue
+
+            stats["orphan_files"] += 1
+            stats["orphan_bytes"] += size
+            if dry_run:
+                log(f"[dry-run] would delete {path} ({size} bytes)")
+            elif storage.delete_file(path, bucket):
+                stats["deleted_files"] += 1
+                stats["deleted_bytes"] += size
+                log(f"deleted {path} ({size} bytes)")
+
+    return stats
@@ -0,0 +1,266 @@
+"""
+People You May Know
+Offline recommender over the friend and follower graphs, run as a batch job
+Candidates are friends-of-friends and co-followers (users who follow the same
+accounts); each is scored by mutual friends, mutual follows and shared interests,
+and the top K per user are written to people_suggestions for the profile page
+
+Uses SciPy sparse matrix products when SciPy/NumPy are installed and falls back
+to pure Python otherwise. Users are processed in blocks, so memory stays bounded
+by the graph itself plus one block of candidate rows.
+"""
+from collections import Counter
+from itertools import chain
+
+from tag_index import parse_tags
+
+try:
+    import numpy as np
+    import scipy.sparse as sp
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+TOP_K = 20
+BLOCK_SIZE = 2000
+
+# Score weights
+MUTUAL_FRIEND_WEIGHT = 1.0
+MUTUAL_FOLLOW_WEIGHT = 0.5
+SHARED_INTEREST_WEIGHT = 0.25
+
+# Accounts with more friends/followers than this are skipped as intermediaries:
+# sharing a celebrity says little and would make every fan a candidate of every other
+FRIEND_HUB_DEGREE = 5000
+FOLLOW_HUB_DEGREE = 1000
+
+# Only the most common interests are compared (kept as a 256-bit mask per user)
+INTEREST_VOCABULARY = 256
+
+FRIENDS_SQL = "SELECT user_id, friend_id FROM friend_edges WHERE status = 'accepted'"
+# Pending requests count as existing edges: never suggest someone already asked
+PENDING_SQL = "SELECT user_id, friend_id FROM friend_edges WHERE status != 'accepted'"
+FOLLOWS_SQL = "SELECT follower_id, following_id FROM followers"
+BLOCKS_SQL = "SELECT user_id, blocked_user_id FROM blocked_users"
+
+
+def load_interests(conn):
+    """{user id: set of interests}, limited to the INTEREST_VOCABULARY most common"""
+    interests = {
+        row[0]: set(parse_tags(row[1]))
+        for row in conn.execute("SELECT id, interests FROM users WHERE interests IS NOT NULL AND interests != ''")
+    }
+    counts = Counter(tag for tags in interests.values() for tag in tags)
+    vocabulary = [tag for tag, _ in sorted(counts.items(), key=lambda item: (-item[1], item[0]))]
+    vocabulary = {tag: bit for bit, tag in enumerate(vocabulary[:INTEREST_VOCABULARY])}
+    kept = {}
+    for user_id, tags in interests.items():
+        tags = {tag for tag in tags if tag in vocabulary}
+        if tags:
+            kept[user_id] = tags
+    return kept, vocabulary
+
+
+def _write_block(conn, first_id, last_id, rows):
+    """Replace the stored suggestions of users first_id..last_id"""
+    conn.execute("DELETE FROM people_suggestions WHERE user_id BETWEEN ? AND ?", (first_id, last_id))
+    # Accounts deleted since the graph was read are skipped (foreign keys would reject them)
+    conn.executemany("""
+        INSERT INTO people_suggestions
+            (user_id, suggested_id, score, mutual_friends, mutual_follows, shared_interests)
+        SELECT ?1, ?2, ?3, ?4, ?5, ?6
+        WHERE EXISTS (SELECT 1 FROM users WHERE id = ?1) AND EXISTS (SELECT 1 FROM users WHERE id = ?2)
+    """, rows)
+    conn.commit()
+
+
+def compute_suggestions(conn, top_k=TOP_K, block_size=BLOCK_SIZE, use_scipy=None, log=print):
+    """
+    Recompute people_suggestions for every user.
+
+    Args:
+        conn: database connection (committed after each block)
+        top_k: suggestions kept per user
+        block_size: users processed per block
+        use_scipy: force the SciPy (True) or pure-Python (False) path
+
+    Returns:
+        dict: users processed and suggestions written
+    """
+    if use_scipy is None:
+        use_scipy = SCIPY_AVAILABLE
+    user_ids = [row[0] for row in conn.execute("SELECT id FROM users ORDER BY id")]
+    if not user_ids:
+        conn.execute("DELETE FROM people_suggestions")
+        conn.commit()
+        return {"users": 0, "suggestions": 0}
+
+    compute = _compute_scipy if use_scipy else _compute_python
+    written = 0
+    for first, last, rows in compute(conn, user_ids, top_k, block_size, log):
+        _write_block(conn, first, last, rows)
+        written += len(rows)
+    # Users deleted since the last run
+    conn.execute("DELETE FROM people_suggestions WHERE user_id NOT IN (SELECT id FROM users)")
+    conn.commit()
+    return {"users": len(user_ids), "suggestions": written}
+
+
+def _score(mutual_friends, mutual_follows, shared_interests):
+    return (MUTUAL_FRIEND_WEIGHT * mutual_friends + MUTUAL_FOLLOW_WEIGHT * mutual_follows
+            + SHARED_INTEREST_WEIGHT * shared_interests)
+
+
+# -----------------------
+# Pure Python
+# -----------------------
+def _compute_python(conn, user_ids, top_k, block_size, log):
+    friend_sets, following, followers, excluded = {}, {}, {}, {}
+    for a, b in conn.execute(FRIENDS_SQL):
+        friend_sets.setdefault(a, set()).add(b)
+    for a, b in conn.execute(FOLLOWS_SQL):
+        following.setdefault(a, set()).add(b)
+        followers.setdefault(b, set()).add(a)
+    for a, b in chain(conn.execute(PENDING_SQL).fetchall(), conn.execute(BLOCKS_SQL).fetchall()):
+        excluded.setdefault(a, set()).add(b)
+        excluded.setdefault(b, set()).add(a)
+    interests, _ = load_interests(conn)
+    log(f"Graph: {len(user_ids)} users, {sum(map(len, friend_sets.values())) // 2} friendships, "
+        f"{sum(map(len, following.values()))} follows (pure Python)")
+
+    for start in range(0, len(user_ids), block_size):
+        block = user_ids[start:start + block_size]
+        rows = []
+        for user_id in block:
+            mine = friend_sets.get(user_id, set())
+            mutual_friends = Counter()
+            for friend in mine:
+                others = friend_sets.get(friend, ())
+                if len(others) <= FRIEND_HUB_DEGREE:
+                    mutual_friends.update(others)
+            mutual_follows = Counter()
+            for followed in following.get(user_id, ()):
+                fans = followers.get(followed, ())
+                if len(fans) <= FOLLOW_HUB_DEGREE:
+                    mutual_follows.update(fans)
+
+            skip = mine | following.get(user_id, set()) | excluded.get(user_id, set()) | {user_id}
+            my_interests = interests.get(user_id, set())
+            scored = []
+            for other in set(mutual_friends) | set(mutual_follows):
+                if other in skip:
+                    continue
+                mf, mo = mutual_friends[other], mutual_follows[other]
+                si = len(my_interests & interests[other]) if other in interests else 0
+                scored.append((-_score(mf, mo, si), other, mf, mo, si))
+            scored.sort()
+            rows.extend((user_id, other, -neg, mf, mo, si) for neg, other, mf, mo, si in scored[:top_k])
+        yield block[0], block[-1], rows
+
+
+# -----------------------
+# SciPy sparse
+# -----------------------
+# Mutual friend and follow counts travel in one matrix: friends * PACK + follows
+PACK = float(1 << 24)
+
+
+def _pair_array(conn, sql):
+    cursor = conn.execute(sql)
+    return np.fromiter(chain.from_iterable(cursor), dtype=np.int64).reshape(-1, 2)
+
+
+def _matrix(pairs, index):
+    """0/1 CSR matrix with a 1 at (index of a, index of b) for each (a, b) of known users"""
+    n = len(index)
+    rows = np.searchsorted(index, pairs[:, 0])
+    cols = np.searchsorted(index, pairs[:, 1])
+    rows_c = np.minimum(rows, n - 1)
+    cols_c = np.minimum(cols, n - 1)
+    keep = (index[rows_c] == pairs[:, 0]) & (index[cols_c] == pairs[:, 1])
+    m = sp.csr_matrix(
+        (np.ones(int(keep.sum())), (rows_c[keep], cols_c[keep])), shape=(n, n)
+    )
+    m.data[:] = 1  # collapse duplicates
+    return m
+
+
+def _drop_hubs(m, limit):
+    """Zero the columns of m with more than `limit` entries"""
+    keep = np.asarray((m > 0).sum(axis=0)).ravel() <= limit
+    if keep.all():
+        return m
+    return (m @ sp.diags(keep.astype(np.float64))).tocsr()
+
+
+def _interest_masks(conn, index):
+    """(n, words) uint64 bitmask of each user's interests"""
+    interests, vocabulary = load_interests(conn)
+    words = max(1, (len(vocabulary) + 63) // 64)
+    masks = np.zeros((len(index), words), dtype=np.uint64)
+    pairs = [(user_id, vocabulary[tag]) for user_id, tags in interests.items() for tag in tags]
+    if pairs:
+        users, bits = np.asarray(pairs, dtype=np.int64).T
+        pos = np.minimum(np.searchsorted(index, users), len(index) - 1)
+        known = index[pos] == users
+        np.bitwise_or.at(
+            masks, (pos[known], bits[known] // 64),
+            np.left_shift(np.uint64(1), (bits[known] % 64).astype(np.uint64))
+        )
+    return masks
+
+
+def _popcount(values):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values).sum(axis=1)
+    table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    return table[values.view(np.uint8)].sum(axis=1)
+
+
+def _compute_scipy(conn, user_ids, top_k, block_size, log):
+    index = np.asarray(user_ids, dtype=np.int64)
+    n = len(index)
+    F = _matrix(_pair_array(conn, FRIENDS_SQL), index)
+    G = _matrix(_pair_array(conn, FOLLOWS_SQL), index)          # G[u, v] = 1 if u follows v
+    P = _matrix(np.concatenate((_pair_array(conn, PENDING_SQL), _pair_array(conn, BLOCKS_SQL))), index)
+    excluded = (F + G + P + P.T + sp.identity(n, format="csr")).tocsr()
+    log(f"Graph: {n} users, {F.nnz // 2} friendships, {G.nnz} follows (SciPy)")
+
+    # FoF = F_walk F^T and co-follows = G_walk G^T, packed into one product per block
+    walk = sp.hstack((_drop_hubs(F, FRIEND_HUB_DEGREE) * PACK, _drop_hubs(G, FOLLOW_HUB_DEGREE))).tocsr()
+    reach = sp.vstack((F.T, G.T)).tocsr()
+    masks = _interest_masks(conn, index)
+    has_interests = masks.any(axis=1)
+
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        candidates = (walk[start:stop] @ reach).tocsr()
+        # Drop self, existing friends/requests, followed and blocked users
+        candidates = (candidates - candidates.multiply(excluded[start:stop] > 0)).tocsr()
+        candidates.sort_indices()
+        candidates = candidates.tocoo()
+        nonzero = candidates.data > 0
+        r = candidates.row[nonzero]
+        c = candidates.col[nonzero]
+        packed = candidates.data[nonzero]
+        rows = []
+        if len(r):
+            mf = np.floor(packed / PACK)
+            mo = packed - mf * PACK
+            si = np.zeros(len(r), dtype=np.int64)
+            both = has_interests[start + r] & has_interests[c]
+            if both.any():
+                si[both] = _popcount(masks[start + r[both]] & masks[c[both]])
+            score = _score(mf, mo, si)
+            # Best first per row: rows and ids are already ascending, so one stable
+            # sort on (row, -score) keeps ties in user id order
+            order = np.argsort(r * (score.max() + 1) - score, kind="stable")
+            r, c, mf, mo, si, score = r[order], c[order], mf[order], mo[order], si[order], score[order]
+            rank = np.arange(len(r)) - np.searchsorted(r, r)
+            keep = rank < top_k
+            rows = list(zip(
+                index[start + r[keep]].tolist(), index[c[keep]].tolist(), score[keep].tolist(),
+                mf[keep].astype(np.int64).tolist(), mo[keep].astype(np.int64).tolist(),
+                si[keep].tolist(),
+            ))
+        yield int(index[start]), int(index[stop - 1]), rows
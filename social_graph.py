@@ -0,0 +1,199 @@
+"""
+Social Graph Cache
+Per-process cache of each active user's friend, follower/following and block sets
+Entries load lazily on a miss (a handful of primary-key/index range scans), are
+dropped by the routes that change a relationship, and are evicted least-recently
+used once the cache exceeds its memory budget
+
+Other workers can't see this process's invalidations, so every entry also expires
+after GRAPH_CACHE_TTL seconds; that bounds how long another worker can serve a stale
+relationship.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Approximate bytes held per cached id (set slot + int object) and per entry
+BYTES_PER_ID = 64
+BYTES_PER_ENTRY = 1024
+
+GRAPH_CACHE_BYTES = int(os.environ.get("GRAPH_CACHE_BYTES", 64 * 1024 * 1024))
+GRAPH_CACHE_TTL = int(os.environ.get("GRAPH_CACHE_TTL", 60))
+
+# Entries bigger than this share of the budget (celebrity accounts) are served
+# but not kept, so one huge user can't flush everyone else
+MAX_ENTRY_SHARE = 0.125
+
+
+def edge_friendship(user_id, other_id, edge):
+    """
+    Rebuild the friendships row from user_id's (status, requested_by, request_id)
+    edge to other_id, as a dict; None when there is no edge
+    """
+    if edge is None or edge[0] is None:
+        return None
+    status, requested_by, request_id = edge
+    return {
+        "id": request_id,
+        "user_id": requested_by,
+        "friend_id": user_id if requested_by == other_id else other_id,
+        "status": status,
+    }
+
+
+class UserGraph:
+    """One user's relationships as id sets"""
+    __slots__ = ("user_id", "edges", "friends", "followers", "following",
+                 "blocked", "blocked_by", "block_set", "cost")
+
+    def __init__(self, user_id, edges, followers, following, blocked, blocked_by):
+        self.user_id = user_id
+        # other user id -> (status, requested_by, request_id), from friend_edges
+        self.edges = edges
+        self.friends = frozenset(other for other, edge in edges.items() if edge[0] == "accepted")
+        self.followers = frozenset(followers)
+        self.following = frozenset(following)
+        self.blocked = frozenset(blocked)
+        self.blocked_by = frozenset(blocked_by)
+        # Blocks hide content in both directions
+        self.block_set = self.blocked | self.blocked_by
+        ids = (len(edges) + len(self.friends) + len(self.followers) + len(self.following)
+               + 2 * (len(self.blocked) + len(self.blocked_by)))
+        self.cost = BYTES_PER_ENTRY + ids * BYTES_PER_ID
+
+    def is_friend(self, other_id):
+        return other_id in self.friends
+
+    def friendship(self, other_id):
+        """The friendships row between this user and other_id as a dict, or None"""
+        return edge_friendship(self.user_id, other_id, self.edges.get(other_id))
+
+    def friendship_status(self, other_id):
+        """'accepted', 'pending' or 'none'"""
+        edge = self.edges.get(other_id)
+        return edge[0] if edge else "none"
+
+    def incoming_request_count(self):
+        return sum(1 for other, edge in self.edges.items()
+                   if edge[0] == "pending" and edge[1] == other)
+
+    def is_blocked_with(self, other_id):
+        """True if either user has blocked the other"""
+        return other_id in self.block_set
+
+    def neighbours(self):
+        return (set(self.edges) | self.followers | self.following
+                | self.blocked | self.blocked_by)
+
+
+def load_user_graph(conn, user_id):
+    """Read one user's relationships from the database"""
+    edges = {
+        row[0]: (row[1], row[2], row[3])
+        for row in conn.execute(
+            "SELECT friend_id, status, requested_by, request_id FROM friend_edges WHERE user_id=?",
+            (user_id,)
+        )
+    }
+    followers = [row[0] for row in conn.execute(
+        "SELECT follower_id FROM followers WHERE following_id=?", (user_id,))]
+    following = [row[0] for row in conn.execute(
+        "SELECT following_id FROM followers WHERE follower_id=?", (user_id,))]
+    blocked = [row[0] for row in conn.execute(
+        "SELECT blocked_user_id FROM blocked_users WHERE user_id=?", (user_id,))]
+    blocked_by = [row[0] for row in conn.execute(
+        "SELECT user_id FROM blocked_users WHERE blocked_user_id=?", (user_id,))]
+    return UserGraph(user_id, edges, followers, following, blocked, blocked_by)
+
+
+class GraphCache:
+    """LRU of UserGraph entries bounded by an approximate byte budget"""
+
+    def __init__(self, max_bytes=GRAPH_CACHE_BYTES, ttl=GRAPH_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()  # user_id -> (UserGraph, expires_at)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Bumped by every invalidation; a load that raced one is not stored
+        self._generation = 0
+
+    def get(self, conn, user_id):
+        """Cached graph for user_id, loading it with `conn` on a miss"""
+        with self._lock:
+            entry = self._data.get(user_id)
+            if entry is not None and entry[1] > time.time():
+                self._data.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generation
+
+        graph = load_user_graph(conn, user_id)
+        if graph.cost <= self.max_bytes * MAX_ENTRY_SHARE:
+            with self._lock:
+                if generation != self._generation:
+                    return graph
+                self._remove(user_id)
+                self._data[user_id] = (graph, time.time() + self.ttl)
+                self.bytes += graph.cost
+                while self.bytes > self.max_bytes and self._data:
+                    _, (evicted, _) = self._data.popitem(last=False)
+                    self.bytes -= evicted.cost
+                    self.evictions += 1
+        return graph
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                self._remove(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def _remove(self, user_id):
+        entry = self._data.pop(user_id, None)
+        if entry is not None:
+            self.bytes -= entry[0].cost
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+graphs = GraphCache()
+
+
+def user_graph(conn, user_id):
+    return graphs.get(conn, user_id)
+
+
+def invalidate(*user_ids):
+    """Drop cached graphs after a relationship between these users changed"""
+    graphs.invalidate(*user_ids)
+
+
+def block_set(conn, user_id):
+    """Ids user_id has blocked or been blocked by (cached with the rest of the graph)"""
+    return graphs.get(conn, user_id).block_set
+
+
+def without_blocked(rows, blocked, key="user_id"):
+    """rows whose `key` user is not in the viewer's block set"""
+    if not blocked:
+        return list(rows)
+    return [row for row in rows if row[key] not in blocked]
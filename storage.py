@@ -4,8 +4,10 @@ Handles file uploads and URL generation for Supabase Storage
 Falls back to local storage if Supabase is not configured
 """
 import os
+import uuid
 from werkzeug.utils import secure_filename
 import time
+from cache import LRUCache
 
 # Try to import Supabase and config
 try:
@@ -28,6 +30,9 @@ except ImportError:
         BUCKET_MUSIC = "music"
         BUCKET_STORIES = "stories"
         BUCKET_IMAGES = "images"
+        PRIVATE_BUCKETS = []
+        URL_CACHE_SIZE = 4096
+        SIGNED_URL_TTL = 3600
     config = MockConfig()
 
 # Also check environment variables (for Render deployment)
@@ -76,8 +81,8 @@ def upload_file(file, bucket_name, folder="", local_folder="static"):
         return None
     
     filename = secure_filename(file.filename)
-    timestamp = str(int(time.time()))
-    unique_filename = f"{timestamp}_{filename}"
+    # Random prefix: a timestamp collides when the same name is uploaded twice in a second
+    unique_filename = f"{uuid.uuid4().hex}_{filename}"
     
     if SUPABASE_ENABLED and supabase:
         # Upload to Supabase Storage
@@ -114,6 +119,51 @@ def upload_file(file, bucket_name, folder="", local_folder="static"):
     # Return relative path from static folder
     return f"{bucket_name}/{unique_filename}"
 
+# -----------------------
+# URL resolver cache
+# -----------------------
+URL_CACHE_SIZE = int(getattr(config, 'URL_CACHE_SIZE', 4096))
+SIGNED_URL_TTL = int(getattr(config, 'SIGNED_URL_TTL', 3600))
+PRIVATE_BUCKETS = set(getattr(config, 'PRIVATE_BUCKETS', []) or [])
+
+# Signed URLs are dropped from the cache this many seconds before they expire
+SIGNED_URL_MARGIN = 60
+
+_public_urls = LRUCache(URL_CACHE_SIZE)
+_signed_urls = LRUCache(URL_CACHE_SIZE)
+
+# bucket -> (prefix, suffix) around the object path in a public URL
+_bucket_url_templates = {}
+_URL_PROBE = "__fanvy_url_probe__"
+
+def _strip_bucket(path, bucket_name):
+    """Remove a leading "<bucket>/" from a stored path"""
+    prefix = f"{bucket_name}/"
+    return path[len(prefix):] if path.startswith(prefix) else path
+
+def _bucket_url_template(bucket_name):
+    """
+    Get the (prefix, suffix) of public URLs for a bucket.
+
+    The Supabase client is asked once per bucket for the URL of a probe
+    object; every later URL is built by string concatenation.
+    """
+    template = _bucket_url_templates.get(bucket_name)
+    if template is None:
+        probe_url = supabase.storage.from_(bucket_name).get_public_url(_URL_PROBE)
+        if _URL_PROBE not in probe_url:
+            raise ValueError(f"Unexpected public URL format: {probe_url}")
+        prefix, suffix = probe_url.split(_URL_PROBE, 1)
+        template = (prefix, suffix)
+        _bucket_url_templates[bucket_name] = template
+    return template
+
+def clear_url_cache():
+    """Forget cached bucket templates and resolved URLs"""
+    _bucket_url_templates.clear()
+    _public_urls.clear()
+    _signed_urls.clear()
+
 def get_public_url(path, bucket_name):
     """
     Get public URL for a file in Supabase Storage
@@ -128,18 +178,59 @@ def get_public_url(path, bucket_name):
     if not path:
         return None
     
-    # If Supabase is enabled, get public URL
+    # If Supabase is enabled, build the URL from the cached bucket template
     if SUPABASE_ENABLED and supabase:
+        key = (bucket_name, path)
+        url = _public_urls.get(key)
+        if url is not None:
+            return url
         try:
-            # Remove bucket name from path if it's included
-            clean_path = path.replace(f"{bucket_name}/", "")
-            return supabase.storage.from_(bucket_name).get_public_url(clean_path)
+            prefix, suffix = _bucket_url_template(bucket_name)
+            url = f"{prefix}{_strip_bucket(path, bucket_name)}{suffix}"
+            _public_urls.set(key, url)
+            return url
         except Exception as e:
             print(f"Error getting public URL: {e}")
     
     # Return local static path
     return f"/static/{path}"
 
+def get_signed_url(path, bucket_name, expires_in=None):
+    """
+    Get a time-limited URL for a file in a private bucket
+    
+    Args:
+        path: File path in bucket
+        bucket_name: Name of the storage bucket
+        expires_in: Lifetime of the URL in seconds (defaults to SIGNED_URL_TTL)
+    
+    Returns:
+        str: Signed URL or local path
+    """
+    if not path:
+        return None
+    
+    if SUPABASE_ENABLED and supabase:
+        expires_in = expires_in or SIGNED_URL_TTL
+        key = (bucket_name, path, expires_in)
+        url = _signed_urls.get(key)
+        if url is not None:
+            return url
+        try:
+            result = supabase.storage.from_(bucket_name).create_signed_url(
+                _strip_bucket(path, bucket_name), expires_in
+            )
+            url = result.get("signedURL") or result.get("signedUrl")
+            if url:
+                # Keep a safety margin so a cached URL never reaches the browser expired
+                margin = min(SIGNED_URL_MARGIN, expires_in // 2)
+                _signed_urls.set(key, url, time.time() + expires_in - margin)
+                return url
+        except Exception as e:
+            print(f"Error creating signed URL: {e}")
+    
+    return f"/static/{path}"
+
 def get_file_url(path):
     """
     Helper to get file URL - determines bucket from path
@@ -155,7 +246,9 @@ def get_file_url(path):
     
     # Extract bucket name from path
     if '/' in path:
-        bucket = path.split('/')[0]
+        bucket = path.split('/', 1)[0]
+        if bucket in PRIVATE_BUCKETS:
+            return get_signed_url(path, bucket)
         return get_public_url(path, bucket)
     
     return f"/static/{path}"
@@ -174,9 +267,13 @@ def delete_file(path, bucket_name):
     if not path:
         return False
     
+    _public_urls.pop((bucket_name, path))
+    # Signed URLs are cached per lifetime: (bucket, path, expires_in)
+    _signed_urls.pop_matching(lambda key: key[:2] == (bucket_name, path))
+    
     if SUPABASE_ENABLED and supabase:
         try:
-            clean_path = path.replace(f"{bucket_name}/", "")
+            clean_path = _strip_bucket(path, bucket_name)
             supabase.storage.from_(bucket_name).remove([clean_path])
             return True
         except Exception as e:
@@ -194,6 +291,96 @@ def delete_file(path, bucket_name):
     
     return False
 
+def download_file(path, bucket_name):
+    """
+    Read a stored file's bytes (Supabase or local)
+    
+    Args:
+        path: File path in bucket
+        bucket_name: Name of the storage bucket
+    
+    Returns:
+        bytes: File contents, or None if it could not be read
+    """
+    if not path:
+        return None
+    
+    if SUPABASE_ENABLED and supabase:
+        try:
+            return supabase.storage.from_(bucket_name).download(_strip_bucket(path, bucket_name))
+        except Exception as e:
+            print(f"Download error: {e}")
+            return None
+    
+    try:
+        with open(os.path.join("static", path), "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+def _parse_timestamp(value):
+    """Parse an ISO timestamp from the Supabase API into epoch seconds"""
+    from datetime import datetime
+    if not value:
+        return 0.0
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return 0.0
+
+def list_files(bucket_name, local_folder="static", page_size=1000):
+    """
+    Stream every file stored in a bucket (or its local folder)
+    
+    Args:
+        bucket_name: Name of the storage bucket
+        local_folder: Fallback local folder if Supabase not configured
+        page_size: Objects fetched per Supabase list call
+    
+    Yields:
+        tuple: (path, size_in_bytes, modified_epoch) with path like "avatars/123_image.jpg"
+    """
+    if SUPABASE_ENABLED and supabase:
+        bucket = supabase.storage.from_(bucket_name)
+        pending = [""]
+        while pending:
+            folder = pending.pop()
+            offset = 0
+            while True:
+                items = bucket.list(folder, {"limit": page_size, "offset": offset,
+                                             "sortBy": {"column": "name", "order": "asc"}})
+                for item in items:
+                    name = f"{folder}/{item['name']}" if folder else item["name"]
+                    if item.get("id") is None:
+                        # Folders have no object id
+                        pending.append(name)
+                        continue
+                    metadata = item.get("metadata") or {}
+                    modified = _parse_timestamp(item.get("updated_at") or item.get("created_at"))
+                    yield f"{bucket_name}/{name}", int(metadata.get("size") or 0), modified
+                if len(items) < page_size:
+                    break
+                offset += page_size
+        return
+    
+    # Local storage - walk the folder without building a full listing
+    base = os.path.join(local_folder, bucket_name)
+    pending = [base]
+    while pending:
+        directory = pending.pop()
+        try:
+            entries = os.scandir(directory)
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat()
+                    rel = os.path.relpath(entry.path, local_folder).replace(os.sep, "/")
+                    yield rel, stat.st_size, stat.st_mtime
+
 # Helper functions for specific buckets
 def upload_avatar(file):
     """Upload avatar to avatars bucket"""
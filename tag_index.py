@@ -0,0 +1,154 @@
+"""
+Tag Index
+Normalized post tags with an integer vocabulary, and interest scoring for the feed
+A post scores one point per user interest that is a substring of one of its
+tags (or the other way round), matching the original string comparison
+"""
+import threading
+
+from cache import LRUCache
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Below this many (post, tag) pairs the pure-Python path is faster than NumPy setup
+NUMPY_MIN_PAIRS = 2000
+
+# interest -> (highest tag id checked, frozenset of matching tag ids)
+_expansions = LRUCache(4096)
+_expansion_lock = threading.Lock()
+
+
+def parse_tags(text):
+    """ "Music, Games ,," -> ["music", "games"] (same normalization the feed always used)"""
+    return [t.strip() for t in (text or "").lower().split(",") if t.strip()]
+
+
+def tag_matches(interest, tag):
+    return interest in tag or tag in interest
+
+
+def index_post_tags(conn, post_id, tags_text):
+    """Add a post's tags to the vocabulary and link them in post_tags"""
+    names = sorted(set(parse_tags(tags_text)))
+    if not names:
+        return
+    conn.executemany("INSERT OR IGNORE INTO tags (name) VALUES (?)", [(n,) for n in names])
+    placeholders = ','.join('?' for _ in names)
+    conn.execute(f"""
+        INSERT OR IGNORE INTO post_tags (post_id, tag_id)
+        SELECT ?, id FROM tags WHERE name IN ({placeholders})
+    """, [post_id] + names)
+
+
+def backfill_post_tags(conn):
+    """Index every post that has tags (used when post_tags is first created)"""
+    rows = conn.execute("SELECT id, tags FROM posts WHERE tags IS NOT NULL AND tags != ''").fetchall()
+    for post_id, tags_text in rows:
+        index_post_tags(conn, post_id, tags_text)
+    return len(rows)
+
+
+def get_post_tag_ids(conn, post_ids):
+    """{post_id: [tag ids]} for many posts, batched"""
+    post_ids = list(post_ids)
+    result = {}
+    for i in range(0, len(post_ids), 500):
+        chunk = post_ids[i:i + 500]
+        placeholders = ','.join('?' for _ in chunk)
+        for post_id, tag_id in conn.execute(
+            f"SELECT post_id, tag_id FROM post_tags WHERE post_id IN ({placeholders})", chunk
+        ):
+            result.setdefault(post_id, []).append(tag_id)
+    return result
+
+
+def expand_interests(conn, interests):
+    """
+    Precomputed tag-id set for each interest: every vocabulary tag it matches.
+
+    Expansions are cached per interest string and extended incrementally with
+    tags added since (the vocabulary only grows), so a request normally costs
+    one MAX(id) lookup.
+    """
+    if not interests:
+        return []
+    head = conn.execute("SELECT COALESCE(MAX(id), 0) FROM tags").fetchone()[0]
+
+    cached = {}
+    stale_from = head
+    for interest in set(interests):
+        entry = _expansions.get(interest) or (0, frozenset())
+        cached[interest] = entry
+        stale_from = min(stale_from, entry[0])
+
+    if stale_from < head:
+        new_tags = conn.execute("SELECT id, name FROM tags WHERE id > ?", (stale_from,)).fetchall()
+        with _expansion_lock:
+            for interest, (checked, ids) in cached.items():
+                if checked >= head:
+                    continue
+                added = {tag_id for tag_id, name in new_tags
+                         if tag_id > checked and tag_matches(interest, name)}
+                entry = (head, ids | added)
+                cached[interest] = entry
+                _expansions.set(interest, entry)
+
+    return [cached[interest][1] for interest in interests]
+
+
+def _interest_masks(interest_sets):
+    """tag id -> bitmask of the interests it satisfies"""
+    masks = {}
+    for bit, tag_ids in enumerate(interest_sets):
+        for tag_id in tag_ids:
+            masks[tag_id] = masks.get(tag_id, 0) | (1 << bit)
+    return masks
+
+
+def score_posts(post_tag_ids, interest_sets):
+    """
+    Interest score for each candidate post.
+
+    Args:
+        post_tag_ids: list of tag-id iterables, one per post
+        interest_sets: expand_interests() output for the viewer
+
+    Returns:
+        list[int]: number of interests each post matches
+    """
+    if not interest_sets:
+        return [0] * len(post_tag_ids)
+    masks = _interest_masks(interest_sets)
+    if not masks:
+        return [0] * len(post_tag_ids)
+
+    pairs = sum(len(tags) for tags in post_tag_ids)
+    if NUMPY_AVAILABLE and len(interest_sets) <= 64 and pairs >= NUMPY_MIN_PAIRS:
+        return _score_numpy(post_tag_ids, masks)
+
+    scores = []
+    for tags in post_tag_ids:
+        combined = 0
+        for tag_id in tags:
+            combined |= masks.get(tag_id, 0)
+        scores.append(bin(combined).count("1"))
+    return scores
+
+
+def _score_numpy(post_tag_ids, masks):
+    """OR the per-tag masks of each post with reduceat, then popcount"""
+    lengths = np.fromiter((len(tags) for tags in post_tag_ids), dtype=np.int64, count=len(post_tag_ids))
+    flat = np.fromiter((masks.get(t, 0) for tags in post_tag_ids for t in tags),
+                       dtype=np.uint64, count=int(lengths.sum()))
+    scores = np.zeros(len(post_tag_ids), dtype=np.int64)
+    has_tags = lengths > 0
+    if flat.size:
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))[has_tags]
+        combined = np.bitwise_or.reduceat(flat, offsets)
+        bits = np.unpackbits(combined.view(np.uint8).reshape(-1, 8), axis=1)
+        scores[has_tags] = bits.sum(axis=1)
+    return scores.tolist()
@@ -0,0 +1,80 @@
+"""
+Background Tasks
+Runs slow work (file parsing, cleanup, fan-out) off the request thread
+Each lane is an in-memory FIFO queue drained by its own daemon worker per process
+"""
+import os
+import queue
+import threading
+import traceback
+
+# Run tasks inline instead of on the worker (useful for CLI commands and debugging)
+TASKS_EAGER = os.environ.get("TASKS_EAGER") == "1"
+
+# Quick jobs (settlement, fan-out, metadata) share the default lane; long
+# throttled jobs (account purges) go to the slow lane so they never queue ahead of them
+DEFAULT_LANE = "default"
+SLOW_LANE = "slow"
+
+_queues = {DEFAULT_LANE: queue.Queue(), SLOW_LANE: queue.Queue()}
+_workers = {}
+_worker_lock = threading.Lock()
+
+
+def _execute(func, args, kwargs):
+    try:
+        func(*args, **kwargs)
+    except Exception as e:
+        print(f"❌ Background task {getattr(func, '__name__', func)} failed: {e}")
+        traceback.print_exc()
+
+
+def _run(lane_queue):
+    while True:
+        func, args, kwargs = lane_queue.get()
+        try:
+            _execute(func, args, kwargs)
+        finally:
+            lane_queue.task_done()
+
+
+def _ensure_worker(lane):
+    worker = _workers.get(lane)
+    if worker is not None and worker.is_alive():
+        return
+    with _worker_lock:
+        worker = _workers.get(lane)
+        if worker is None or not worker.is_alive():
+            name = "fanvy-tasks" if lane == DEFAULT_LANE else f"fanvy-tasks-{lane}"
+            worker = threading.Thread(target=_run, args=(_queues[lane],), name=name, daemon=True)
+            worker.start()
+            _workers[lane] = worker
+
+
+def _enqueue(lane, func, args, kwargs):
+    if TASKS_EAGER:
+        _execute(func, args, kwargs)
+        return
+    _ensure_worker(lane)
+    _queues[lane].put((func, args, kwargs))
+
+
+def enqueue(func, *args, **kwargs):
+    """Schedule func(*args, **kwargs) on the background worker"""
+    _enqueue(DEFAULT_LANE, func, args, kwargs)
+
+
+def enqueue_slow(func, *args, **kwargs):
+    """Schedule a long-running func(*args, **kwargs) on the slow lane's worker"""
+    _enqueue(SLOW_LANE, func, args, kwargs)
+
+
+def wait():
+    """Block until every queued task has finished"""
+    for lane_queue in _queues.values():
+        lane_queue.join()
+
+
+def pending():
+    """Number of tasks waiting to run"""
+    return sum(lane_queue.qsize() for lane_queue in _queues.values())
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    """app.py bootstrapped against a fresh users.db in a temporary directory"""
+    monkeypatch.chdir(tmp_path)
+    import app
+    monkeypatch.setattr(app, "_bootstrapped", False)
+    # Process-wide caches would carry rows over from another test's database
+    app.social_graph.graphs.clear()
+    app.POST_CARD_CACHE.clear()
+    app.app.config["TESTING"] = True
+    app.bootstrap(precompile=False)
+    return app
+
+
+@pytest.fixture
+def login(app_module):
+    """Test client signed in as the given user id"""
+    def client_for(user_id):
+        client = app_module.app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = user_id
+        return client
+    return client_for
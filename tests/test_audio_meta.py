@@ -0,0 +1,30 @@
+import pytest
+
+import audio_meta
+
+# MPEG-1 Layer III, 128 kbit/s, 44.1 kHz, no CRC, stereo: 417-byte frames
+FRAME_HEADER = b"\xff\xfb\x90\x44"
+FRAME_LENGTH = 417
+FRAMES = 40
+
+
+def write_mp3(path, frames=FRAMES, tail=b""):
+    frame = FRAME_HEADER + bytes(FRAME_LENGTH - 4)
+    path.write_bytes(frame * frames + tail)
+    return str(path)
+
+
+def test_complete_file(tmp_path):
+    meta = audio_meta.read_metadata(write_mp3(tmp_path / "full.mp3"))
+    assert meta["format"] == "mp3"
+    assert meta["duration"] == pytest.approx(FRAMES * 1152 / 44100, abs=0.001)
+
+
+def test_truncated_final_frame_keeps_metadata(tmp_path):
+    # The last frame is cut inside its side info
+    path = write_mp3(tmp_path / "cut.mp3", tail=FRAME_HEADER + bytes(6))
+    meta = audio_meta.read_metadata(path)
+    assert meta is not None
+    assert meta["duration"] == pytest.approx(FRAMES * 1152 / 44100, rel=0.01)
+    assert meta["bitrate"] == pytest.approx(128000, rel=0.01)
+    assert meta["waveform"] is not None
@@ -0,0 +1,101 @@
+"""
+Query budget of the public profile: one header query plus one query per
+section, whatever the number of posts on the page.
+"""
+import sys
+
+import pytest
+
+SECTION_ROWS = 25
+
+
+@pytest.fixture
+def seeded(app_module):
+    conn = app_module.get_db_connection()
+    for name, private in (("alice", 0), ("bob", 0), ("carol", 1), ("dave", 0)):
+        conn.execute(
+            "INSERT INTO users (username, email, password, is_private) VALUES (?, ?, 'x', ?)",
+            (name, f"{name}@example.com", private)
+        )
+    for i in range(SECTION_ROWS):
+        conn.execute("INSERT INTO posts (user_id, content, created_at) VALUES (1, ?, datetime('now', ?))",
+                     (f"forum {i}", f"-{i} minutes"))
+        conn.execute("INSERT INTO profile_posts (user_id, content, created_at) VALUES (1, ?, datetime('now', ?))",
+                     (f"profile {i}", f"-{i} minutes"))
+        conn.execute("INSERT INTO stories (user_id, image, expires_at) VALUES (1, ?, datetime('now', '+1 day'))",
+                     (f"story{i}.jpg",))
+    # bob and carol are friends; dave is a stranger to carol
+    conn.execute("INSERT INTO friendships (user_id, friend_id, status) VALUES (2, 3, 'accepted')")
+    conn.commit()
+    conn.close()
+    return app_module
+
+
+@pytest.fixture
+def route_queries(seeded, monkeypatch):
+    """Statements per connection the given view function opens, in order"""
+    counts = {}
+    original = seeded.get_db_connection
+
+    def counting():
+        conn = original()
+        opener = sys._getframe(1).f_code.co_name
+        statements = counts.setdefault(opener, [])
+        statements.append(0)
+        index = len(statements) - 1
+
+        def trace(_sql):
+            statements[index] += 1
+        conn.set_trace_callback(trace)
+        return conn
+
+    monkeypatch.setattr(seeded, "get_db_connection", counting)
+    return counts
+
+
+def budget(app):
+    return 1 + len(app.PROFILE_SECTIONS)
+
+
+def test_profile_page_stays_within_budget(seeded, route_queries, login):
+    response = login(2).get("/profile/1")
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert html.count('class="post-card"') == 2 * seeded.PROFILE_SECTION_LIMIT
+    assert route_queries["view_user_profile"] == [budget(seeded)]
+
+
+def test_private_profile_for_friend_stays_within_budget(seeded, route_queries, login):
+    response = login(2).get("/profile/3")
+    assert response.status_code == 200
+    assert route_queries["view_user_profile"] == [budget(seeded)]
+
+
+def test_restricted_profile_is_one_query(seeded, route_queries, login):
+    response = login(4).get("/profile/3")
+    assert response.status_code == 200
+    assert route_queries["view_user_profile"] == [1]
+
+
+def test_more_pages_are_constant_per_page(seeded, route_queries, login):
+    client = login(2)
+    cursor = client.get("/profile/1/more/profile_posts").get_json()["next_cursor"]
+    seen = 0
+    while cursor:
+        page = client.get("/profile/1/more/profile_posts", query_string={"cursor": cursor}).get_json()
+        seen += page["html"].count('class="post-card"')
+        cursor = page["next_cursor"]
+    assert seen == SECTION_ROWS - seeded.PROFILE_SECTION_LIMIT
+    pages = route_queries["profile_section_page"]
+    assert pages and set(pages) == {2}
+
+
+def test_more_on_private_profile(seeded, route_queries, login):
+    assert login(4).get("/profile/3/more/forum_posts").status_code == 403
+    assert login(2).get("/profile/3/more/forum_posts").status_code == 200
+    denied, allowed = route_queries["profile_section_page"]
+    # Both load the viewer's (cold) social graph; only the friend gets the section query
+    assert allowed == denied + 1
+    # Once the graph is cached a page is the user lookup plus the section
+    assert login(2).get("/profile/3/more/forum_posts").status_code == 200
+    assert route_queries["profile_section_page"][-1] == 2
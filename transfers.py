@@ -0,0 +1,181 @@
+"""
+Peer-to-Peer Transfers
+Money sent in chat is queued and settled in batches by a single worker
+
+A transfer request is one small INSERT into pending_transfers (plus the chat
+message that carries it). The requester holds the write lock only for those
+inserts and never moves balances, so sending money costs about the same as
+sending a message.
+
+settle_batch() takes the next TRANSFER_BATCH pending transfers in id order
+inside one BEGIN IMMEDIATE transaction. It reads the balances involved once,
+applies the transfers in order in memory, and writes everything back with one
+executemany per table: balances, ledger journals, transactions, transfer
+statuses and the chat messages' money_status. Because transfers run in id
+order, a sender's later transfer sees the effect of their earlier ones. A
+transfer the sender can no longer cover is marked failed and moves no money.
+"""
+import ledger
+from wallet_service import clean_key
+
+TRANSFER_BATCH = 500
+
+PENDING = "pending"
+SETTLED = "settled"
+FAILED = "failed"
+
+
+class TransferError(ValueError):
+    pass
+
+
+def create_tables(conn):
+    """pending_transfers and its queue index (idempotent)"""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS pending_transfers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sender_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+        receiver_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+        amount INTEGER NOT NULL,
+        message_id INTEGER REFERENCES messages(id) ON DELETE SET NULL,
+        idempotency_key TEXT,
+        status TEXT DEFAULT 'pending',
+        failure_reason TEXT,
+        journal_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        settled_at TIMESTAMP,
+        UNIQUE(sender_id, idempotency_key)
+    )""")
+    # The queue: only pending rows, in settlement order
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_pending_transfers_queue
+        ON pending_transfers(id) WHERE status = 'pending'
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pending_transfers_receiver ON pending_transfers(receiver_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pending_transfers_message ON pending_transfers(message_id)")
+
+
+def request_transfer(conn, sender_id, receiver_id, amount, message_id=None, key=None):
+    """
+    Queue a transfer. Runs in the caller's transaction (commit it together
+    with the chat message).
+
+    Args:
+        conn: database connection
+        sender_id, receiver_id: the two wallets
+        amount: positive amount in currency units
+        message_id: chat message whose money_status follows the transfer
+        key: optional idempotency key; a repeat returns the first transfer
+
+    Returns:
+        dict: the transfer's id, status and whether it was already queued
+    """
+    cents = ledger.to_minor(amount)
+    if cents <= 0:
+        raise TransferError("amount must be positive")
+    if sender_id == receiver_id:
+        raise TransferError("cannot send money to yourself")
+    replay = find_replay(conn, sender_id, key)
+    if replay is not None:
+        return replay
+    transfer_id = conn.execute("""
+        INSERT INTO pending_transfers (sender_id, receiver_id, amount, message_id, idempotency_key)
+        VALUES (?, ?, ?, ?, ?)
+    """, (sender_id, receiver_id, cents, message_id, clean_key(key))).lastrowid
+    return {"id": transfer_id, "status": PENDING, "message_id": message_id, "replayed": False}
+
+
+def find_replay(conn, sender_id, key):
+    """The transfer already queued under (sender_id, key), as request_transfer() returns it, or None"""
+    key = clean_key(key)
+    if key is None:
+        return None
+    row = conn.execute(
+        "SELECT id, status, message_id FROM pending_transfers WHERE sender_id=? AND idempotency_key=?",
+        (sender_id, key)
+    ).fetchone()
+    if row is None:
+        return None
+    return {"id": row[0], "status": row[1], "message_id": row[2], "replayed": True}
+
+
+def settle_batch(conn, limit=TRANSFER_BATCH):
+    """
+    Settle up to `limit` pending transfers in one transaction.
+
+    Returns:
+        tuple: (settled, failed) counts; (0, 0) once the queue is empty
+    """
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        queue = conn.execute("""
+            SELECT id, sender_id, receiver_id, amount, message_id FROM pending_transfers
+            WHERE status = 'pending' ORDER BY id LIMIT ?
+        """, (limit,)).fetchall()
+        if not queue:
+            conn.rollback()
+            return 0, 0
+
+        # A party whose account was deleted is NULL (the transfer itself is kept)
+        user_ids = sorted(({t[1] for t in queue} | {t[2] for t in queue}) - {None})
+        placeholders = ",".join("?" for _ in user_ids)
+        # Wallets of accounts being deleted are already closed on the ledger
+        balances = dict(conn.execute(f"""
+            SELECT id, wallet_cents FROM users
+            WHERE id IN ({placeholders}) AND id NOT IN (SELECT user_id FROM account_deletions)
+        """, user_ids).fetchall())
+
+        settled, failed, journals, history = [], [], [], []
+        for transfer_id, sender, receiver, cents, message_id in queue:
+            if sender not in balances or receiver not in balances:
+                failed.append((transfer_id, message_id, "account_closed"))
+            elif balances[sender] < cents:
+                failed.append((transfer_id, message_id, "insufficient_funds"))
+            else:
+                balances[sender] -= cents
+                balances[receiver] += cents
+                settled.append((transfer_id, message_id))
+                journals.append(("transfer", f"Transfer #{transfer_id}",
+                                 [(ledger.WALLET, sender, -cents), (ledger.WALLET, receiver, cents)]))
+                history.append((sender, "transfer_out", -ledger.to_major(cents), f"Sent to user #{receiver}"))
+                history.append((receiver, "transfer_in", ledger.to_major(cents), f"Received from user #{sender}"))
+
+        touched = {user_id for journal in journals for _, user_id, _ in journal[2]}
+        conn.executemany(
+            "UPDATE users SET wallet_cents=?, wallet_balance=? WHERE id=?",
+            [(balances[u], ledger.to_major(balances[u]), u) for u in sorted(touched)]
+        )
+        journal_ids = ledger.post_many(conn, journals)
+        conn.executemany(
+            "INSERT INTO transactions (user_id, type, amount, description) VALUES (?, ?, ?, ?)", history
+        )
+        conn.executemany(
+            "UPDATE pending_transfers SET status='settled', journal_id=?, settled_at=CURRENT_TIMESTAMP WHERE id=?",
+            [(journal_id, t[0]) for journal_id, t in zip(journal_ids, settled)]
+        )
+        conn.executemany(
+            "UPDATE pending_transfers SET status='failed', failure_reason=?, settled_at=CURRENT_TIMESTAMP WHERE id=?",
+            [(reason, transfer_id) for transfer_id, _, reason in failed]
+        )
+        statuses = ([(SETTLED, m) for _, m in settled if m is not None]
+                    + [(FAILED, m) for _, m, _ in failed if m is not None])
+        if statuses:
+            conn.executemany("UPDATE messages SET money_status=? WHERE id=?", statuses)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return len(settled), len(failed)
+
+
+def settle_all(conn, limit=TRANSFER_BATCH):
+    """Settle batches until the queue is empty. Returns (settled, failed) totals"""
+    totals = [0, 0]
+    while True:
+        settled, failed = settle_batch(conn, limit)
+        if not settled and not failed:
+            return tuple(totals)
+        totals[0] += settled
+        totals[1] += failed
@@ -0,0 +1,250 @@
+"""
+Wallet Service
+Debits, credits, checkout and subscription purchases as single atomic transactions
+
+Every operation opens its transaction with BEGIN IMMEDIATE, so it holds the
+database's write lock from the start. Concurrent operations queue on the busy
+timeout instead of failing with "database is locked" when a deferred read
+transaction tries to upgrade to a write. Balances only move through
+conditional UPDATEs (`... WHERE wallet_cents >= ?`), so the funds check and
+the debit are one statement and no read-modify-write can lose an update.
+
+Amounts are handled in integer cents. Each operation also posts a balanced
+journal to the ledger (see ledger.py) and adds the user-facing row to
+transactions, in the same transaction as the balance change. wallet_balance
+is kept equal to wallet_cents / 100 for the templates and exports.
+
+Operations may carry an idempotency key (one per submitted form). The first
+successful run records its outcome in wallet_operations inside the same
+transaction. A double-submit or retry with that key returns the recorded
+outcome and moves no money. Failed attempts record nothing, so they can be
+retried after a top-up.
+"""
+import json
+from contextlib import contextmanager
+
+import ledger
+
+IDEMPOTENCY_KEY_MAX = 64
+
+
+class WalletError(Exception):
+    """Base class for refused wallet operations"""
+
+
+class InsufficientFunds(WalletError):
+    pass
+
+
+class AlreadySubscribed(WalletError):
+    pass
+
+
+class EmptyCart(WalletError):
+    pass
+
+
+@contextmanager
+def immediate(conn):
+    """
+    Run the enclosed statements in one BEGIN IMMEDIATE transaction on `conn`,
+    committing on success and rolling back on any exception.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def clean_key(key):
+    """Client-supplied idempotency key, or None if it is missing or unusable"""
+    if not key:
+        return None
+    key = str(key).strip()
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX:
+        return None
+    return key
+
+
+def _replay(conn, user_id, key, operation):
+    """Recorded outcome of an earlier run of (user_id, key), or None"""
+    if key is None:
+        return None
+    row = conn.execute(
+        "SELECT operation, result FROM wallet_operations WHERE user_id=? AND idempotency_key=?",
+        (user_id, key)
+    ).fetchone()
+    if row is None:
+        return None
+    if row[0] != operation:
+        raise WalletError(f"idempotency key already used for {row[0]}")
+    result = json.loads(row[1])
+    result["replayed"] = True
+    return result
+
+
+def _record(conn, user_id, key, operation, result):
+    if key is not None:
+        conn.execute(
+            "INSERT INTO wallet_operations (user_id, idempotency_key, operation, result) VALUES (?, ?, ?, ?)",
+            (user_id, key, operation, json.dumps(result))
+        )
+    return dict(result, replayed=False)
+
+
+def _debit(conn, user_id, cents):
+    """Take `cents` from the balance in one statement; InsufficientFunds if it can't be covered"""
+    cur = conn.execute("""
+        UPDATE users SET wallet_cents = wallet_cents - ?1, wallet_balance = (wallet_cents - ?1) / 100.0
+        WHERE id=?2 AND wallet_cents >= ?1
+    """, (cents, user_id))
+    if cur.rowcount == 0:
+        raise InsufficientFunds(f"user {user_id} cannot cover {cents} cents")
+
+
+def _credit(conn, user_id, cents):
+    conn.execute("""
+        UPDATE users SET wallet_cents = wallet_cents + ?1, wallet_balance = (wallet_cents + ?1) / 100.0
+        WHERE id=?2
+    """, (cents, user_id))
+
+
+def _balance(conn, user_id):
+    row = conn.execute("SELECT wallet_cents FROM users WHERE id=?", (user_id,)).fetchone()
+    return ledger.to_major(row[0]) if row else 0.0
+
+
+def _transaction(conn, user_id, tx_type, amount, description):
+    return conn.execute(
+        "INSERT INTO transactions (user_id, type, amount, description) VALUES (?, ?, ?, ?)",
+        (user_id, tx_type, amount, description)
+    ).lastrowid
+
+
+def debit(conn, user_id, amount, tx_type, description, account=None, key=None):
+    """
+    Take money from a wallet and record the transaction.
+
+    Args:
+        conn: database connection (must not be inside another transaction's work)
+        user_id: wallet owner
+        amount: positive amount to take, in currency units
+        tx_type: transactions.type to record
+        description: transactions.description to record
+        account: ledger account credited with the money (defaults to tx_type)
+        key: optional idempotency key
+
+    Returns:
+        dict: balance after the debit, transaction id and whether it was a replay
+
+    Raises:
+        InsufficientFunds: the balance is lower than `amount`
+    """
+    operation = f"debit:{tx_type}"
+    with immediate(conn):
+        replay = _replay(conn, user_id, key, operation)
+        if replay is not None:
+            return replay
+        cents = ledger.to_minor(amount)
+        _debit(conn, user_id, cents)
+        ledger.post(conn, tx_type, description,
+                    [(ledger.WALLET, user_id, -cents), (account or tx_type, None, cents)])
+        tx_id = _transaction(conn, user_id, tx_type, -ledger.to_major(cents), description)
+        return _record(conn, user_id, key, operation, {
+            "balance": _balance(conn, user_id), "transaction_id": tx_id,
+        })
+
+
+def credit(conn, user_id, amount, tx_type, description, account=None, key=None):
+    """Add money to a wallet and record the transaction (see debit)"""
+    operation = f"credit:{tx_type}"
+    with immediate(conn):
+        replay = _replay(conn, user_id, key, operation)
+        if replay is not None:
+            return replay
+        cents = ledger.to_minor(amount)
+        _credit(conn, user_id, cents)
+        ledger.post(conn, tx_type, description,
+                    [(ledger.WALLET, user_id, cents), (account or tx_type, None, -cents)])
+        tx_id = _transaction(conn, user_id, tx_type, ledger.to_major(cents), description)
+        return _record(conn, user_id, key, operation, {
+            "balance": _balance(conn, user_id), "transaction_id": tx_id,
+        })
+
+
+def checkout(conn, user_id, product_ids, key=None):
+    """
+    Buy every product in the cart: one debit for the total, one transaction
+    and one purchases row per product, all or nothing.
+
+    Prices are read inside the transaction, so a concurrent price change or
+    product removal can't be charged differently from what is recorded.
+    Products that no longer exist are skipped.
+
+    Raises:
+        EmptyCart: none of the products exist any more
+        InsufficientFunds: the balance doesn't cover the total
+    """
+    with immediate(conn):
+        replay = _replay(conn, user_id, key, "checkout")
+        if replay is not None:
+            return replay
+        products = []
+        if product_ids:
+            placeholders = ",".join("?" for _ in product_ids)
+            products = conn.execute(
+                f"SELECT id, price FROM products WHERE id IN ({placeholders})", list(product_ids)
+            ).fetchall()
+        if not products:
+            raise EmptyCart()
+        cents = sum(ledger.to_minor(p[1] or 0) for p in products)
+        description = f"Purchased {len(products)} product(s)"
+        _debit(conn, user_id, cents)
+        ledger.post(conn, "purchase", description, [(ledger.WALLET, user_id, -cents), (ledger.SHOP, None, cents)])
+        tx_id = _transaction(conn, user_id, "purchase", -ledger.to_major(cents), description)
+        conn.executemany(
+            "INSERT INTO purchases (user_id, product_id, purchased_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
+            [(user_id, p[0]) for p in products]
+        )
+        return _record(conn, user_id, key, "checkout", {
+            "balance": _balance(conn, user_id), "transaction_id": tx_id,
+            "total": ledger.to_major(cents), "products": [p[0] for p in products],
+        })
+
+
+def buy_subscription(conn, user_id, plan, price, key=None):
+    """
+    Switch a user to `plan` and charge `price`, in one conditional UPDATE.
+
+    Raises:
+        AlreadySubscribed: the user is already on `plan`
+        InsufficientFunds: the balance doesn't cover `price`
+    """
+    operation = f"subscription:{plan}"
+    with immediate(conn):
+        replay = _replay(conn, user_id, key, operation)
+        if replay is not None:
+            return replay
+        cents = ledger.to_minor(price)
+        cur = conn.execute("""
+            UPDATE users SET wallet_cents = wallet_cents - ?1, wallet_balance = (wallet_cents - ?1) / 100.0,
+                             subscription = ?2
+            WHERE id=?3 AND wallet_cents >= ?1 AND subscription IS NOT ?2
+        """, (cents, plan, user_id))
+        if cur.rowcount == 0:
+            row = conn.execute("SELECT subscription FROM users WHERE id=?", (user_id,)).fetchone()
+            if row is not None and row[0] == plan:
+                raise AlreadySubscribed(plan)
+            raise InsufficientFunds(f"user {user_id} cannot cover {price}")
+        description = f"Purchased {plan.capitalize()} subscription"
+        ledger.post(conn, "subscription", description,
+                    [(ledger.WALLET, user_id, -cents), (ledger.SUBSCRIPTIONS, None, cents)])
+        tx_id = _transaction(conn, user_id, "subscription", -ledger.to_major(cents), description)
+        return _record(conn, user_id, key, operation, {
+            "balance": _balance(conn, user_id), "transaction_id": tx_id, "plan": plan,
+        })